@@ -0,0 +1,227 @@
+import math
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import alerts
+import partitions
+from timestamps import epoch_second
+
+# Log-bucketed histogram for quantiles: every value in a bin lies within
+# (gamma - 1) / (gamma + 1), about 1%, of the bin's representative value.
+SKETCH_GAMMA = 1.02
+_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+QUANTILE = 0.95
+
+
+def _sketch_key(value: float) -> float:
+    if value == 0:
+        return 0.0
+    idx = math.ceil(math.log(abs(value)) / _LOG_GAMMA)
+    rep = 2 * SKETCH_GAMMA ** idx / (SKETCH_GAMMA + 1)
+    return rep if value > 0 else -rep
+
+
+class _Second:
+    __slots__ = ("count", "total", "vmin", "vmax", "sketch")
+
+    def __init__(self, sketch: bool) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.vmin = math.inf
+        self.vmax = -math.inf
+        self.sketch: Optional[Counter] = Counter() if sketch else None
+
+
+class MetricWindow:
+    """Per-second count/sum/min/max (and optionally a sketch) for one metric."""
+
+    def __init__(self, span: int, sketch: bool) -> None:
+        self.span = span
+        self.sketch = sketch
+        self.seconds: Dict[int, _Second] = {}
+
+    def _slot(self, second: int) -> _Second:
+        slot = self.seconds.get(second)
+        if slot is None:
+            slot = self.seconds[second] = _Second(self.sketch)
+        return slot
+
+    def add(self, second: int, value: float) -> None:
+        slot = self._slot(second)
+        slot.count += 1
+        slot.total += value
+        if value < slot.vmin:
+            slot.vmin = value
+        if value > slot.vmax:
+            slot.vmax = value
+        if slot.sketch is not None:
+            slot.sketch[_sketch_key(value)] += 1
+
+    def add_summary(self, second: int, count: int, total: float, vmin: float, vmax: float) -> None:
+        slot = self._slot(second)
+        slot.count += count
+        slot.total += total
+        slot.vmin = min(slot.vmin, vmin)
+        slot.vmax = max(slot.vmax, vmax)
+
+    def prune(self, now: int) -> None:
+        cutoff = now - self.span
+        for second in [s for s in self.seconds if s < cutoff]:
+            del self.seconds[second]
+
+    def summary(self, since: int) -> Tuple[int, float, float, float]:
+        count, total, vmin, vmax = 0, 0.0, math.inf, -math.inf
+        for second, slot in self.seconds.items():
+            if second >= since:
+                count += slot.count
+                total += slot.total
+                vmin = min(vmin, slot.vmin)
+                vmax = max(vmax, slot.vmax)
+        return count, total, vmin, vmax
+
+    def quantile(self, since: int, q: float) -> Optional[float]:
+        merged: Counter = Counter()
+        for second, slot in self.seconds.items():
+            if second >= since and slot.sketch:
+                merged.update(slot.sketch)
+        n = sum(merged.values())
+        if not n:
+            return None
+        rank = max(math.ceil(q * n), 1)
+        seen = 0
+        for key in sorted(merged):
+            seen += merged[key]
+            if seen >= rank:
+                return key
+        return None
+
+
+class StreamingAggregator:
+    """Sliding-window aggregates for the enabled alert rules, fed by ingest.
+
+    observe() takes the metric rows of each committed batch and evaluate()
+    checks rules against the in-memory windows, so alert checks never query
+    the database. Only load() reads it, to pick up rules and seed windows.
+    """
+
+    def __init__(self, quantile: float = QUANTILE) -> None:
+        self.quantile = quantile
+        self._lock = threading.Lock()
+        self._rules: List[alerts.Rule] = []
+        self._windows: Dict[str, MetricWindow] = {}
+        self._last_fired: Dict[int, float] = {}
+
+    def load(self, conn) -> None:
+        """(Re)load enabled rules and seed their windows from the database."""
+        with self._lock:
+            rules = alerts.load_rules(conn)
+            spans: Dict[str, int] = {}
+            sketches: Set[str] = set()
+            for rule in rules:
+                spans[rule.metric_name] = max(spans.get(rule.metric_name, 0), alerts.window_of(rule))
+                if rule.aggregation == "p95":
+                    sketches.add(rule.metric_name)
+            windows = {name: MetricWindow(span, name in sketches) for name, span in spans.items()}
+            now = datetime.utcnow()
+            for name, window in windows.items():
+                self._seed(conn, name, window, now)
+            self._rules = rules
+            self._windows = windows
+            live = {rule.id for rule in rules}
+            self._last_fired = {rid: t for rid, t in self._last_fired.items() if rid in live}
+
+    def _seed(self, conn, name: str, window: MetricWindow, now: datetime) -> None:
+        since = (now - timedelta(seconds=window.span)).replace(microsecond=0).isoformat()
+        if window.sketch:
+            since_us = epoch_second(since) * 1_000_000
+            for day in partitions.overlapping(conn, since):
+                # Served from the (metric_name, ts_us, metric_value) index alone.
+                rows = conn.execute(
+                    f"SELECT ts_us, metric_value FROM {partitions.table('metrics', day)}"
+                    " WHERE metric_name = ? AND ts_us >= ?",
+                    (name, since_us),
+                )
+                for ts_us, value in rows:
+                    window.add(ts_us // 1_000_000, value)
+            return
+        rows = conn.execute(
+            f"""
+            SELECT bucket, SUM(value_count), SUM(value_sum), MIN(value_min), MAX(value_max)
+            FROM {alerts.ROLLUP_TABLE}
+            WHERE metric_name = ? AND bucket >= ?
+            GROUP BY bucket
+            """,
+            (name, since),
+        )
+        for bucket, count, total, vmin, vmax in rows:
+            second = epoch_second(bucket)
+            if second is not None:
+                window.add_summary(second, count, total, vmin, vmax)
+
+    def observe(self, rows: Iterable[Tuple[str, int, float]]) -> Set[str]:
+        """Add (metric_name, ts_us, value) rows; returns the metrics touched."""
+        touched: Set[str] = set()
+        now = int(time.time())
+        with self._lock:
+            windows = self._windows
+            if not windows:
+                return touched
+            for name, ts_us, value in rows:
+                window = windows.get(name)
+                if window is None:
+                    continue
+                second = ts_us // 1_000_000
+                if second < now - window.span:
+                    continue
+                # Future timestamps count against the current second.
+                window.add(min(second, now), value)
+                touched.add(name)
+        return touched
+
+    def evaluate(
+        self, metrics: Optional[Set[str]] = None, now: Optional[float] = None
+    ) -> List[Tuple[alerts.Rule, float]]:
+        """Rules (restricted to ``metrics`` if given) whose condition holds.
+
+        A rule that fired is skipped until its cooldown has elapsed.
+        """
+        now = time.time() if now is None else now
+        now_s = int(now)
+        fired: List[Tuple[alerts.Rule, float]] = []
+        with self._lock:
+            if metrics is None:
+                for window in self._windows.values():
+                    window.prune(now_s)
+            cache: Dict[Tuple[str, int, bool], Optional[Tuple]] = {}
+            for rule in self._rules:
+                if metrics is not None and rule.metric_name not in metrics:
+                    continue
+                last = self._last_fired.get(rule.id)
+                if last is not None and now - last < alerts.cooldown_of(rule):
+                    continue
+                window = self._windows.get(rule.metric_name)
+                if window is None:
+                    continue
+                span = alerts.window_of(rule)
+                p95 = rule.aggregation == "p95"
+                key = (rule.metric_name, span, p95)
+                if key not in cache:
+                    # ``span`` one-second buckets, the current one included,
+                    # as alerts._since() selects from the rollups.
+                    since = now_s - span + 1
+                    cache[key] = (window.quantile(since, self.quantile),) if p95 else window.summary(since)
+                result = cache[key]
+                if p95:
+                    value = result[0]
+                else:
+                    value = alerts.aggregate(rule.aggregation, *result, span)
+                if value is None:
+                    continue
+                if alerts.evaluate_condition(float(value), rule.condition, float(rule.threshold)):
+                    self._last_fired[rule.id] = now
+                    fired.append((rule, value))
+        return fired
@@ -1,11 +1,16 @@
 import json
 import logging
+import math
 import smtplib
+from collections import defaultdict
 from datetime import datetime, timedelta
 from email.message import EmailMessage
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 from urllib import request
 
+import partitions
+from timestamps import utc_micros
+
 logger = logging.getLogger("loglens.alerts")
 
 
@@ -49,50 +54,228 @@ def send_email(recipient: str, payload: Dict[str, Any], smtp_host: str = "localh
         return False
 
 
-def check_rules(conn) -> List[Dict[str, Any]]:
+class Rule(NamedTuple):
+    id: int
+    metric_name: str
+    condition: str
+    threshold: float
+    window_seconds: int
+    webhook_url: Optional[str]
+    email: Optional[str]
+    aggregation: str
+    cooldown_seconds: Optional[int]
+
+
+RULE_COLUMNS = "id, metric_name, condition, threshold, window_seconds, webhook_url, email, aggregation, cooldown_seconds"
+
+AGGREGATIONS = ("avg", "min", "max", "sum", "count", "rate", "p95")
+
+ROLLUP_TABLE = "metric_rollup_1s"
+
+# Used when a rule has no cooldown_seconds; matches the old 30s poll cadence.
+DEFAULT_COOLDOWN_SECONDS = 30
+
+
+def ensure_schema(conn) -> None:
+    """Add columns introduced after the first release to alert_rules."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(alert_rules)")}
+    if "aggregation" not in columns:
+        conn.execute("ALTER TABLE alert_rules ADD COLUMN aggregation TEXT NOT NULL DEFAULT 'avg'")
+    if "cooldown_seconds" not in columns:
+        conn.execute("ALTER TABLE alert_rules ADD COLUMN cooldown_seconds INTEGER")
+    conn.commit()
+
+
+def load_rules(conn) -> List[Rule]:
+    rows = conn.execute(f"SELECT {RULE_COLUMNS} FROM alert_rules WHERE enabled = 1").fetchall()
+    return [Rule(*row) for row in rows]
+
+
+def window_of(rule: Rule) -> int:
+    return max(int(rule.window_seconds or 60), 5)
+
+
+def cooldown_of(rule: Rule) -> int:
+    if rule.cooldown_seconds is None:
+        return DEFAULT_COOLDOWN_SECONDS
+    return max(int(rule.cooldown_seconds), 0)
+
+
+def _since(now: datetime, window: int) -> str:
+    # Whole seconds, so the same cutoff selects raw rows and 1s rollup buckets:
+    # the current second and the ``window`` - 1 before it.
+    return (now - timedelta(seconds=window - 1)).replace(microsecond=0).isoformat()
+
+
+def _values_cte(keys: List[Tuple[str, str]]) -> Tuple[str, List[Any]]:
+    rows = ", ".join("(?, ?)" for _ in keys)
+    params: List[Any] = [p for key in keys for p in key]
+    return f"WITH w(metric_name, since) AS (VALUES {rows})", params
+
+
+def _summaries(conn, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Tuple[int, float, float, float]]:
+    """(metric_name, since) -> (count, sum, min, max) in one grouped rollup query."""
+    if not keys:
+        return {}
+    cte, params = _values_cte(keys)
+    rows = conn.execute(
+        f"""
+        {cte}
+        SELECT w.metric_name, w.since,
+               SUM(r.value_count), SUM(r.value_sum), MIN(r.value_min), MAX(r.value_max)
+        FROM w JOIN {ROLLUP_TABLE} r ON r.metric_name = w.metric_name AND r.bucket >= w.since
+        GROUP BY w.metric_name, w.since
+        """,
+        params,
+    ).fetchall()
+    return {(name, since): (count, total, vmin, vmax) for name, since, count, total, vmin, vmax in rows}
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    rank = max(math.ceil(pct * len(values)), 1)
+    return values[rank - 1]
+
+
+def _percentiles(conn, keys: List[Tuple[str, str]], pct: float = 0.95) -> Dict[Tuple[str, str], float]:
+    """Nearest-rank percentile per (metric_name, since) from one raw-row query.
+
+    Rows are fetched once per metric over its widest window and narrower
+    windows are cut from the same list.
+    """
+    widest: Dict[str, str] = {}
+    for name, since in keys:
+        if name not in widest or since < widest[name]:
+            widest[name] = since
+    if not widest:
+        return {}
+    # Sinces are naive UTC ISO strings; raw rows are matched on ts_us, an
+    # index-only range scan of (metric_name, ts_us, metric_value).
+    cte, params = _values_cte([(name, utc_micros(since)) for name, since in widest.items()])
+    samples: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+    for day in partitions.overlapping(conn, min(widest.values())):
+        rows = conn.execute(
+            f"""
+            {cte}
+            SELECT m.metric_name, m.ts_us, m.metric_value
+            FROM w JOIN {partitions.table('metrics', day)} m
+                ON m.metric_name = w.metric_name AND m.ts_us >= w.since
+            """,
+            params,
+        )
+        for name, ts_us, value in rows:
+            samples[name].append((ts_us, value))
+    out: Dict[Tuple[str, str], float] = {}
+    for name, since in keys:
+        since_us = utc_micros(since)
+        values = sorted(v for ts_us, v in samples.get(name, ()) if ts_us >= since_us)
+        if values:
+            out[(name, since)] = _percentile(values, pct)
+    return out
+
+
+def aggregate(aggregation: str, count: int, total: float, vmin: float, vmax: float, window: int) -> Optional[float]:
+    if not count:
+        return None
+    if aggregation == "avg":
+        return total / count
+    if aggregation == "min":
+        return vmin
+    if aggregation == "max":
+        return vmax
+    if aggregation == "sum":
+        return total
+    if aggregation == "count":
+        return float(count)
+    if aggregation == "rate":
+        return count / window
+    return None
+
+
+def evaluate_rules(conn, rules: List[Rule], now: Optional[datetime] = None) -> Dict[int, float]:
+    """Current aggregate value per rule id; rules without data are omitted.
+
+    Rules are grouped by (metric_name, window), so a cycle costs one rollup
+    query plus one raw query for p95 rules however many rules share them.
+    """
+    now = now or datetime.utcnow()
+    keyed = [(rule, (rule.metric_name, _since(now, window_of(rule)))) for rule in rules]
+    summary_keys = sorted({key for rule, key in keyed if rule.aggregation != "p95"})
+    pct_keys = sorted({key for rule, key in keyed if rule.aggregation == "p95"})
+    summaries = _summaries(conn, summary_keys)
+    pcts = _percentiles(conn, pct_keys)
+
+    values: Dict[int, float] = {}
+    for rule, key in keyed:
+        if rule.aggregation == "p95":
+            value = pcts.get(key)
+        else:
+            summary = summaries.get(key)
+            value = aggregate(rule.aggregation, *summary, window_of(rule)) if summary else None
+        if value is not None:
+            values[rule.id] = value
+    return values
+
+
+def record_alerts(conn, fired: List[Tuple[Rule, float]], notifier=None) -> List[Dict[str, Any]]:
+    """Write alert_history for rules whose condition held and notify.
+
+    With a notify.Notifier, rows are stored with notified = 0 and delivery
+    is queued; the notifier's result callback marks them later. Without one,
+    notifications are sent inline.
+    """
     cur = conn.cursor()
-    cur.execute(
-        "SELECT id, metric_name, condition, threshold, window_seconds, webhook_url, email, enabled FROM alert_rules WHERE enabled = 1"
-    )
-    rules = cur.fetchall()
     triggered: List[Dict[str, Any]] = []
+    for rule, metric_value in fired:
+        payload = {
+            "rule_id": rule.id,
+            "metric_name": rule.metric_name,
+            "aggregation": rule.aggregation,
+            "condition": rule.condition,
+            "threshold": rule.threshold,
+            "window_seconds": rule.window_seconds,
+            "metric_value": metric_value,
+            "triggered_at": datetime.utcnow().isoformat(),
+        }
+        notified = False
+        if notifier is None:
+            if rule.webhook_url:
+                notified = send_webhook(rule.webhook_url, payload) or notified
+            if rule.email:
+                notified = send_email(rule.email, payload) or notified
 
-    for rule in rules:
-        rid, metric_name, condition, threshold, window_seconds, webhook_url, email, enabled = rule
-        since = (datetime.utcnow() - timedelta(seconds=max(int(window_seconds or 60), 5))).isoformat()
         cur.execute(
-            """
-            SELECT AVG(metric_value) FROM metrics
-            WHERE metric_name = ? AND timestamp >= ?
-            """,
-            (metric_name, since),
+            "INSERT INTO alert_history (rule_id, triggered_at, metric_value, notified) VALUES (?, ?, ?, ?)",
+            (rule.id, payload["triggered_at"], float(metric_value), 1 if notified else 0),
         )
-        row = cur.fetchone()
-        metric_value = row[0] if row and row[0] is not None else None
-        if metric_value is None:
-            continue
-
-        if evaluate_condition(float(metric_value), condition, float(threshold)):
-            payload = {
-                "rule_id": rid,
-                "metric_name": metric_name,
-                "condition": condition,
-                "threshold": threshold,
-                "window_seconds": window_seconds,
-                "metric_value": metric_value,
-                "triggered_at": datetime.utcnow().isoformat(),
-            }
-            notified = False
-            if webhook_url:
-                notified = send_webhook(webhook_url, payload) or notified
-            if email:
-                notified = send_email(email, payload) or notified
-
-            cur.execute(
-                "INSERT INTO alert_history (rule_id, triggered_at, metric_value, notified) VALUES (?, ?, ?, ?)",
-                (rid, payload["triggered_at"], float(metric_value), 1 if notified else 0),
-            )
-            triggered.append(payload)
+        payload["history_id"] = cur.lastrowid
+        triggered.append((rule, payload))
+    conn.commit()
+    if notifier is not None:
+        # Queued after commit so the result callback finds the rows.
+        for rule, payload in triggered:
+            if rule.webhook_url:
+                notifier.submit("webhook", rule.webhook_url, payload, payload["history_id"])
+            if rule.email:
+                notifier.submit("email", rule.email, payload, payload["history_id"])
+    return [payload for rule, payload in triggered]
 
+
+def mark_notified(conn, history_ids: List[int]) -> None:
+    conn.executemany("UPDATE alert_history SET notified = 1 WHERE id = ?", ((i,) for i in history_ids))
     conn.commit()
-    return triggered
+
+
+def check_rules(conn) -> List[Dict[str, Any]]:
+    """Evaluate every enabled rule against the database and record hits.
+
+    The server alerts from aggregator.StreamingAggregator; this is the
+    database-backed equivalent, without cooldowns.
+    """
+    rules = load_rules(conn)
+    values = evaluate_rules(conn, rules)
+    fired = [
+        (rule, values[rule.id])
+        for rule in rules
+        if rule.id in values and evaluate_condition(float(values[rule.id]), rule.condition, float(rule.threshold))
+    ]
+    return record_alerts(conn, fired)
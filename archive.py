@@ -0,0 +1,390 @@
+import bisect
+import json
+import os
+import sqlite3
+import struct
+import sys
+import zlib
+from array import array
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import partitions
+from timestamps import iso_micros, utc_micros
+
+try:  # optional; vectorizes archive scans, the array module is the fallback
+    import numpy as np
+except ImportError:
+    np = None
+
+# Metrics of sealed days are moved out of SQLite into one compressed
+# columnar file per day: int64 epoch-microsecond timestamps (sorted, stored
+# as deltas), dictionary-encoded metric and source names, float64 values.
+# metric_archives lists the current file of every archived day; a new file
+# name is used whenever a day is rewritten so readers never see a partial one.
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS metric_archives (
+    day TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    min_ts INTEGER NOT NULL,
+    max_ts INTEGER NOT NULL,
+    archived_at TEXT NOT NULL
+);
+"""
+
+MAGIC = b"LLMA1\n"
+# column -> array typecode; sizes are checked at import so files are portable
+COLUMNS = (("ts", "q"), ("name", "i"), ("source", "i"), ("value", "d"))
+assert [array(code).itemsize for _, code in COLUMNS] == [8, 4, 4, 8]
+_NUMPY_TYPES = {"q": "<i8", "i": "<i4", "d": "<f8"}
+
+
+class Columns(NamedTuple):
+    ts: "array"
+    name: "array"
+    source: "array"
+    value: "array"
+    names: List[str]
+    sources: List[str]
+
+
+class Built(NamedTuple):
+    day: str
+    file: str
+    rows: int
+    min_ts: int
+    max_ts: int
+    last_id: int
+    previous: Optional[str]
+
+
+def _encode(values: array, delta: bool) -> bytes:
+    if delta and values:
+        values = array(values.typecode, [values[0]] + [b - a for a, b in zip(values, values[1:])])
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return zlib.compress(values.tobytes(), 6)
+
+
+def _decode(blob: bytes, typecode: str, delta: bool):
+    raw = zlib.decompress(blob)
+    if np is not None:
+        values = np.frombuffer(raw, dtype=_NUMPY_TYPES[typecode])
+        return np.cumsum(values) if delta else values
+    values = array(typecode)
+    values.frombytes(raw)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return array(typecode, accumulate(values)) if delta else values
+
+
+def write(path: Path, cols: Columns) -> None:
+    header_cols = []
+    blobs = []
+    offset = 0
+    for col, code in COLUMNS:
+        blob = _encode(getattr(cols, col), delta=col == "ts")
+        header_cols.append([col, code, offset, len(blob)])
+        blobs.append(blob)
+        offset += len(blob)
+    header = json.dumps(
+        {"rows": len(cols.ts), "names": cols.names, "sources": cols.sources, "columns": header_cols}
+    ).encode("utf-8")
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as fh:
+        fh.write(MAGIC)
+        fh.write(struct.pack("<I", len(header)))
+        fh.write(header)
+        for blob in blobs:
+            fh.write(blob)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+@lru_cache(maxsize=16)
+def read(path: str) -> Columns:
+    """Decoded columns of an archive file; cached, file names are never reused."""
+    with open(path, "rb") as fh:
+        data = fh.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a metrics archive")
+    start = len(MAGIC) + 4
+    (size,) = struct.unpack_from("<I", data, len(MAGIC))
+    header = json.loads(data[start:start + size])
+    base = start + size
+    decoded = {
+        col: _decode(data[base + offset:base + offset + length], code, delta=col == "ts")
+        for col, code, offset, length in header["columns"]
+    }
+    return Columns(names=header["names"], sources=header["sources"], **decoded)
+
+
+def archived(conn: sqlite3.Connection, from_: Optional[str] = None, to: Optional[str] = None) -> List[Tuple[str, str]]:
+    """(day, file) of the archived days overlapping [from_, to], oldest first."""
+    filters = ["1=1"]
+    params: List[str] = []
+    # Days are partition days, so they are widened like partitions.overlapping().
+    if from_:
+        filters.append("day >= ?")
+        params.append(partitions.shift_day(from_[:10], -1))
+    if to:
+        filters.append("day <= ?")
+        params.append(partitions.shift_day(to[:10], 1))
+    sql = f"SELECT day, file FROM metric_archives WHERE {' AND '.join(filters)} ORDER BY day"
+    return conn.execute(sql, params).fetchall()
+
+
+def due(conn: sqlite3.Connection, after_days: int, today: Optional[date] = None) -> List[str]:
+    """Days older than ``after_days`` days whose metrics table still has rows."""
+    if after_days <= 0:
+        return []
+    today = today or datetime.utcnow().date()
+    cutoff = (today - timedelta(days=after_days - 1)).isoformat()
+    days = [r[0] for r in conn.execute("SELECT day FROM partitions WHERE day < ? ORDER BY day", (cutoff,))]
+    return [
+        day for day in days
+        if conn.execute(f"SELECT 1 FROM {partitions.table('metrics', day)} LIMIT 1").fetchone() is not None
+    ]
+
+
+def build(conn: sqlite3.Connection, directory: Path, day: str) -> Optional[Built]:
+    """Write the archive file of ``day``: its current file plus the rows still in SQLite.
+
+    Runs on a read connection; commit() then makes the file current and
+    deletes the archived rows. Returns None when there is nothing to move.
+    """
+    rows = conn.execute(
+        f"""
+        SELECT m.id, m.ts_us, m.metric_name, s.value, m.metric_value
+        FROM {partitions.table('metrics', day)} m
+        JOIN {partitions.table('log_entries', day)} le ON le.id = m.log_entry_id
+        JOIN strings s ON s.id = le.source_id
+        """
+    ).fetchall()
+    if not rows:
+        return None
+    previous = conn.execute("SELECT file FROM metric_archives WHERE day = ?", (day,)).fetchone()
+    previous = previous[0] if previous else None
+
+    records: List[Tuple[int, str, str, float]] = []
+    if previous:
+        old = read(str(directory / previous))
+        records.extend(
+            (int(t), old.names[n], old.sources[s], float(v))
+            for t, n, s, v in zip(old.ts, old.name, old.source, old.value)
+        )
+    records.extend(row[1:] for row in rows)
+    records.sort(key=lambda r: r[0])
+
+    names: Dict[str, int] = {}
+    sources: Dict[str, int] = {}
+    cols = Columns(
+        ts=array("q", (r[0] for r in records)),
+        name=array("i", (names.setdefault(r[1], len(names)) for r in records)),
+        source=array("i", (sources.setdefault(r[2], len(sources)) for r in records)),
+        value=array("d", (r[3] for r in records)),
+        names=list(names),
+        sources=list(sources),
+    )
+    directory.mkdir(parents=True, exist_ok=True)
+    version = int(datetime.utcnow().timestamp() * 1000)
+    file = f"metrics_{day.replace('-', '')}_{version}.llma"
+    write(directory / file, cols)
+    last_id = max(row[0] for row in rows)
+    return Built(day, file, len(records), records[0][0], records[-1][0], last_id, previous)
+
+
+def commit(conn: sqlite3.Connection, directory: Path, built: Built) -> None:
+    """Make ``built`` the current file of its day and delete the rows it holds."""
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        current = cur.execute("SELECT file FROM metric_archives WHERE day = ?", (built.day,)).fetchone()
+        if (current[0] if current else None) != built.previous:
+            # Rewritten concurrently; keep the other file, this one is dropped.
+            conn.rollback()
+            os.unlink(directory / built.file)
+            return
+        cur.execute(f"DELETE FROM {partitions.table('metrics', built.day)} WHERE id <= ?", (built.last_id,))
+        cur.execute(
+            """
+            INSERT INTO metric_archives (day, file, rows, min_ts, max_ts, archived_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(day) DO UPDATE SET
+                file = excluded.file, rows = excluded.rows, min_ts = excluded.min_ts,
+                max_ts = excluded.max_ts, archived_at = excluded.archived_at
+            """,
+            (built.day, built.file, built.rows, built.min_ts, built.max_ts, datetime.utcnow().isoformat()),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if built.previous:
+        _unlink(directory / built.previous)
+
+
+def _unlink(path: Path) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def expire(conn: sqlite3.Connection, directory: Path, keep_days: int, today: Optional[date] = None) -> List[str]:
+    """Remove the archives of days older than the newest ``keep_days`` days."""
+    if keep_days <= 0:
+        return []
+    today = today or datetime.utcnow().date()
+    cutoff = (today - timedelta(days=keep_days - 1)).isoformat()
+    rows = conn.execute("SELECT day, file FROM metric_archives WHERE day < ?", (cutoff,)).fetchall()
+    if rows:
+        conn.execute("DELETE FROM metric_archives WHERE day < ?", (cutoff,))
+        conn.commit()
+        for _, file in rows:
+            _unlink(directory / file)
+    return [day for day, _ in rows]
+
+
+def remove_orphans(conn: sqlite3.Connection, directory: Path) -> int:
+    """Delete archive files no catalog row points to (left by a crash mid-compaction)."""
+    if not directory.is_dir():
+        return 0
+    current = {r[0] for r in conn.execute("SELECT file FROM metric_archives")}
+    removed = 0
+    for path in directory.glob("metrics_*.*"):
+        if path.name not in current:
+            _unlink(path)
+            removed += 1
+    return removed
+
+
+def _range(cols: Columns, lo: Optional[int], hi: Optional[int]) -> Tuple[int, int]:
+    # Timestamps are sorted, so a range is a slice.
+    ts = cols.ts
+    if np is not None:
+        start = int(np.searchsorted(ts, lo, "left")) if lo is not None else 0
+        stop = int(np.searchsorted(ts, hi, "right")) if hi is not None else len(ts)
+    else:
+        start = bisect.bisect_left(ts, lo) if lo is not None else 0
+        stop = bisect.bisect_right(ts, hi) if hi is not None else len(ts)
+    return start, stop
+
+
+def _bounds(from_: Optional[str], to: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    lo = utc_micros(from_) if from_ else None
+    hi = utc_micros(to) if to else None
+    return lo, hi
+
+
+def raw_rows(
+    conn: sqlite3.Connection, directory: Path, source: Optional[str], from_: Optional[str], to: Optional[str]
+) -> Iterator[Tuple[str, str, float, int]]:
+    """(metric_name, timestamp, value, ts_us) of archived metrics in range, in time order."""
+    lo, hi = _bounds(from_, to)
+    for _, file in archived(conn, from_, to):
+        cols = read(str(directory / file))
+        want = cols.sources.index(source) if source in cols.sources else None
+        if source and want is None:
+            continue
+        start, stop = _range(cols, lo, hi)
+        for i in range(start, stop):
+            if want is None or cols.source[i] == want:
+                ts = int(cols.ts[i])
+                yield cols.names[cols.name[i]], iso_micros(ts), float(cols.value[i]), ts
+
+
+def records(conn: sqlite3.Connection, directory: Path) -> Iterator[Tuple[str, str, str, float]]:
+    """Every archived (metric_name, source, timestamp, value), for rebuilding rollups."""
+    for _, file in archived(conn):
+        cols = read(str(directory / file))
+        for t, n, s, v in zip(cols.ts, cols.name, cols.source, cols.value):
+            yield cols.names[n], cols.sources[s], iso_micros(int(t)), float(v)
+
+
+def aggregate(
+    conn: sqlite3.Connection,
+    directory: Path,
+    step: int,
+    source: Optional[str],
+    from_: Optional[str],
+    to: Optional[str],
+) -> Dict[Tuple[str, int], List[float]]:
+    """(metric_name, bucket epoch second) -> [count, sum, min, max] over the archive.
+
+    Buckets are ``step`` seconds wide and aligned like rollups.query(). With
+    numpy each file is aggregated in a few vectorized passes.
+    """
+    lo, hi = _bounds(from_, to)
+    out: Dict[Tuple[str, int], List[float]] = {}
+    step_us = step * 1_000_000
+    for _, file in archived(conn, from_, to):
+        cols = read(str(directory / file))
+        want = cols.sources.index(source) if source in cols.sources else None
+        if source and want is None:
+            continue
+        start, stop = _range(cols, lo, hi)
+        if start >= stop:
+            continue
+        if np is not None:
+            cells = _aggregate_numpy(cols, start, stop, want, step_us)
+        else:
+            cells = _aggregate_python(cols, start, stop, want, step_us)
+        for (n, bucket), cell in cells.items():
+            key = (cols.names[n], bucket * step)
+            acc = out.get(key)
+            if acc is None:
+                out[key] = cell
+            else:
+                acc[0] += cell[0]
+                acc[1] += cell[1]
+                acc[2] = min(acc[2], cell[2])
+                acc[3] = max(acc[3], cell[3])
+    return out
+
+
+def _aggregate_numpy(cols: Columns, start: int, stop: int, want: Optional[int], step_us: int) -> Dict:
+    ts, names, values = cols.ts[start:stop], cols.name[start:stop], cols.value[start:stop]
+    if want is not None:
+        mask = cols.source[start:stop] == want
+        ts, names, values = ts[mask], names[mask], values[mask]
+    if not len(ts):
+        return {}
+    buckets = ts // step_us
+    first = int(buckets[0])
+    span = int(buckets[-1]) - first + 1
+    keys = names.astype(np.int64) * span + (buckets - first)
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse)
+    sums = np.bincount(inverse, weights=values)
+    mins = np.full(len(uniq), np.inf)
+    maxs = np.full(len(uniq), -np.inf)
+    np.minimum.at(mins, inverse, values)
+    np.maximum.at(maxs, inverse, values)
+    return {
+        (int(k // span), int(k % span) + first): [int(c), float(s), float(lo), float(hi)]
+        for k, c, s, lo, hi in zip(uniq, counts, sums, mins, maxs)
+    }
+
+
+def _aggregate_python(cols: Columns, start: int, stop: int, want: Optional[int], step_us: int) -> Dict:
+    cells: Dict[Tuple[int, int], List[float]] = defaultdict(lambda: [0, 0.0, float("inf"), float("-inf")])
+    ts, names, sources, values = cols.ts, cols.name, cols.source, cols.value
+    for i in range(start, stop):
+        if want is not None and sources[i] != want:
+            continue
+        v = values[i]
+        cell = cells[(names[i], ts[i] // step_us)]
+        cell[0] += 1
+        cell[1] += v
+        if v < cell[2]:
+            cell[2] = v
+        if v > cell[3]:
+            cell[3] = v
+    return dict(cells)
@@ -0,0 +1,128 @@
+"""End-to-end /api/ingest throughput, per input format.
+
+Posts ``--requests`` bodies of ``--lines`` lines each and counts the time
+until every entry is committed: requests answered 202 are followed by
+polling /api/ingest/queue. Runs the app in process through TestClient on
+a fresh database under ``--workdir``, or against a running server with
+``--url`` (whose database then receives the corpus).
+
+    python benchmarks/bench_ingest.py --requests 200 --lines 100 --output ingest.json
+    python benchmarks/bench_ingest.py --url http://localhost:8000 --concurrency 8
+"""
+import argparse
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import corpus
+from common import emit, load_app, percentiles, split_formats
+
+CONTENT_TYPES = {"json": "application/json"}
+
+
+def _drain(client: Any, committed_before: int, expected: int, timeout: float = 600) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        queue = client.get("/api/ingest/queue").json()
+        if queue["committed"] + queue["failed"] - committed_before >= expected:
+            if queue["failed"]:
+                raise SystemExit(f"{queue['failed']} queued entries failed to commit")
+            return
+        if time.monotonic() > deadline:
+            raise SystemExit(f"queue not drained after {timeout}s: {queue}")
+        time.sleep(0.005)
+
+
+def run_format(client: Any, fmt: str, args: argparse.Namespace) -> Dict[str, Any]:
+    step_us = 1000
+    bodies = [
+        corpus.make_body(fmt, args.lines, seed=i, start_us=corpus.START_US + i * args.lines * step_us, step_us=step_us)
+        for i in range(args.requests)
+    ]
+    headers = {"Content-Type": CONTENT_TYPES.get(fmt, "text/plain")}
+    params = {"source": f"bench-{fmt}", "wait": "true" if args.wait else "false"}
+
+    def post(body: str) -> Tuple[float, int, int]:
+        start = time.perf_counter()
+        response = client.post("/api/ingest", params=params, content=body.encode("utf-8"), headers=headers)
+        elapsed = time.perf_counter() - start
+        data = response.json()
+        return elapsed, response.status_code, data.get("ingested", data.get("accepted", 0))
+
+    committed_before = client.get("/api/ingest/queue").json()["committed"]
+    start = time.perf_counter()
+    if args.concurrency > 1:
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            outcomes: List[Tuple[float, int, int]] = list(pool.map(post, bodies))
+    else:
+        outcomes = [post(body) for body in bodies]
+    answered = time.perf_counter() - start
+    queued = sum(rows for _, status, rows in outcomes if status == 202)
+    if queued:
+        _drain(client, committed_before, queued)
+    elapsed = time.perf_counter() - start
+
+    statuses = Counter(status for _, status, _ in outcomes)
+    rows = sum(rows for _, status, rows in outcomes if status in (200, 202))
+    if rows != args.requests * args.lines:
+        print(f"{fmt}: {rows} of {args.requests * args.lines} lines accepted, statuses {dict(statuses)}", file=sys.stderr)
+    return {
+        "requests": args.requests,
+        "lines_per_request": args.lines,
+        "rows": rows,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "answered_s": round(answered, 4),
+        "committed_s": round(elapsed, 4),
+        "requests_per_s": round(args.requests / answered, 1),
+        "rows_per_s": round(rows / elapsed),
+        "latency": percentiles([t for t, _, _ in outcomes]),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=100, help="lines per request")
+    parser.add_argument("--formats", default=",".join(corpus.FORMATS))
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--wait", action="store_true", help="post with wait=true (200 after commit)")
+    parser.add_argument("--url", help="benchmark a running server instead of an in-process app")
+    parser.add_argument("--workdir", help="database directory for the in-process app (default: a temp dir)")
+    parser.add_argument("--output", help="JSON results file (default: stdout)")
+    args = parser.parse_args()
+    formats = split_formats(args.formats, list(corpus.FORMATS))
+
+    results = {}
+
+    def run_all(client: Any) -> None:
+        for fmt in formats:
+            results[fmt] = run_format(client, fmt, args)
+            row = results[fmt]
+            print(
+                f"{fmt:<11} {row['rows_per_s']:>9,} rows/s {row['requests_per_s']:>8} req/s "
+                f"p50 {row['latency']['p50_ms']} ms p99 {row['latency']['p99_ms']} ms",
+                file=sys.stderr,
+            )
+
+    if args.url:
+        import httpx
+
+        with httpx.Client(base_url=args.url, timeout=600) as client:
+            run_all(client)
+    else:
+        from fastapi.testclient import TestClient
+
+        with tempfile.TemporaryDirectory(prefix="loglens-bench-") as tmp:
+            app = load_app(Path(args.workdir or tmp)).app
+            with TestClient(app) as client:
+                run_all(client)
+
+    emit("ingest", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Equivalence and speed check for detector._guess_level.
+
+Runs the single-pass classifier against the original per-key regex loop on a
+synthetic corpus of mixed log lines and fails if any result differs.
+
+    python benchmarks/bench_level_classifier.py --lines 1000000
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from detector import LEVEL_HINTS, _guess_level  # noqa: E402
+
+WORDS = [
+    "request", "served", "user", "connection", "reset", "timeout", "cache", "miss", "retrying",
+    "db", "query", "took", "ms", "worker", "started", "stopped", "errors=0", "terrible", "information",
+    "warnings", "debugger", "error_code", "Error:", "WARN", "[info]", "fatal:", "TRACE", "critical!",
+    "err", "warning", "debug", "traceback", "Info", "error-prone",
+]
+
+
+def reference_guess_level(*values: str) -> str:
+    for value in values:
+        if not value:
+            continue
+        low = str(value).lower()
+        for k, v in LEVEL_HINTS.items():
+            if re.search(rf"\b{k}\b", low):
+                return v
+    return "INFO"
+
+
+def make_corpus(count: int, seed: int = 42) -> List[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 14))) for _ in range(count)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.lines)
+
+    start = time.perf_counter()
+    expected = [reference_guess_level(line) for line in corpus]
+    reference_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [_guess_level(line) for line in corpus]
+    classifier_s = time.perf_counter() - start
+
+    mismatches = [(line, e, a) for line, e, a in zip(corpus, expected, actual) if e != a]
+    print(f"lines:       {len(corpus)}")
+    print(f"reference:   {reference_s:.2f}s ({len(corpus) / reference_s:,.0f} lines/s)")
+    print(f"classifier:  {classifier_s:.2f}s ({len(corpus) / classifier_s:,.0f} lines/s)")
+    print(f"speedup:     {reference_s / classifier_s:.1f}x")
+    if mismatches:
+        for line, e, a in mismatches[:10]:
+            print(f"MISMATCH {line!r}: expected {e}, got {a}")
+        sys.exit(1)
+    print("results identical")
+
+
+if __name__ == "__main__":
+    main()
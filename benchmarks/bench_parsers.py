@@ -0,0 +1,56 @@
+"""Parser throughput of detect_and_parse, per input format.
+
+Each format's body is parsed once to warm up, then ``--repeat`` times. By
+default the source keeps its cached format, as with a steady ingest stream;
+``--cold`` uses a new source per run so every parse sniffs the format again.
+
+    python benchmarks/bench_parsers.py --lines 100000 --output parsers.json
+"""
+import argparse
+import statistics
+import sys
+import time
+
+import corpus
+from common import emit, split_formats
+from detector import detect_and_parse
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=100_000, help="lines per body")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--formats", default=",".join(corpus.FORMATS))
+    parser.add_argument("--cold", action="store_true", help="re-detect the format on every run")
+    parser.add_argument("--output", help="JSON results file (default: stdout)")
+    args = parser.parse_args()
+
+    results = {}
+    for fmt in split_formats(args.formats, list(corpus.FORMATS)):
+        body = corpus.make_body(fmt, args.lines)
+        detect_and_parse(body, source=f"bench-{fmt}")
+        times = []
+        for run in range(args.repeat):
+            source = f"bench-{fmt}-{run}" if args.cold else f"bench-{fmt}"
+            start = time.perf_counter()
+            entries = detect_and_parse(body, source=source)
+            times.append(time.perf_counter() - start)
+            if len(entries) != args.lines or entries[0]["format_detected"] != corpus.FORMATS[fmt]:
+                raise SystemExit(f"{fmt}: parsed {len(entries)} {entries[0]['format_detected']} entries")
+        best = min(times)
+        results[fmt] = {
+            "lines": args.lines,
+            "bytes": len(body.encode("utf-8")),
+            "best_s": round(best, 4),
+            "median_s": round(statistics.median(times), 4),
+            "lines_per_s": round(args.lines / best),
+            "mb_per_s": round(len(body.encode("utf-8")) / best / 1e6, 2),
+        }
+        row = results[fmt]
+        print(f"{fmt:<11} {row['lines_per_s']:>10,} lines/s {row['mb_per_s']:>8} MB/s", file=sys.stderr)
+
+    emit("parsers", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
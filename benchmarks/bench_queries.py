@@ -0,0 +1,135 @@
+"""Query endpoint latency percentiles on a pre-populated database.
+
+Fills a database to ``--rows`` entries (all formats in turn, spread over
+``--days`` days) unless ``--db`` already holds that many, then times each
+query ``--repeat`` times through TestClient. The response cache is
+disabled so every request runs its queries; ``--cache`` keeps it.
+Populating is the slow part: pass ``--db`` to keep the database and reuse
+it in later runs.
+
+    python benchmarks/bench_queries.py --rows 1000000 --db /tmp/bench-1m/loglens.db
+    python benchmarks/bench_queries.py --rows 10000000 --db /tmp/bench-10m/loglens.db
+"""
+import argparse
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import corpus
+from common import emit, load_app, percentiles
+from detector import detect_and_parse
+
+CHUNK_LINES = 50_000
+# Free-text formats get templates, access logs and JSON get metrics.
+POPULATE_FORMATS = ["jsonl", "syslog", "access_log", "plain"]
+
+
+def _iso(micros: int) -> str:
+    return datetime.fromtimestamp(micros / 1_000_000, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def populate(main: Any, rows: int, days: float) -> Dict[str, Any]:
+    have = main.STATS.snapshot()["total_entries"]
+    step_us = max(1, int(days * 86400 * 1_000_000 / rows))
+    start = time.perf_counter()
+    done = have
+    while done < rows:
+        count = min(CHUNK_LINES, rows - done)
+        chunk = done // CHUNK_LINES
+        fmt = POPULATE_FORMATS[chunk % len(POPULATE_FORMATS)]
+        body = corpus.make_body(fmt, count, seed=chunk, start_us=corpus.START_US + done * step_us, step_us=step_us)
+        entries = detect_and_parse(body, source=f"bench-{fmt}")
+        main._insert_entries(entries)
+        done += count
+        print(f"populated {done:,}/{rows:,}", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    added = done - have
+    return {
+        "existing_rows": have,
+        "added_rows": added,
+        "seconds": round(elapsed, 2),
+        "rows_per_s": round(added / elapsed) if added else None,
+    }
+
+
+def queries(client: Any, rows: int, days: float) -> List[Tuple[str, str, Dict[str, Any]]]:
+    step_us = max(1, int(days * 86400 * 1_000_000 / rows))
+    middle = corpus.START_US + rows * step_us // 2
+    hour = {"from": _iso(middle), "to": _iso(middle + 3600 * 1_000_000)}
+    day = {"from": _iso(middle), "to": _iso(middle + 86400 * 1_000_000)}
+
+    # A cursor a few pages deep, as a user scrolling back would send.
+    cursor: Optional[str] = None
+    for _ in range(5):
+        page = client.get("/api/logs", params={"limit": 100, **({"cursor": cursor} if cursor else {})}).json()
+        cursor = page.get("next_cursor")
+
+    listed = [
+        ("sources", "/api/sources", {}),
+        ("stats", "/api/stats", {}),
+        ("logs_latest", "/api/logs", {"limit": 100}),
+        ("logs_source_level", "/api/logs", {"source": "api", "level": "ERROR", "limit": 100}),
+        ("logs_hour", "/api/logs", {"limit": 100, **hour}),
+        ("logs_search", "/api/logs", {"q": "timeout", "limit": 100}),
+        ("metrics_day", "/api/metrics", {"source": "bench-access_log", **day}),
+        ("metrics_all", "/api/metrics", {}),
+        ("categories_source", "/api/categories", {"source": "bench-access_log"}),
+        ("categories_all", "/api/categories", {}),
+        ("templates", "/api/templates", {}),
+        ("templates_hour", "/api/templates", hour),
+        ("export_hour_ndjson", "/api/logs/export", {"format": "ndjson", **hour}),
+    ]
+    if cursor:
+        listed.insert(4, ("logs_cursor_page6", "/api/logs", {"limit": 100, "cursor": cursor}))
+    return listed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--db", help="database file to fill or reuse (default: a temp file)")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache enabled")
+    parser.add_argument("--only", help="comma-separated query names to run")
+    parser.add_argument("--output", help="JSON results file (default: stdout)")
+    args = parser.parse_args()
+
+    from fastapi.testclient import TestClient
+
+    with tempfile.TemporaryDirectory(prefix="loglens-bench-") as tmp:
+        db_path = Path(args.db) if args.db else Path(tmp) / "loglens.db"
+        env = {"LOGLENS_DB_PATH": str(db_path)}
+        if not args.cache:
+            env["LOGLENS_CACHE_MAX_BYTES"] = "0"
+        main_module = load_app(db_path.parent, **env)
+        results: Dict[str, Any] = {}
+        with TestClient(main_module.app) as client:
+            results["populate"] = populate(main_module, args.rows, args.days)
+            results["db_bytes"] = sum(p.stat().st_size for p in db_path.parent.glob(db_path.name + "*"))
+            only = set(args.only.split(",")) if args.only else None
+            for name, path, params in queries(client, args.rows, args.days):
+                if only is not None and name not in only:
+                    continue
+                client.get(path, params=params)
+                times = []
+                size = 0
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    response = client.get(path, params=params)
+                    times.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        raise SystemExit(f"{name}: HTTP {response.status_code} {response.text[:200]}")
+                    size = len(response.content)
+                results[name] = {"path": path, "params": params, "bytes": size, "latency": percentiles(times)}
+                latency = results[name]["latency"]
+                print(f"{name:<20} p50 {latency['p50_ms']:>9} ms  p99 {latency['p99_ms']:>9} ms", file=sys.stderr)
+
+    emit("queries", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
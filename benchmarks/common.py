@@ -0,0 +1,101 @@
+"""Helpers shared by the benchmark scripts: app setup, percentiles, JSON output."""
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, List, Optional, Sequence
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def load_app(workdir: Path, **env: str) -> ModuleType:
+    """Import main with its database and archive under ``workdir``.
+
+    ``env`` sets further LOGLENS_* settings (e.g. LOGLENS_CACHE_MAX_BYTES="0");
+    main reads them at import time, so this must run before anything else
+    imports it.
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.environ.setdefault("LOGLENS_DB_PATH", str(workdir / "loglens.db"))
+    os.environ.setdefault("LOGLENS_ARCHIVE_DIR", str(workdir / "archive"))
+    os.environ.update(env)
+    import main
+
+    return main
+
+
+def percentiles(samples: Sequence[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds of ``samples`` given in seconds."""
+    ordered = sorted(samples)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": at(0.50),
+        "p90_ms": at(0.90),
+        "p99_ms": at(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10
+        )
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        import orjson  # noqa: F401
+
+        has_orjson = True
+    except ImportError:
+        has_orjson = False
+    return {
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "sqlite": sqlite3.sqlite_version,
+        "orjson": has_orjson,
+        "settings": {k: v for k, v in sorted(os.environ.items()) if k.startswith("LOGLENS_")},
+    }
+
+
+def emit(name: str, params: Dict[str, Any], results: Dict[str, Any], output: Optional[str]) -> None:
+    """Write one run as JSON to ``output`` ("-" or None: stdout)."""
+    document = {
+        "benchmark": name,
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": environment(),
+        "params": params,
+        "results": results,
+    }
+    text = json.dumps(document, indent=2)
+    if output and output != "-":
+        Path(output).write_text(text + "\n")
+        print(f"results written to {output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+def split_formats(value: str, known: List[str]) -> List[str]:
+    formats = [f.strip() for f in value.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in known]
+    if unknown:
+        raise SystemExit(f"unknown formats: {', '.join(unknown)} (known: {', '.join(known)})")
+    return formats
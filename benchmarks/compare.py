@@ -0,0 +1,67 @@
+"""Compare two result files written by the benchmark scripts.
+
+Prints every numeric result present in both runs with its relative change.
+Latencies and durations (*_ms, *_s) are better lower, throughputs (*_per_s)
+better higher; changes beyond ``--threshold`` percent are flagged.
+
+    python benchmarks/compare.py before.json after.json
+"""
+import argparse
+import json
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+
+def flatten(value: Any, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, float(value)
+
+
+def direction(key: str) -> Optional[int]:
+    """+1 when higher is better, -1 when lower is, None for plain counts."""
+    name = key.rsplit(".", 1)[-1]
+    if name.endswith("_per_s"):
+        return 1
+    if name.endswith(("_ms", "_s")):
+        return -1
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change to flag")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before["benchmark"] != after["benchmark"]:
+        raise SystemExit(f"different benchmarks: {before['benchmark']} vs {after['benchmark']}")
+    for label, run in (("before", before), ("after", after)):
+        env = run["environment"]
+        print(f"{label}: {run['recorded_at']} commit {env['git_commit']} python {env['python']} cpus {env['cpus']}")
+
+    old: Dict[str, float] = dict(flatten(before["results"]))
+    regressions = 0
+    for key, new in flatten(after["results"]):
+        sign = direction(key)
+        if key not in old or sign is None:
+            continue
+        base = old[key]
+        change = (new - base) / base * 100 if base else 0.0
+        worse = change * sign < 0
+        flag = ""
+        if abs(change) >= args.threshold:
+            flag = "  REGRESSION" if worse else "  improved"
+            regressions += worse
+        print(f"{key:<45} {base:>14.3f} {new:>14.3f} {change:>+8.1f}%{flag}")
+    print(f"{regressions} regression(s) beyond {args.threshold}%")
+
+
+if __name__ == "__main__":
+    main()
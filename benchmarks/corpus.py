@@ -0,0 +1,138 @@
+"""Synthetic log corpora in every format detect_and_parse supports.
+
+Lines are deterministic for a given seed. Timestamps start at ``start_us``
+(UTC epoch microseconds) and advance by ``step_us`` per line, so several
+generated chunks can be laid end to end on one timeline.
+"""
+import json
+import random
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+# Parser format name -> format_detected of the entries it produces.
+FORMATS = {
+    "json": "json",
+    "jsonl": "json",
+    "csv": "csv",
+    "syslog": "syslog",
+    "access_log": "access_log",
+    "plain": "plain",
+}
+
+START_US = int(datetime(2026, 1, 5, tzinfo=timezone.utc).timestamp() * 1_000_000)
+
+SOURCES = ["api", "auth", "billing", "worker", "web"]
+LEVELS = ["INFO"] * 14 + ["DEBUG"] * 3 + ["WARN"] * 2 + ["ERROR"]
+REGIONS = ["eu-west-1", "eu-central-1", "us-east-1", "us-west-2", "ap-south-1"]
+HOSTS = [f"node-{i:02d}" for i in range(12)]
+PATHS = ["/", "/login", "/api/users", "/api/orders", "/api/orders/{id}", "/static/app.js", "/health"]
+AGENTS = ["Mozilla/5.0 (X11; Linux x86_64)", "curl/8.5.0", "python-httpx/0.27", "Go-http-client/1.1"]
+STATUSES = [200] * 40 + [201, 204, 301, 304, 400, 401, 404, 404, 500, 502, 503]
+
+MESSAGES = [
+    "request {method} {path} completed in {ms}ms",
+    "user {user} logged in from {ip}",
+    "payment {order} failed: card declined",
+    "cache miss for key session:{user}",
+    "worker {worker} processed {jobs} jobs",
+    "connection to db-{worker} timeout after {ms}ms, retrying",
+    "order {order} shipped to {region}",
+]
+
+
+class _Line:
+    """Random fields shared by every format, for one line."""
+
+    def __init__(self, rng: random.Random, ts_us: int) -> None:
+        self.ts = datetime.fromtimestamp(ts_us / 1_000_000, timezone.utc)
+        self.source = rng.choice(SOURCES)
+        self.level = rng.choice(LEVELS)
+        self.region = rng.choice(REGIONS)
+        self.host = rng.choice(HOSTS)
+        self.ip = f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+        self.user = f"u{rng.randrange(50000)}"
+        self.ms = rng.randrange(1, 2000)
+        self.status = rng.choice(STATUSES)
+        self.bytes = rng.randrange(0, 50000)
+        self.method = rng.choice(["GET"] * 4 + ["POST", "PUT", "DELETE"])
+        self.path = rng.choice(PATHS).replace("{id}", str(rng.randrange(100000)))
+        self.message = rng.choice(MESSAGES).format(
+            method=self.method,
+            path=self.path,
+            ms=self.ms,
+            user=self.user,
+            ip=self.ip,
+            order=rng.randrange(10**6),
+            worker=rng.randrange(16),
+            jobs=rng.randrange(1, 500),
+            region=self.region,
+        )
+
+    @property
+    def iso(self) -> str:
+        return self.ts.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+    def record(self) -> Dict[str, object]:
+        return {
+            "timestamp": self.iso,
+            "level": self.level,
+            "service": self.source,
+            "message": self.message,
+            "duration_ms": self.ms,
+            "status": self.status,
+            "region": self.region,
+            "user": self.user,
+        }
+
+
+def _json_line(line: _Line) -> str:
+    return json.dumps(line.record(), separators=(",", ":"))
+
+
+def _csv_line(line: _Line) -> str:
+    message = line.message.replace(",", ";")
+    return f"{line.iso},{line.level},{line.source},{message},{line.ms},{line.status},{line.region}"
+
+
+def _syslog_line(line: _Line) -> str:
+    return f"{line.iso} {line.host} {line.source}[{1000 + line.ms}]: {line.level.lower()}: {line.message}"
+
+
+def _access_line(line: _Line) -> str:
+    ts = line.ts.strftime("%d/%b/%Y:%H:%M:%S +0000")
+    return (
+        f'{line.ip} - - [{ts}] "{line.method} {line.path} HTTP/1.1" {line.status} {line.bytes} '
+        f'"-" "{AGENTS[line.ms % len(AGENTS)]}" {line.ms / 1000:.3f}'
+    )
+
+
+def _plain_line(line: _Line) -> str:
+    return f"{line.iso} {line.level} [{line.source}] {line.message}"
+
+
+LINE_WRITERS: Dict[str, Callable[[_Line], str]] = {
+    "json": _json_line,
+    "jsonl": _json_line,
+    "csv": _csv_line,
+    "syslog": _syslog_line,
+    "access_log": _access_line,
+    "plain": _plain_line,
+}
+
+CSV_HEADER = "timestamp,level,source,message,duration_ms,status,region"
+
+
+def make_lines(fmt: str, count: int, seed: int = 42, start_us: int = START_US, step_us: int = 1000) -> List[str]:
+    rng = random.Random(f"{fmt}:{seed}")
+    write = LINE_WRITERS[fmt]
+    return [write(_Line(rng, start_us + i * step_us)) for i in range(count)]
+
+
+def make_body(fmt: str, count: int, seed: int = 42, start_us: int = START_US, step_us: int = 1000) -> str:
+    """An /api/ingest request body of ``count`` entries."""
+    lines = make_lines(fmt, count, seed, start_us, step_us)
+    if fmt == "json":
+        return "[" + ",".join(lines) + "]"
+    if fmt == "csv":
+        lines.insert(0, CSV_HEADER)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,143 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+# Data of any source changed.
+DATA = "data"
+# The set of sources changed.
+SOURCES = "sources"
+ALERTS = "alerts"
+
+
+def source_scope(source: str) -> str:
+    return f"source:{source}"
+
+
+class DataVersions:
+    """Version counters of what cached responses depend on.
+
+    A response records the versions of its scopes when it is computed and is
+    served again only while they are unchanged. Writers bump after commit,
+    so a response computed from older data always carries an older version.
+    Changes that cut across scopes (retention, archiving, templates
+    generalized by another source) bump the epoch every scope includes.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+        self._epoch = 0
+
+    def token(self, scopes: Sequence[str]) -> Tuple[int, ...]:
+        with self._lock:
+            return (self._epoch,) + tuple(self._versions.get(s, 0) for s in scopes)
+
+    def bump(self, scopes: Iterable[str]) -> None:
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def bump_sources(self, sources: Iterable[str]) -> None:
+        """Record new data for ``sources``."""
+        with self._lock:
+            for source in set(sources):
+                scope = source_scope(source)
+                if scope not in self._versions:
+                    # First write seen for it: it may be a new source.
+                    self._versions[SOURCES] = self._versions.get(SOURCES, 0) + 1
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+            self._versions[DATA] = self._versions.get(DATA, 0) + 1
+
+    def bump_all(self) -> None:
+        with self._lock:
+            self._epoch += 1
+
+
+class Entry(NamedTuple):
+    token: Tuple[int, ...]
+    body: bytes
+    etag: str
+
+
+def etag_of(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header names ``etag`` (weak comparison)."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+class ResponseCache:
+    """Serialized responses by (path, parameters), LRU-bounded by body bytes.
+
+    An entry whose version token no longer matches is dropped on lookup;
+    max_bytes=0 disables storing.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Entry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, token: Tuple[int, ...]) -> Optional[Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.token != token:
+                self._remove(key)
+                self.stale += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, token: Tuple[int, ...], body: bytes) -> Entry:
+        entry = Entry(token, body, etag_of(body))
+        # One response may not take more than a quarter of the budget.
+        if len(body) * 4 > self.max_bytes:
+            return entry
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return entry
+
+    def _remove(self, key: Hashable) -> None:
+        self._bytes -= len(self._entries.pop(key).body)
+
+    def record_not_modified(self) -> None:
+        with self._lock:
+            self.not_modified += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,412 @@
+import base64
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import partitions
+from extractor import CATEGORY_CARDINALITY_LIMIT
+
+# Category fields start out stored row by row and counted exactly. Once a
+# field has more than CATEGORY_CARDINALITY_LIMIT distinct values across all
+# sources (IPs, URL paths, ids) it is "promoted": its rows are no longer
+# stored and each source gets a top-K sketch and a distinct counter instead,
+# persisted in category_sketches and served from memory. Past ``max_sources``
+# sources per field, the least recently seen one is merged into the field's
+# OTHER_SOURCE sketch.
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS category_fields (
+    name TEXT PRIMARY KEY,
+    promoted INTEGER NOT NULL,
+    distinct_values TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS category_sketches (
+    name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, source)
+);
+"""
+
+FIELD_UPSERT_SQL = """
+INSERT INTO category_fields (name, promoted, distinct_values) VALUES (?, ?, ?)
+ON CONFLICT(name) DO UPDATE SET promoted = excluded.promoted, distinct_values = excluded.distinct_values
+"""
+
+SKETCH_DELETE_SQL = "DELETE FROM category_sketches WHERE name = ? AND source = ?"
+
+# Sketch that sources evicted past max_sources are merged into.
+OTHER_SOURCE = "\x00other"
+
+SKETCH_UPSERT_SQL = """
+INSERT INTO category_sketches (name, source, state) VALUES (?, ?, ?)
+ON CONFLICT(name, source) DO UPDATE SET state = excluded.state
+"""
+
+
+def _hash64(value: str) -> int:
+    # Stable across processes, unlike hash(), so registers can be persisted.
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Distinct counter in 2**precision one-byte registers (~1.6% error at 12)."""
+
+    def __init__(self, precision: int = 12, registers: Optional[bytearray] = None) -> None:
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value: str) -> None:
+        h = _hash64(value)
+        idx = h >> (64 - self.precision)
+        rest = (h << self.precision) & ((1 << 64) - 1)
+        rank = 64 - self.precision + 1 if rest == 0 else 65 - rest.bit_length()
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def estimate(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+    def dumps(self) -> str:
+        return base64.b64encode(bytes(self.registers)).decode("ascii")
+
+    @classmethod
+    def loads(cls, precision: int, data: str) -> "HyperLogLog":
+        return cls(precision, bytearray(base64.b64decode(data)))
+
+
+class SpaceSaving:
+    """Top-K counter (Space-Saving) with batched eviction.
+
+    Tracks up to 2 * k values; when full, only the k largest are kept and
+    the largest evicted count becomes the floor a new value starts from.
+    A reported count overestimates the true one by at most its error.
+    """
+
+    def __init__(self, k: int = 64) -> None:
+        self.k = k
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.floor = 0
+
+    def add(self, value: str, count: int = 1) -> None:
+        if value in self.counts:
+            self.counts[value] += count
+            return
+        if len(self.counts) >= 2 * self.k:
+            self._compact()
+        self.counts[value] = self.floor + count
+        self.errors[value] = self.floor
+
+    def _compact(self) -> None:
+        ranked = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)
+        keep, evicted = ranked[: self.k], ranked[self.k:]
+        if evicted:
+            self.floor = max(self.floor, evicted[0][1])
+        self.counts = dict(keep)
+        self.errors = {v: self.errors.get(v, 0) for v in self.counts}
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        return sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+
+    def merge(self, other: "SpaceSaving") -> None:
+        for value, count in other.counts.items():
+            self.add(value, count)
+
+    def state(self) -> Dict:
+        return {"k": self.k, "floor": self.floor, "counts": self.counts, "errors": self.errors}
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "SpaceSaving":
+        sketch = cls(state["k"])
+        sketch.floor = state["floor"]
+        sketch.counts = dict(state["counts"])
+        sketch.errors = dict(state["errors"])
+        return sketch
+
+
+class FieldSketch:
+    __slots__ = ("top", "distinct", "total")
+
+    def __init__(self, top: SpaceSaving, distinct: HyperLogLog, total: int = 0) -> None:
+        self.top = top
+        self.distinct = distinct
+        self.total = total
+
+    def merge(self, other: "FieldSketch") -> None:
+        self.top.merge(other.top)
+        self.distinct.merge(other.distinct)
+        self.total += other.total
+
+    def dumps(self) -> str:
+        return json.dumps(
+            {"top": self.top.state(), "p": self.distinct.precision, "hll": self.distinct.dumps(), "total": self.total}
+        )
+
+    @classmethod
+    def loads(cls, data: str) -> "FieldSketch":
+        state = json.loads(data)
+        return cls(SpaceSaving.from_state(state["top"]), HyperLogLog.loads(state["p"], state["hll"]), state["total"])
+
+
+class CategoryTracker:
+    """Decides which category rows are stored and sketches the others.
+
+    route() runs on the writer inside the ingest transaction; sketches are
+    read by the API through snapshot(). Memory is bounded per field: at
+    most ``limit`` + 1 distinct values for exact fields, and for promoted
+    ones 2 * ``top_k`` counters plus 2**``precision`` bytes for each of at
+    most ``max_sources`` + 1 sketches.
+    """
+
+    def __init__(
+        self,
+        limit: int = CATEGORY_CARDINALITY_LIMIT,
+        top_k: int = 64,
+        precision: int = 12,
+        max_sources: int = 100,
+    ) -> None:
+        self.limit = limit
+        self.top_k = top_k
+        self.precision = precision
+        self.max_sources = max(1, max_sources)
+        self._lock = threading.Lock()
+        self._distinct: Dict[str, Set[str]] = {}
+        self._promoted: Set[str] = set()
+        # field -> source -> sketch, least recently updated source first.
+        self._sketches: Dict[str, "OrderedDict[str, FieldSketch]"] = defaultdict(OrderedDict)
+        # Bumped whenever the set of promoted fields may have changed.
+        self.revision = 0
+
+    def _new_sketch(self) -> FieldSketch:
+        return FieldSketch(SpaceSaving(self.top_k), HyperLogLog(self.precision))
+
+    def _sketch(self, name: str, source: str, evicted: Set[Tuple[str, str]]) -> FieldSketch:
+        """The sketch of (``name``, ``source``), made the most recent one.
+
+        Sources pushed past ``max_sources`` are merged into OTHER_SOURCE and
+        added to ``evicted``.
+        """
+        sketches = self._sketches[name]
+        sketch = sketches.get(source)
+        if sketch is not None:
+            sketches.move_to_end(source)
+            return sketch
+        sketch = sketches[source] = self._new_sketch()
+        self._fold(name, evicted)
+        return sketch
+
+    def _fold(self, name: str, evicted: Set[Tuple[str, str]]) -> None:
+        sketches = self._sketches[name]
+        while len(sketches) - (OTHER_SOURCE in sketches) > self.max_sources:
+            oldest = next(s for s in sketches if s != OTHER_SOURCE)
+            other = sketches.get(OTHER_SOURCE)
+            if other is None:
+                other = sketches[OTHER_SOURCE] = self._new_sketch()
+                # Oldest position, so it is never mistaken for a fresh source.
+                sketches.move_to_end(OTHER_SOURCE, last=False)
+            other.merge(sketches.pop(oldest))
+            evicted.add((name, oldest))
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self.revision += 1
+            self._distinct = {}
+            self._promoted = set()
+            self._sketches = defaultdict(OrderedDict)
+            for name, promoted, values in conn.execute("SELECT name, promoted, distinct_values FROM category_fields"):
+                if promoted:
+                    self._promoted.add(name)
+                else:
+                    self._distinct[name] = set(json.loads(values))
+            # Sources over a lowered max_sources are folded in memory; the
+            # next write to the field persists that.
+            for name, source, state in conn.execute(
+                "SELECT name, source, state FROM category_sketches ORDER BY rowid"
+            ):
+                self._sketches[name][source] = FieldSketch.loads(state)
+            for name in list(self._sketches):
+                self._fold(name, set())
+
+    def needs_backfill(self, conn: sqlite3.Connection) -> bool:
+        has_fields = conn.execute("SELECT 1 FROM category_fields LIMIT 1").fetchone() is not None
+        return not has_fields and partitions.any_rows(conn, "categories")
+
+    def backfill(self, conn: sqlite3.Connection) -> List[str]:
+        """Track the fields of categories stored before tracking existed.
+
+        Returns the fields promoted; their existing rows seed the sketches.
+        """
+        distinct: Dict[str, Set[str]] = defaultdict(set)
+        for day in partitions.overlapping(conn):
+            rows = conn.execute(
+                f"""
+                SELECT n.value, v.value
+                FROM (SELECT DISTINCT name_id, value_id FROM {partitions.table('categories', day)}) c
+                JOIN strings n ON n.id = c.name_id
+                JOIN strings v ON v.id = c.value_id
+                """
+            )
+            for name, value in rows:
+                if len(distinct[name]) <= self.limit:
+                    distinct[name].add(value)
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            promoted = []
+            with self._lock:
+                for name, values in distinct.items():
+                    if len(values) > self.limit:
+                        promoted.append(name)
+                        self._promote(cur, name, {})
+                    else:
+                        self._distinct[name] = values
+                self._persist_fields(cur, distinct)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return promoted
+
+    def _promote(self, cur: sqlite3.Cursor, name: str, pending: Dict[Tuple[str, str], int]) -> None:
+        """Move ``name`` to sketches, seeded from its stored rows and ``pending``."""
+        self.revision += 1
+        self._promoted.add(name)
+        self._distinct.pop(name, None)
+        seeds: Dict[Tuple[str, str], int] = Counter(pending)
+        for day in partitions.overlapping(cur.connection):
+            rows = cur.execute(
+                f"""
+                SELECT s.value, v.value, x.n
+                FROM (
+                    SELECT le.source_id, c.value_id, COUNT(*) AS n
+                    FROM {partitions.table('categories', day)} c
+                    JOIN {partitions.table('log_entries', day)} le ON le.id = c.log_entry_id
+                    WHERE c.name_id = (SELECT id FROM strings WHERE value = ?)
+                    GROUP BY le.source_id, c.value_id
+                ) x
+                JOIN strings s ON s.id = x.source_id
+                JOIN strings v ON v.id = x.value_id
+                """,
+                (name,),
+            )
+            for source, value, n in rows:
+                seeds[(source, value)] += n
+        evicted: Set[Tuple[str, str]] = set()
+        for (source, value), n in seeds.items():
+            sketch = self._sketch(name, source, evicted)
+            sketch.top.add(value, n)
+            sketch.distinct.add(value)
+            sketch.total += n
+        self._save(cur, {(name, source) for source in self._sketches[name]}, evicted)
+
+    def _save(self, cur: sqlite3.Cursor, touched: Set[Tuple[str, str]], evicted: Set[Tuple[str, str]]) -> None:
+        """Persist the ``touched`` sketches and drop the rows of ``evicted`` ones."""
+        current = self._sketches
+        cur.executemany(SKETCH_DELETE_SQL, [(n, s) for n, s in evicted if s not in current.get(n, ())])
+        touched = touched | {(n, OTHER_SOURCE) for n, _ in evicted}
+        cur.executemany(
+            SKETCH_UPSERT_SQL,
+            [(n, s, current[n][s].dumps()) for n, s in touched if s in current.get(n, ())],
+        )
+
+    def _persist_fields(self, cur: sqlite3.Cursor, names: Iterable[str]) -> None:
+        rows = []
+        for name in names:
+            if name in self._promoted:
+                rows.append((name, 1, "[]"))
+            else:
+                rows.append((name, 0, json.dumps(sorted(self._distinct.get(name, ())))))
+        cur.executemany(FIELD_UPSERT_SQL, rows)
+
+    def route(self, cur: sqlite3.Cursor, rows: List[tuple], sources: List[str]) -> List[tuple]:
+        """Sketch the (offset, name, value, ts) rows of promoted fields.
+
+        Returns the rows still to be stored. New fields, promotions and
+        sketch states are written through ``cur``.
+        """
+        with self._lock:
+            new_values: Dict[str, Set[str]] = defaultdict(set)
+            for _, name, value, _ in rows:
+                if name not in self._promoted:
+                    known = self._distinct.get(name)
+                    if known is None or value not in known:
+                        new_values[name].add(value)
+            changed: Set[str] = set()
+            promote: List[str] = []
+            for name, values in new_values.items():
+                known = self._distinct.setdefault(name, set())
+                if len(known | values) > self.limit:
+                    promote.append(name)
+                else:
+                    known |= values
+                changed.add(name)
+            if promote:
+                pending: Dict[str, Counter] = defaultdict(Counter)
+                for offset, name, value, _ in rows:
+                    if name in promote:
+                        pending[name][(sources[offset], value)] += 1
+                for name in promote:
+                    self._promote(cur, name, pending[name])
+            if changed:
+                self._persist_fields(cur, changed)
+
+            stored: List[tuple] = []
+            batch: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+            for row in rows:
+                name = row[1]
+                if name not in self._promoted:
+                    stored.append(row)
+                elif name not in promote:
+                    batch[(name, sources[row[0]])][row[2]] += 1
+            evicted: Set[Tuple[str, str]] = set()
+            for (name, source), counts in batch.items():
+                sketch = self._sketch(name, source, evicted)
+                for value, n in counts.items():
+                    sketch.top.add(value, n)
+                    sketch.distinct.add(value)
+                    sketch.total += n
+            self._save(cur, set(batch), evicted)
+        return stored
+
+    def promoted(self) -> Set[str]:
+        return set(self._promoted)
+
+    def snapshot(self, source: Optional[str], top: int) -> Dict[str, Dict]:
+        """Top values and distinct estimate of every promoted field.
+
+        Without ``source`` the sketches of all sources are merged. A source
+        folded into OTHER_SOURCE only counts in that merged view.
+        """
+        out: Dict[str, Dict] = {}
+        with self._lock:
+            merged: Dict[str, FieldSketch] = {}
+            for name, sketches in self._sketches.items():
+                for src, sketch in sketches.items():
+                    if source is not None and src != source:
+                        continue
+                    acc = merged.get(name)
+                    if acc is None:
+                        acc = merged[name] = self._new_sketch()
+                    acc.merge(sketch)
+            for name, sketch in merged.items():
+                out[name] = {
+                    "top": sketch.top.top(top),
+                    "distinct": sketch.distinct.estimate(),
+                    "total": sketch.total,
+                }
+        return out
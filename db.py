@@ -0,0 +1,160 @@
+import logging
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional
+
+logger = logging.getLogger("loglens.db")
+
+WriteFn = Callable[..., Any]
+
+_STOP = object()
+# How often a read() waiting for a pooled reader checks that the database is
+# still open; close() does not hand readers back to waiters.
+_READ_POLL_SECONDS = 0.5
+
+
+def _tune(database: sqlite3.Connection, cache_kib: int, mmap_bytes: int) -> None:
+    database.execute("PRAGMA synchronous=NORMAL;")
+    database.execute(f"PRAGMA cache_size=-{int(cache_kib)};")
+    database.execute(f"PRAGMA mmap_size={int(mmap_bytes)};")
+    database.execute("PRAGMA temp_store=MEMORY;")
+
+
+class Database:
+    """One writer connection owned by a thread, plus a pool of WAL readers.
+
+    Writes are functions taking the writer connection; they run one at a
+    time, in submission order, on the writer thread. Readers are opened
+    read-only and handed out by read(), so queries run concurrently with
+    each other and with the writer.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        readers: int = 4,
+        cache_kib: int = 65536,
+        mmap_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.path = Path(path)
+        self.reader_count = max(1, readers)
+        self.cache_kib = cache_kib
+        self.mmap_bytes = mmap_bytes
+        self._writes: "queue.Queue[Any]" = queue.Queue()
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all_readers: List[sqlite3.Connection] = []
+        self._writer: Optional[sqlite3.Connection] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def open(self, init: Optional[WriteFn] = None) -> None:
+        """Start the writer, run ``init`` on it, then open the readers."""
+        ready: Future = Future()
+        self._thread = threading.Thread(target=self._run_writer, args=(ready,), name="loglens-db-writer", daemon=True)
+        self._thread.start()
+        ready.result()
+        if init is not None:
+            self.write(init)
+        # Readers need the database and its WAL index to exist already.
+        for _ in range(self.reader_count):
+            reader = self._connect_reader()
+            self._all_readers.append(reader)
+            self._readers.put(reader)
+
+    def _connect_reader(self) -> sqlite3.Connection:
+        reader = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        _tune(reader, self.cache_kib, self.mmap_bytes)
+        return reader
+
+    def _run_writer(self, ready: Future) -> None:
+        try:
+            writer = sqlite3.connect(str(self.path))
+            writer.execute("PRAGMA journal_mode=WAL;")
+            _tune(writer, self.cache_kib, self.mmap_bytes)
+        except Exception as exc:
+            ready.set_exception(exc)
+            return
+        self._writer = writer
+        ready.set_result(None)
+        while True:
+            item = self._writes.get()
+            if item is _STOP:
+                break
+            fn, args, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(writer, *args))
+            except BaseException as exc:
+                if writer.in_transaction:
+                    writer.rollback()
+                future.set_exception(exc)
+        writer.close()
+        self._writer = None
+
+    def submit(self, fn: WriteFn, *args: Any) -> Future:
+        """Queue ``fn(writer_conn, *args)`` on the writer thread."""
+        if self._thread is None or not self._thread.is_alive():
+            raise RuntimeError("Database is not open")
+        future: Future = Future()
+        self._writes.put((fn, args, future))
+        return future
+
+    def write(self, fn: WriteFn, *args: Any) -> Any:
+        return self.submit(fn, *args).result()
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a reader; everything inside sees one database snapshot."""
+        while True:
+            if not self.is_open:
+                raise RuntimeError("Database is not open")
+            try:
+                reader = self._readers.get(timeout=_READ_POLL_SECONDS)
+                break
+            except queue.Empty:
+                continue
+        try:
+            reader.execute("BEGIN")
+            yield reader
+        finally:
+            try:
+                reader.rollback()
+            except sqlite3.ProgrammingError:
+                # Closed by close() while borrowed; it is not pooled again.
+                pass
+            else:
+                self._readers.put(reader)
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """A snapshot on a connection of its own, for long scans.
+
+        Unlike read() it does not take a reader from the pool, so a slow
+        consumer cannot starve other queries.
+        """
+        if not self.is_open:
+            raise RuntimeError("Database is not open")
+        reader = self._connect_reader()
+        try:
+            reader.execute("BEGIN")
+            yield reader
+        finally:
+            reader.close()
+
+    @property
+    def is_open(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._writes.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        for reader in self._all_readers:
+            reader.close()
+        self._all_readers.clear()
+        self._readers = queue.LifoQueue()
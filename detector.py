@@ -2,8 +2,14 @@ import csv
 import io
 import json
 import re
-from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import timestamps
+
+try:  # optional faster decoder; the stdlib json module is the fallback
+    import orjson
+except ImportError:
+    orjson = None
 
 
 SYSLOG_RE = re.compile(
@@ -27,61 +33,58 @@ LEVEL_HINTS = {
     "fatal": "ERROR",
 }
 
+# All hints in one alternation, scanned once per value. When a value holds
+# several hints the earliest one in LEVEL_HINTS wins, as with the old
+# per-key search.
+LEVEL_RANK = {k: i for i, k in enumerate(LEVEL_HINTS)}
+LEVEL_BY_RANK = list(LEVEL_HINTS.values())
+LEVEL_RE = re.compile(r"\b(" + "|".join(re.escape(k) for k in sorted(LEVEL_HINTS, key=len, reverse=True)) + r")\b")
+
 ISO_TS_RE = re.compile(r"\d{4}-\d{2}-\d{2}[T\s]\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?")
-NUM_RE = re.compile(r"[-+]?\d*\.\d+|[-+]?\d+")
-
-
-def _normalize_timestamp(value: Optional[str]) -> str:
-    if not value:
-        return datetime.utcnow().isoformat()
-    val = value.strip()
-    if not val:
-        return datetime.utcnow().isoformat()
-    formats = [
-        "%Y-%m-%d %H:%M:%S",
-        "%Y-%m-%dT%H:%M:%S",
-        "%Y-%m-%dT%H:%M:%S.%f",
-        "%Y-%m-%d %H:%M:%S.%f",
-        "%b %d %H:%M:%S",
-        "%d/%b/%Y:%H:%M:%S %z",
-        "%Y-%m-%dT%H:%M:%S%z",
-        "%Y-%m-%d %H:%M:%S%z",
-    ]
-    for f in formats:
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WS_RE = re.compile(r"[ \t\n\r]*")
+
+
+def json_loads(data: str) -> Any:
+    if orjson is not None:
         try:
-            dt = datetime.strptime(val, f)
-            if dt.year == 1900:
-                dt = dt.replace(year=datetime.utcnow().year)
-            return dt.isoformat()
-        except ValueError:
-            continue
-    try:
-        return datetime.fromisoformat(val.replace("Z", "+00:00")).isoformat()
-    except Exception:
-        return datetime.utcnow().isoformat()
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter (NaN, big ints); let the stdlib decide.
+            pass
+    return json.loads(data)
+
+
+def json_dumps(obj: Any) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj)
+
+
+def _normalize_timestamp(value: Optional[str], key: Optional[Tuple[str, str]] = None) -> str:
+    return timestamps.normalize(value, key)
 
 
 def _guess_level(*values: str) -> str:
     for value in values:
         if not value:
             continue
-        low = str(value).lower()
-        for k, v in LEVEL_HINTS.items():
-            if re.search(rf"\b{k}\b", low):
-                return v
+        best = None
+        for m in LEVEL_RE.finditer(str(value).lower()):
+            rank = LEVEL_RANK[m.group(1)]
+            if rank == 0:
+                return LEVEL_BY_RANK[0]
+            if best is None or rank < best:
+                best = rank
+        if best is not None:
+            return LEVEL_BY_RANK[best]
     return "INFO"
 
 
-def _extract_numbers(text: str) -> Dict[str, float]:
-    metrics: Dict[str, float] = {}
-    for i, n in enumerate(NUM_RE.findall(text or "")):
-        try:
-            metrics[f"value_{i+1}"] = float(n)
-        except ValueError:
-            continue
-    return metrics
-
-
 def _parse_json_obj(obj: Dict[str, Any], fallback_source: str, raw: str) -> Dict[str, Any]:
     ts = obj.get("timestamp") or obj.get("time") or obj.get("ts")
     level = obj.get("level") or obj.get("severity") or obj.get("log_level") or ""
@@ -106,7 +109,7 @@ def _parse_json_obj(obj: Dict[str, Any], fallback_source: str, raw: str) -> Dict
         string_fields.pop(skip, None)
         numeric_fields.pop(skip, None)
     return {
-        "timestamp": _normalize_timestamp(str(ts) if ts is not None else None),
+        "timestamp": _normalize_timestamp(str(ts) if ts is not None else None, (fallback_source, "json")),
         "source": str(source),
         "level": _guess_level(str(level), str(msg)),
         "message": str(msg),
@@ -117,154 +120,643 @@ def _parse_json_obj(obj: Dict[str, Any], fallback_source: str, raw: str) -> Dict
     }
 
 
-def detect_and_parse(text: str, source: str = "ingest") -> List[Dict[str, Any]]:
-    lines = [ln for ln in (text or "").splitlines() if ln.strip()]
-    if not lines:
-        return []
+def parse_json_objects(
+    objs: Iterable[Any], source: str = "ingest", raws: Optional[Iterable[Optional[str]]] = None
+) -> List[Dict[str, Any]]:
+    """Structured ingest: parse already-decoded JSON values.
+
+    ``raws`` optionally gives the original text of each value, stored as
+    raw_line as-is; values without one are re-serialized.
+    """
+    with timestamps.batch():
+        parsed: List[Dict[str, Any]] = []
+        for item, raw in zip(objs, raws if raws is not None else _repeat_none()):
+            parsed.extend(_parse_json_item(item, source, raw))
+        return parsed
+
+
+def _repeat_none() -> Iterable[None]:
+    while True:
+        yield None
+
+
+def _parse_json_item(item: Any, source: str, raw: Optional[str] = None) -> List[Dict[str, Any]]:
+    if isinstance(item, dict):
+        return [_parse_json_obj(item, source, raw if raw is not None else json_dumps(item))]
+    return detect_and_parse(str(item), source=source)
 
-    # whole-body JSON array or object
-    try:
-        body_json = json.loads(text)
-        if isinstance(body_json, dict):
-            return [_parse_json_obj(body_json, source, text.strip())]
-        if isinstance(body_json, list):
-            parsed = []
-            for item in body_json:
-                if isinstance(item, dict):
-                    parsed.append(_parse_json_obj(item, source, json.dumps(item)))
-                else:
-                    raw = str(item)
-                    parsed.extend(detect_and_parse(raw, source=source))
-            return parsed
-    except json.JSONDecodeError:
-        pass
 
-    # Try line-by-line JSON lines
-    jsonl_ok = True
-    jsonl_entries: List[Dict[str, Any]] = []
+def _iter_json_array(text: str) -> List[Tuple[Any, str]]:
+    # Decodes a JSON array element by element so each element keeps its
+    # original text. Raises ValueError unless the whole text is one array.
+    end = len(text)
+    idx = _JSON_WS_RE.match(text, 0).end()
+    if idx >= end or text[idx] != "[":
+        raise ValueError("not a JSON array")
+    idx = _JSON_WS_RE.match(text, idx + 1).end()
+    items: List[Tuple[Any, str]] = []
+    if idx < end and text[idx] == "]":
+        idx += 1
+    else:
+        while True:
+            item, stop = _JSON_DECODER.raw_decode(text, idx)
+            items.append((item, text[idx:stop]))
+            idx = _JSON_WS_RE.match(text, stop).end()
+            if idx < end and text[idx] == ",":
+                idx = _JSON_WS_RE.match(text, idx + 1).end()
+                continue
+            if idx < end and text[idx] == "]":
+                idx += 1
+                break
+            raise ValueError("malformed JSON array")
+    if _JSON_WS_RE.match(text, idx).end() != end:
+        raise ValueError("trailing data after JSON array")
+    return items
+
+
+def parse_json_text(text: str, source: str = "ingest") -> Optional[List[Dict[str, Any]]]:
+    """Parse a body holding one JSON object or array, or return None."""
+    body = text.strip()
+    if body.startswith("["):
+        try:
+            items = _iter_json_array(body)
+        except ValueError:
+            return None
+        return parse_json_objects([i for i, _ in items], source, [r for _, r in items])
+    if body.startswith("{"):
+        try:
+            obj = json_loads(body)
+        except ValueError:
+            return None
+        if isinstance(obj, dict):
+            with timestamps.batch():
+                return [_parse_json_obj(obj, source, body)]
+    return None
+
+
+def _parse_jsonl(lines: List[str], source: str) -> Optional[List[Dict[str, Any]]]:
+    entries: List[Dict[str, Any]] = []
     for line in lines:
         try:
-            obj = json.loads(line)
-            if isinstance(obj, dict):
-                jsonl_entries.append(_parse_json_obj(obj, source, line))
-            else:
-                jsonl_ok = False
-                break
-        except json.JSONDecodeError:
-            jsonl_ok = False
-            break
-    if jsonl_ok and jsonl_entries:
-        return jsonl_entries
-
-    # CSV/TSV detection
-    if len(lines) >= 2:
-        sample = "\n".join(lines[:10])
+            obj = json_loads(line)
+        except ValueError:
+            return None
+        if not isinstance(obj, dict):
+            return None
+        entries.append(_parse_json_obj(obj, source, line))
+    return entries
+
+
+def sniff_csv(lines: List[str]) -> Optional[Any]:
+    if len(lines) < 2:
+        return None
+    sample = "\n".join(lines[:10])
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",\t|;")
+    except csv.Error:
+        return None
+    header = next(csv.reader([lines[0]], dialect=dialect), [])
+    if len(header) <= 1:
+        return None
+    return dialect
+
+
+def _csv_row_entry(row: Dict[str, Any], source: str) -> Optional[Dict[str, Any]]:
+    if not row:
+        return None
+    row_clean = {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
+    msg = row_clean.get("message") or row_clean.get("msg") or " ".join(
+        [f"{k}={v}" for k, v in row_clean.items() if v]
+    )
+    ts = row_clean.get("timestamp") or row_clean.get("time") or row_clean.get("date")
+    level = row_clean.get("level") or row_clean.get("severity") or ""
+    src = row_clean.get("source") or row_clean.get("service") or source
+    numeric_fields = {}
+    string_fields = {}
+    for k, v in row_clean.items():
+        if v in (None, ""):
+            continue
         try:
-            dialect = csv.Sniffer().sniff(sample, delimiters=",\t|;")
-            reader = csv.DictReader(io.StringIO(text), dialect=dialect)
-            if reader.fieldnames and len(reader.fieldnames) > 1:
-                out = []
-                for row in reader:
-                    if not row:
-                        continue
-                    row_clean = {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
-                    msg = row_clean.get("message") or row_clean.get("msg") or " ".join(
-                        [f"{k}={v}" for k, v in row_clean.items() if v]
-                    )
-                    ts = row_clean.get("timestamp") or row_clean.get("time") or row_clean.get("date")
-                    level = row_clean.get("level") or row_clean.get("severity") or ""
-                    src = row_clean.get("source") or row_clean.get("service") or source
-                    numeric_fields = {}
-                    string_fields = {}
-                    for k, v in row_clean.items():
-                        if v in (None, ""):
-                            continue
-                        try:
-                            numeric_fields[k] = float(v)
-                        except Exception:
-                            string_fields[k] = str(v)
-                    out.append(
-                        {
-                            "timestamp": _normalize_timestamp(str(ts) if ts else None),
-                            "source": str(src),
-                            "level": _guess_level(str(level), str(msg)),
-                            "message": str(msg),
-                            "raw_line": ",".join([str(x) for x in row_clean.values()]),
-                            "format_detected": "csv",
-                            "numeric_fields": numeric_fields,
-                            "string_fields": string_fields,
-                        }
-                    )
-                if out:
-                    return out
+            numeric_fields[k] = float(v)
         except Exception:
+            string_fields[k] = str(v)
+    return {
+        "timestamp": _normalize_timestamp(str(ts) if ts else None, (source, "csv")),
+        "source": str(src),
+        "level": _guess_level(str(level), str(msg)),
+        "message": str(msg),
+        "raw_line": ",".join([str(x) for x in row_clean.values()]),
+        "format_detected": "csv",
+        "numeric_fields": numeric_fields,
+        "string_fields": string_fields,
+    }
+
+
+def _syslog_entry(m: "re.Match[str]", line: str, source: str) -> Dict[str, Any]:
+    gd = m.groupdict()
+    msg = gd.get("msg", "")
+    return {
+        "timestamp": _normalize_timestamp(gd.get("ts"), (source, "syslog")),
+        "source": gd.get("proc") or source,
+        "level": _guess_level(msg),
+        "message": msg,
+        "raw_line": line,
+        "format_detected": "syslog",
+        # Free-text numbers become metrics through template mining.
+        "numeric_fields": {},
+        "string_fields": {"hostname": gd.get("host", "")},
+    }
+
+
+def _access_entry(n: "re.Match[str]", line: str, source: str) -> Dict[str, Any]:
+    gd = n.groupdict()
+    status = int(gd["status"])
+    numeric_fields = {
+        "status": float(status),
+        "bytes": float(gd["size"]) if gd.get("size") and gd["size"].isdigit() else 0.0,
+    }
+    if gd.get("rt"):
+        try:
+            numeric_fields["response_time"] = float(gd["rt"])
+        except ValueError:
             pass
+    return {
+        "timestamp": _normalize_timestamp(gd.get("ts"), (source, "access_log")),
+        "source": source if source != "ingest" else "nginx",
+        "level": "ERROR" if status >= 500 else ("WARN" if status >= 400 else "INFO"),
+        "message": f"{gd.get('method')} {gd.get('path')} -> {status}",
+        "raw_line": line,
+        "format_detected": "access_log",
+        "numeric_fields": numeric_fields,
+        "string_fields": {
+            "ip": gd.get("ip", ""),
+            "method": gd.get("method", ""),
+            "path": gd.get("path", ""),
+            "status_group": f"{status // 100}xx",
+        },
+    }
+
+
+def _plain_entry(line: str, source: str) -> Dict[str, Any]:
+    ts_match = ISO_TS_RE.search(line)
+    ts = ts_match.group(0) if ts_match else None
+    return {
+        "timestamp": _normalize_timestamp(ts, (source, "plain")),
+        "source": source,
+        "level": _guess_level(line),
+        "message": line[:1000],
+        "raw_line": line,
+        "format_detected": "plain",
+        "numeric_fields": {},
+        "string_fields": {},
+    }
+
+
+def _parse_line(line: str, source: str) -> Dict[str, Any]:
+    m = SYSLOG_RE.match(line)
+    if m:
+        return _syslog_entry(m, line, source)
+    n = NGINX_RE.match(line)
+    if n:
+        return _access_entry(n, line, source)
+    return _plain_entry(line, source)
+
+
+def _parse_text_lines(lines: List[str], source: str) -> List[Dict[str, Any]]:
+    return [_parse_line(line, source) for line in lines]
+
+
+# --- format registry -------------------------------------------------------
+#
+# Each parser gets a cheap sniff() over the first SNIFF_BYTES of the body and a
+# parse() returning (entries, error_count), or None when the body is plainly
+# not in that format. Errors are lines the parser could not handle itself and
+# handed to the generic per-line chain. Probing follows registration order.
+# The format found for a source is reused for its next bodies as long as it
+# still sniffs positive and stays under FORMAT_ERROR_THRESHOLD; "plain" is the
+# catch-all and is never cached, since it cannot fail.
+
+ParseResult = Tuple[List[Dict[str, Any]], int]
+
 
-    parsed = []
+class FormatParser(NamedTuple):
+    name: str
+    sniff: Callable[[str], bool]
+    parse: Callable[[str, List[str], str], Optional[ParseResult]]
+    cacheable: bool = True
+    # (header, rows) when the body may be parsed in shards of rows, each
+    # prefixed with the header lines; None keeps it whole.
+    split: Optional[Callable[[str, List[str]], Optional[Tuple[List[str], List[str]]]]] = None
+
+
+FORMAT_REGISTRY: Dict[str, FormatParser] = {}
+SNIFF_BYTES = 4096
+# Above this share of error lines a cached format is dropped for the source
+# and the body goes back through full detection.
+FORMAT_ERROR_THRESHOLD = 0.2
+# Parsers give up once this many lines are in and the error share already
+# exceeds the threshold, instead of parsing a mismatched body to the end.
+FORMAT_PROBE_LINES = 256
+SOURCE_FORMAT_CACHE_SIZE = 4096
+_SOURCE_FORMATS: Dict[str, str] = {}
+
+
+def register_format(
+    name: str,
+    sniff: Callable[[str], bool],
+    parse: Callable[[str, List[str], str], Optional[ParseResult]],
+    cacheable: bool = True,
+    split: Optional[Callable[[str, List[str]], Optional[Tuple[List[str], List[str]]]]] = None,
+) -> None:
+    FORMAT_REGISTRY[name] = FormatParser(name, sniff, parse, cacheable, split)
+
+
+def cached_format(source: str) -> Optional[str]:
+    return _SOURCE_FORMATS.get(source)
+
+
+def _remember_format(source: str, name: Optional[str]) -> None:
+    if name is None:
+        _SOURCE_FORMATS.pop(source, None)
+        return
+    if source not in _SOURCE_FORMATS and len(_SOURCE_FORMATS) >= SOURCE_FORMAT_CACHE_SIZE:
+        _SOURCE_FORMATS.pop(next(iter(_SOURCE_FORMATS)))
+    _SOURCE_FORMATS[source] = name
+
+
+def _first_line(head: str) -> str:
+    for line in head.splitlines():
+        if line.strip():
+            return line
+    return ""
+
+
+def _over_threshold(errors: int, seen: int, total: int) -> bool:
+    if errors > FORMAT_ERROR_THRESHOLD * total:
+        return True
+    return seen >= FORMAT_PROBE_LINES and errors > FORMAT_ERROR_THRESHOLD * seen
+
+
+def _sniff_json(head: str) -> bool:
+    return head.lstrip()[:1] in ("[", "{")
+
+
+def _parse_json_body(text: str, lines: List[str], source: str) -> Optional[ParseResult]:
+    entries = parse_json_text(text, source)
+    return (entries, 0) if entries is not None else None
+
+
+def _sniff_jsonl(head: str) -> bool:
+    return _first_line(head).lstrip().startswith("{")
+
+
+def _parse_jsonl_body(text: str, lines: List[str], source: str) -> Optional[ParseResult]:
+    entries: List[Dict[str, Any]] = []
+    errors = 0
     for line in lines:
-        m = SYSLOG_RE.match(line)
-        if m:
-            gd = m.groupdict()
-            msg = gd.get("msg", "")
-            parsed.append(
-                {
-                    "timestamp": _normalize_timestamp(gd.get("ts")),
-                    "source": gd.get("proc") or source,
-                    "level": _guess_level(msg),
-                    "message": msg,
-                    "raw_line": line,
-                    "format_detected": "syslog",
-                    "numeric_fields": _extract_numbers(msg),
-                    "string_fields": {"hostname": gd.get("host", "")},
-                }
-            )
-            continue
+        try:
+            obj = json_loads(line)
+        except ValueError:
+            obj = None
+        if isinstance(obj, dict):
+            entries.append(_parse_json_obj(obj, source, line))
+        elif not entries:
+            return None
+        else:
+            errors += 1
+            if _over_threshold(errors, len(entries), len(lines)):
+                return None
+            entries.append(_parse_line(line, source))
+    return entries, errors
+
+
+def _sniff_csv_head(head: str) -> bool:
+    first = _first_line(head)
+    return not _sniff_json(first) and any(d in first for d in ",\t|;")
+
+
+def _parse_csv_body(text: str, lines: List[str], source: str) -> Optional[ParseResult]:
+    dialect = sniff_csv(lines)
+    if dialect is None:
+        return None
+    try:
+        reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+        entries: List[Dict[str, Any]] = []
+        errors = 0
+        for row in reader:
+            # DictReader files surplus cells under None and pads short rows with None
+            if None in row or None in row.values():
+                errors += 1
+            entry = _csv_row_entry(row, source)
+            if entry:
+                entries.append(entry)
+    except Exception:
+        return None
+    if not entries:
+        return None
+    return entries, errors
+
+
+def _line_parser(pattern: "re.Pattern[str]", build: Callable[..., Dict[str, Any]]) -> Callable[..., Optional[ParseResult]]:
+    def parse(text: str, lines: List[str], source: str) -> Optional[ParseResult]:
+        entries = []
+        errors = 0
+        for line in lines:
+            m = pattern.match(line)
+            if m:
+                entries.append(build(m, line, source))
+            else:
+                errors += 1
+                if _over_threshold(errors, len(entries), len(lines)):
+                    return None
+                entries.append(_parse_line(line, source))
+        return entries, errors
+    return parse
+
+
+def _sniff_line(pattern: "re.Pattern[str]") -> Callable[[str], bool]:
+    return lambda head: pattern.match(_first_line(head)) is not None
+
+
+def _parse_plain_body(text: str, lines: List[str], source: str) -> Optional[ParseResult]:
+    return _parse_text_lines(lines, source), 0
+
+
+def _split_lines(text: str, lines: List[str]) -> Optional[Tuple[List[str], List[str]]]:
+    return [], lines
+
+
+def _split_csv(text: str, lines: List[str]) -> Optional[Tuple[List[str], List[str]]]:
+    # Quoted fields may span lines; those bodies keep the single reader.
+    if '"' in text:
+        return None
+    return lines[:1], lines[1:]
+
+
+register_format("json", _sniff_json, _parse_json_body)
+register_format("jsonl", _sniff_jsonl, _parse_jsonl_body, split=_split_lines)
+register_format("csv", _sniff_csv_head, _parse_csv_body, split=_split_csv)
+register_format("syslog", _sniff_line(SYSLOG_RE), _line_parser(SYSLOG_RE, _syslog_entry), split=_split_lines)
+register_format("access_log", _sniff_line(NGINX_RE), _line_parser(NGINX_RE, _access_entry), split=_split_lines)
+register_format("plain", lambda head: True, _parse_plain_body, cacheable=False, split=_split_lines)
 
-        n = NGINX_RE.match(line)
-        if n:
-            gd = n.groupdict()
-            status = int(gd["status"])
-            numeric_fields = {
-                "status": float(status),
-                "bytes": float(gd["size"]) if gd.get("size") and gd["size"].isdigit() else 0.0,
-            }
-            if gd.get("rt"):
-                try:
-                    numeric_fields["response_time"] = float(gd["rt"])
-                except ValueError:
-                    pass
-            parsed.append(
-                {
-                    "timestamp": _normalize_timestamp(gd.get("ts")),
-                    "source": source if source != "ingest" else "nginx",
-                    "level": "ERROR" if status >= 500 else ("WARN" if status >= 400 else "INFO"),
-                    "message": f"{gd.get('method')} {gd.get('path')} -> {status}",
-                    "raw_line": line,
-                    "format_detected": "access_log",
-                    "numeric_fields": numeric_fields,
-                    "string_fields": {
-                        "ip": gd.get("ip", ""),
-                        "method": gd.get("method", ""),
-                        "path": gd.get("path", ""),
-                        "status_group": f"{status // 100}xx",
-                    },
-                }
-            )
+
+def _acceptable(result: Optional[ParseResult]) -> bool:
+    if result is None or not result[0]:
+        return False
+    entries, errors = result
+    return errors / len(entries) <= FORMAT_ERROR_THRESHOLD
+
+
+def _parse_with(fmt: FormatParser, text: str, lines: List[str], source: str) -> Optional[ParseResult]:
+    return fmt.parse(text, lines, source)
+
+
+def parse_shard(name: str, header: List[str], rows: List[str], source: str) -> Optional[ParseResult]:
+    """Parse ``header + rows`` with a registered format; the parse pool's unit of work.
+
+    Runs in worker processes, so only formats registered at import time are
+    available there.
+    """
+    lines = header + rows
+    with timestamps.batch():
+        return FORMAT_REGISTRY[name].parse("\n".join(lines), lines, source)
+
+
+def detect_and_parse(
+    text: str, source: str = "ingest", parse: Callable[..., Optional[ParseResult]] = _parse_with
+) -> List[Dict[str, Any]]:
+    """Parse a body with the format cached for ``source``, else the first that fits.
+
+    ``parse(fmt, text, lines, source)`` runs one candidate format; the parse
+    pool replaces it to spread the work over processes.
+    """
+    with timestamps.batch():
+        return _detect_and_parse(text, source, parse)
+
+
+def _detect_and_parse(text: str, source: str, parse: Callable[..., Optional[ParseResult]]) -> List[Dict[str, Any]]:
+    lines = [ln for ln in (text or "").splitlines() if ln.strip()]
+    if not lines:
+        return []
+    return _detect(text, lines, source, parse)[1]
+
+
+def _detect(
+    text: str,
+    lines: List[str],
+    source: str,
+    parse: Callable[..., Optional[ParseResult]] = _parse_with,
+    skip: Tuple[str, ...] = (),
+) -> Tuple[Optional[FormatParser], List[Dict[str, Any]]]:
+    """The format chosen for a body and its entries; None when no format fit."""
+    head = text[:SNIFF_BYTES]
+    cached = FORMAT_REGISTRY.get(_SOURCE_FORMATS.get(source, ""))
+    if cached is not None and cached.name not in skip:
+        result = parse(cached, text, lines, source) if cached.sniff(head) else None
+        if _acceptable(result):
+            return cached, result[0]
+        _remember_format(source, None)
+
+    for fmt in FORMAT_REGISTRY.values():
+        if fmt is cached or fmt.name in skip or not fmt.sniff(head):
             continue
+        result = parse(fmt, text, lines, source)
+        if _acceptable(result):
+            if fmt.cacheable:
+                _remember_format(source, fmt.name)
+            return fmt, result[0]
+
+    return None, _parse_text_lines(lines, source)
+
 
-        # fallback
-        ts_match = ISO_TS_RE.search(line)
-        ts = ts_match.group(0) if ts_match else None
-        parsed.append(
-            {
-                "timestamp": _normalize_timestamp(ts),
-                "source": source,
-                "level": _guess_level(line),
-                "message": line[:1000],
-                "raw_line": line,
-                "format_detected": "plain",
-                "numeric_fields": _extract_numbers(line),
-                "string_fields": {},
-            }
-        )
-    return parsed
+def _looks_like_json_array(text: str) -> bool:
+    body = text.lstrip()
+    if not body.startswith("["):
+        return False
+    idx = 1
+    while idx < len(body) and body[idx].isspace():
+        idx += 1
+    if idx < len(body) and body[idx] == "]":
+        return True
+    try:
+        _, idx = _JSON_DECODER.raw_decode(body, idx)
+    except json.JSONDecodeError:
+        return False
+    while idx < len(body) and body[idx].isspace():
+        idx += 1
+    return idx < len(body) and body[idx] in ",]"
+
+
+class StreamParser:
+    """Incremental counterpart of detect_and_parse for bodies read in chunks.
+
+    Text is fed with feed(); complete lines are parsed as soon as the format
+    is known and returned, so memory stays bounded by the detection window
+    plus one chunk. The format is chosen once, through the registry and the
+    source's cached format, from the first ``detect_bytes`` of input (the
+    whole body when it is shorter, exactly as detect_and_parse would). Line
+    formats then parse each chunk with the chosen parser. A JSON array body
+    is decoded element by element; an element still undecodable after
+    ``max_element_bytes`` ends it and the rest is read as plain lines. A
+    single multi-line JSON object has no line structure and is buffered
+    whole. CSV rows are read line by line, so quoted fields spanning lines
+    are not supported in this mode.
+    """
+
+    def __init__(
+        self, source: str = "ingest", detect_bytes: int = 64 * 1024, max_element_bytes: int = 1024 * 1024
+    ) -> None:
+        self.source = source
+        self.detect_bytes = detect_bytes
+        self.max_element_bytes = max_element_bytes
+        # A registry format name, "json_array", or None until detected.
+        self.format: Optional[str] = None
+        self._fmt: Optional[FormatParser] = None
+        self._header: List[str] = []
+        self._carry = ""
+        self._head: List[str] = []
+        self._head_size = 0
+        self._json_buf = ""
+        self._json_started = False
+        self._json_done = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        with timestamps.batch():
+            return self._feed(chunk)
+
+    def close(self) -> List[Dict[str, Any]]:
+        with timestamps.batch():
+            return self._close()
+
+    def _feed(self, chunk: str) -> List[Dict[str, Any]]:
+        if self.format in ("json_array", "json"):
+            return self._feed_json(chunk, final=False)
+        lines = (self._carry + chunk).splitlines(keepends=True)
+        if lines and not lines[-1].endswith(("\n", "\r")):
+            self._carry = lines.pop()
+        else:
+            self._carry = ""
+        return self._feed_lines([ln.rstrip("\r\n") for ln in lines], final=False)
+
+    def _close(self) -> List[Dict[str, Any]]:
+        if self.format in ("json_array", "json"):
+            return self._feed_json("", final=True)
+        tail = [self._carry] if self._carry else []
+        self._carry = ""
+        return self._feed_lines(tail, final=True)
+
+    def _feed_lines(self, lines: List[str], final: bool) -> List[Dict[str, Any]]:
+        lines = [ln for ln in lines if ln.strip()]
+        if self.format is not None:
+            return self._parse_lines(lines)
+        self._head.extend(lines)
+        self._head_size += sum(len(ln) for ln in lines)
+        if self._head_size < self.detect_bytes and not final:
+            return []
+        head, self._head = self._head, []
+        out = self._detect(head, final)
+        if self.format in ("json_array", "json"):
+            out.extend(self._feed_json("", final=final))
+        return out
+
+    def _detect(self, head: List[str], final: bool) -> List[Dict[str, Any]]:
+        if not head:
+            self._use(FORMAT_REGISTRY.get("plain"), [])
+            return []
+        head_text = "\n".join(head)
+        if final:
+            # The whole body: the same choice as a non-streamed upload.
+            fmt, entries = _detect(head_text, head, self.source)
+            self._use(fmt, head)
+            return entries
+        json_fmt = FORMAT_REGISTRY.get("json")
+        if json_fmt is not None and json_fmt.sniff(head_text):
+            is_object_doc = head[0].lstrip().startswith("{") and _parse_jsonl(head[:1], self.source) is None
+            if is_object_doc or _looks_like_json_array(head_text):
+                self.format = "json" if is_object_doc else "json_array"
+                self._json_buf = head_text + "\n" + self._carry
+                self._carry = ""
+                return []
+        # Only part of the body is here, so a whole-body format cannot be judged.
+        fmt, entries = _detect(head_text, head, self.source, skip=("json",))
+        self._use(fmt, head)
+        return entries
+
+    def _use(self, fmt: Optional[FormatParser], head: List[str]) -> None:
+        self._fmt = fmt if fmt is not None else FORMAT_REGISTRY.get("plain")
+        self.format = self._fmt.name if self._fmt is not None else "plain"
+        self._header = []
+        if self._fmt is not None and self._fmt.split is not None:
+            parts = self._fmt.split("\n".join(head), head)
+            # Only CSV declines to split, for quoted cells; rows here are
+            # single lines regardless, so its header is the first line.
+            self._header = parts[0] if parts is not None else head[:1]
+
+    def _parse_lines(self, lines: List[str]) -> List[Dict[str, Any]]:
+        fmt = self._fmt
+        if not lines or fmt is None:
+            return _parse_text_lines(lines, self.source)
+        chunk = self._header + lines
+        result = fmt.parse("\n".join(chunk), chunk, self.source)
+        if result is not None:
+            return result[0]
+        # The chunk as a whole did not fit (e.g. it starts with a bad line):
+        # line by line, like the parser's own fallback.
+        out: List[Dict[str, Any]] = []
+        for line in lines:
+            one = self._header + [line]
+            result = fmt.parse("\n".join(one), one, self.source)
+            out.extend(result[0] if result is not None else [_parse_line(line, self.source)])
+        return out
+
+    def _feed_json(self, chunk: str, final: bool) -> List[Dict[str, Any]]:
+        self._json_buf += chunk
+        if self.format == "json":
+            if not final:
+                return []
+            text, self._json_buf = self._json_buf, ""
+            return detect_and_parse(text, source=self.source)
+
+        out: List[Dict[str, Any]] = []
+        buf = self._json_buf
+        idx = 0
+        end = len(buf)
+        while not self._json_done:
+            while idx < end and (buf[idx].isspace() or (self._json_started and buf[idx] == ",")):
+                idx += 1
+            if idx >= end:
+                break
+            if not self._json_started:
+                self._json_started = True
+                idx += 1  # the opening "[" checked by _looks_like_json_array
+                continue
+            if buf[idx] == "]":
+                self._json_done = True
+                _remember_format(self.source, "json")
+                idx += 1
+                break
+            try:
+                item, stop = _JSON_DECODER.raw_decode(buf, idx)
+            except json.JSONDecodeError:
+                if final:
+                    # Truncated or malformed array: keep what is left as text.
+                    self._json_done = True
+                elif end - idx > self.max_element_bytes:
+                    # Malformed, not just incomplete: stop buffering the body.
+                    self._json_done = True
+                    rest, self._json_buf = buf[idx:], ""
+                    self._use(FORMAT_REGISTRY.get("plain"), [])
+                    out.extend(self._feed(rest))
+                    return out
+                break
+            if stop >= end and not final:
+                # A bare number or literal may continue in the next chunk.
+                break
+            out.extend(_parse_json_item(item, self.source, buf[idx:stop]))
+            idx = stop
+        self._json_buf = buf[idx:]
+        if final and self._json_buf.strip():
+            rest, self._json_buf = self._json_buf, ""
+            out.extend(detect_and_parse(rest, source=self.source))
+        return out
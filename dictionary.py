@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+# Short strings repeated on every row (source, level, format, category names
+# and values) are stored once in ``strings`` and referenced by integer id.
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS strings (
+    id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL UNIQUE
+);
+"""
+
+# SQLite's default limit on host parameters is 999 before 3.32.
+_IN_CHUNK = 500
+
+
+def _chunks(items: List, size: int = _IN_CHUNK) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class StringDictionary:
+    """In-process cache over the ``strings`` table, in both directions.
+
+    encode() runs on the writer inside the ingest transaction and may insert
+    new strings; their ids only enter the cache through remember(), called
+    once the transaction has committed, so a rollback never leaves dangling
+    ids behind. Readers use decode() and id_of(), which fall back to the
+    table for anything not cached yet.
+    """
+
+    def __init__(self, max_size: int = 200000) -> None:
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._ids: Dict[str, int] = {}
+        self._values: Dict[int, str] = {}
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute("SELECT id, value FROM strings ORDER BY id LIMIT ?", (self.max_size,)).fetchall()
+        with self._lock:
+            self._values = dict(rows)
+            self._ids = {value: sid for sid, value in rows}
+
+    def remember(self, mapping: Dict[str, int]) -> None:
+        with self._lock:
+            if len(self._ids) + len(mapping) > self.max_size:
+                # Rarely hit; misses are looked up again in the table.
+                self._ids = {}
+                self._values = {}
+            for value, sid in mapping.items():
+                self._ids[value] = sid
+                self._values[sid] = value
+
+    def encode(self, cur: sqlite3.Cursor, values: Iterable[str]) -> Dict[str, int]:
+        """Ids of ``values``, inserting the unknown ones in the open transaction."""
+        ids = self._ids
+        out: Dict[str, int] = {}
+        missing: List[str] = []
+        for value in set(values):
+            sid = ids.get(value)
+            if sid is None:
+                missing.append(value)
+            else:
+                out[value] = sid
+        if missing:
+            cur.executemany("INSERT OR IGNORE INTO strings (value) VALUES (?)", ((v,) for v in missing))
+            for chunk in _chunks(missing):
+                marks = ",".join("?" * len(chunk))
+                out.update(cur.execute(f"SELECT value, id FROM strings WHERE value IN ({marks})", chunk))
+        return out
+
+    def decode(self, conn: sqlite3.Connection, ids: Iterable[int]) -> Dict[int, str]:
+        values = self._values
+        out: Dict[int, str] = {}
+        missing: List[int] = []
+        for sid in set(ids):
+            value = values.get(sid)
+            if value is None:
+                missing.append(sid)
+            else:
+                out[sid] = value
+        if missing:
+            found: Dict[int, str] = {}
+            for chunk in _chunks(missing):
+                marks = ",".join("?" * len(chunk))
+                found.update(conn.execute(f"SELECT id, value FROM strings WHERE id IN ({marks})", chunk))
+            self.remember({value: sid for sid, value in found.items()})
+            out.update(found)
+        return out
+
+    def id_of(self, conn: sqlite3.Connection, value: str) -> Optional[int]:
+        sid = self._ids.get(value)
+        if sid is None:
+            row = conn.execute("SELECT id FROM strings WHERE value = ?", (value,)).fetchone()
+            if row is None:
+                return None
+            sid = row[0]
+            self.remember({value: sid})
+        return sid
+
+    def decode_rows(self, conn: sqlite3.Connection, rows: List[tuple], columns: Iterable[int]) -> List[tuple]:
+        """``rows`` with the id ``columns`` replaced by their strings."""
+        columns = list(columns)
+        if not rows:
+            return rows
+        values = self.decode(conn, (row[c] for row in rows for c in columns))
+        out = []
+        for row in rows:
+            row = list(row)
+            for c in columns:
+                row[c] = values.get(row[c], "")
+            out.append(tuple(row))
+        return out
@@ -1,6 +1,9 @@
 from collections import Counter, defaultdict
 from typing import Dict, Iterable, List, Tuple
 
+# Fields with more distinct values than this are not worth a category chart.
+CATEGORY_CARDINALITY_LIMIT = 50
+
 
 def metric_name_normalize(name: str) -> str:
     return (
@@ -38,7 +41,7 @@ def derive_metrics_and_categories(entries: List[Dict]) -> Tuple[Dict[str, List[f
 
     varying_numeric = {k: v for k, v in numeric_map.items() if len(set(v)) > 1 or len(v) == 1}
     compact_categories = {
-        k: c for k, c in category_map.items() if 0 < len(c) <= 50
+        k: c for k, c in category_map.items() if 0 < len(c) <= CATEGORY_CARDINALITY_LIMIT
     }
     return varying_numeric, compact_categories
 
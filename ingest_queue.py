@@ -0,0 +1,335 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from itertools import chain
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from detector import json_dumps
+
+logger = logging.getLogger("loglens.ingest")
+
+Entries = List[Dict[str, Any]]
+CommitFn = Callable[[Entries], Any]
+
+CHECKPOINT = "checkpoint"
+DEAD_LETTER = "dead-letter"
+
+
+class Position(NamedTuple):
+    segment: int
+    offset: int
+
+
+class Spool:
+    """Append-only record of accepted entries that are not committed yet.
+
+    One JSON line per accepted request, in numbered segment files. The
+    checkpoint names the position up to which everything is committed;
+    segments before it are deleted. Lines are flushed, not fsynced: like
+    the database (synchronous=NORMAL) the spool survives a process crash,
+    not a power loss. Replay is at-least-once: a group committed right
+    before a crash, ahead of its checkpoint, is committed again. Entries
+    whose commit failed are kept in a dead-letter file and queued again by
+    the next start.
+    """
+
+    def __init__(self, directory: Path, segment_bytes: int = 64 * 1024 * 1024) -> None:
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._checkpoint = self._read_checkpoint()
+        # Always append to a fresh segment: the last one may end in a line
+        # torn by a crash.
+        self._segment = max(self._segments() + [self._checkpoint.segment]) + 1
+        self._file = open(self._path(self._segment), "ab")
+
+    def _path(self, segment: int) -> Path:
+        return self.directory / f"{segment:010d}.spool"
+
+    def _segments(self) -> List[int]:
+        return sorted(int(p.stem) for p in self.directory.glob("*.spool") if p.stem.isdigit())
+
+    def _read_checkpoint(self) -> Position:
+        try:
+            segment, offset = (self.directory / CHECKPOINT).read_text().split()
+            return Position(int(segment), int(offset))
+        except (OSError, ValueError):
+            return Position(0, 0)
+
+    @staticmethod
+    def encode(entries: Entries) -> bytes:
+        return (json_dumps(entries) + "\n").encode("utf-8")
+
+    def append(self, line: bytes) -> Position:
+        with self._lock:
+            if self._file.tell() and self._file.tell() + len(line) > self.segment_bytes:
+                self._file.close()
+                self._segment += 1
+                self._file = open(self._path(self._segment), "ab")
+            self._file.write(line)
+            self._file.flush()
+            return Position(self._segment, self._file.tell())
+
+    def replay(self) -> Iterator[Tuple[Entries, Position]]:
+        """Entries spooled after the checkpoint by earlier runs, oldest first."""
+        for segment in self._segments():
+            if segment < self._checkpoint.segment or segment >= self._segment:
+                continue
+            with open(self._path(segment), "rb") as f:
+                if segment == self._checkpoint.segment:
+                    f.seek(self._checkpoint.offset)
+                for line in f:
+                    try:
+                        entries = json.loads(line)
+                    except ValueError:
+                        logger.warning("Skipping the torn end of spool segment %d", segment)
+                        break
+                    yield entries, Position(segment, f.tell())
+
+    def dead_letter(self, lines: List[bytes]) -> None:
+        with self._lock:
+            with open(self.directory / DEAD_LETTER, "ab") as f:
+                f.writelines(lines)
+                f.flush()
+
+    def requeue_dead_letters(self) -> List[Tuple[Entries, Position]]:
+        """Move dead-lettered entries to the current segment, to be queued again."""
+        path = self.directory / DEAD_LETTER
+        if not path.exists():
+            return []
+        requeued = []
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    entries = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping the torn end of the dead-letter file")
+                    break
+                requeued.append((entries, self.append(line)))
+        os.unlink(path)
+        return requeued
+
+    def commit(self, position: Position) -> None:
+        """Everything up to ``position`` is in the database."""
+        with self._lock:
+            tmp = self.directory / (CHECKPOINT + ".tmp")
+            tmp.write_text(f"{position.segment} {position.offset}")
+            os.replace(tmp, self.directory / CHECKPOINT)
+            self._checkpoint = position
+            for segment in self._segments():
+                if segment < position.segment:
+                    os.unlink(self._path(segment))
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class _Item(NamedTuple):
+    entries: Entries
+    future: Future
+    position: Optional[Position]
+
+
+class IngestQueue:
+    """Bounded queue of parsed entries, committed by one thread in groups.
+
+    offer() accepts a request's entries when they fit in ``max_rows`` (an
+    oversized request is still accepted into an empty queue). The drain
+    thread waits up to ``linger`` seconds for a group to reach
+    ``group_rows``, then commits everything it took with one ``commit``
+    call, so many small requests share a few large transactions. When that
+    call fails, each request of the group is committed on its own, so only
+    the requests that cannot be written fail. With ``spool_dir`` accepted
+    entries are also spooled to disk, replayed by start() if the process
+    stopped before committing them, and failed ones are dead-lettered;
+    without it, entries of a failed request are only logged.
+    """
+
+    def __init__(
+        self,
+        commit: CommitFn,
+        max_rows: int = 200000,
+        group_rows: int = 10000,
+        linger: float = 0.05,
+        spool_dir: Optional[Path] = None,
+    ) -> None:
+        self.commit = commit
+        self.max_rows = max_rows
+        self.group_rows = max(1, group_rows)
+        self.linger = linger
+        self.spool_dir = spool_dir
+        self.spool: Optional[Spool] = None
+        self._cond = threading.Condition()
+        self._items: Deque[_Item] = deque()
+        self._rows = 0
+        self._rate = 0.0
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+        self.accepted = 0
+        self.rejected = 0
+        self.committed = 0
+        self.failed = 0
+        self.groups = 0
+
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._closing = False
+            if self.spool_dir is not None:
+                self.spool = Spool(self.spool_dir)
+                replayed = 0
+                for entries, position in chain(self.spool.replay(), self.spool.requeue_dead_letters()):
+                    self._items.append(_Item(entries, Future(), position))
+                    self._rows += len(entries)
+                    replayed += len(entries)
+                if replayed:
+                    logger.info("Replaying %d spooled entries", replayed)
+            self._thread = threading.Thread(target=self._run, name="loglens-ingest", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Stop accepting, commit what is queued, then stop the thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+    def _fits(self, rows: int) -> bool:
+        return not self._rows or self._rows + rows <= self.max_rows
+
+    def offer(self, entries: Entries, timeout: Optional[float] = 0) -> Optional[Future]:
+        """Queue ``entries``; the future resolves once they are committed.
+
+        Waits up to ``timeout`` seconds (None: indefinitely) for room and
+        returns None if there is still none.
+        """
+        line = Spool.encode(entries) if self.spool is not None else None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._fits(len(entries)):
+                if self._closing:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self._closing or not self._fits(len(entries)):
+                self.rejected += len(entries)
+                return None
+            # Spooled under the lock so spool order is queue order.
+            position = self.spool.append(line) if line is not None else None
+            item = _Item(entries, Future(), position)
+            self._items.append(item)
+            self._rows += len(entries)
+            self.accepted += len(entries)
+            self._cond.notify_all()
+            return item.future
+
+    def _take(self) -> List[_Item]:
+        with self._cond:
+            while not self._items and not self._closing:
+                self._cond.wait()
+            deadline = time.monotonic() + self.linger
+            while self._rows < self.group_rows and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            group: List[_Item] = []
+            rows = 0
+            while self._items and (not group or rows + len(self._items[0].entries) <= self.group_rows):
+                item = self._items.popleft()
+                group.append(item)
+                rows += len(item.entries)
+            self._rows -= rows
+            self._cond.notify_all()
+            return group
+
+    def _run(self) -> None:
+        while True:
+            group = self._take()
+            if not group:
+                return
+            entries = [e for item in group for e in item.entries]
+            started = time.monotonic()
+            try:
+                self.commit(entries)
+            except Exception as exc:
+                logger.warning(
+                    "Group commit of %d entries failed, committing its requests one by one: %s", len(entries), exc
+                )
+                self._commit_each(group, exc)
+            else:
+                rate = len(entries) / max(time.monotonic() - started, 1e-3)
+                self._rate = rate if not self._rate else 0.8 * self._rate + 0.2 * rate
+                self._committed(group)
+            # Every item is now committed or dead-lettered.
+            if self.spool is not None and group[-1].position is not None:
+                self.spool.commit(group[-1].position)
+
+    def _committed(self, items: List[_Item]) -> None:
+        self.committed += sum(len(item.entries) for item in items)
+        self.groups += 1
+        for item in items:
+            item.future.set_result(len(item.entries))
+
+    def _commit_each(self, group: List[_Item], exc: Exception) -> None:
+        # A group holds at most group_rows entries, one transaction, so the
+        # failed attempt left nothing behind and one bad request only fails
+        # itself. A lone item is not retried.
+        failed: List[Tuple[_Item, Exception]] = []
+        if len(group) == 1:
+            failed.append((group[0], exc))
+        else:
+            for item in group:
+                try:
+                    self.commit(item.entries)
+                except Exception as item_exc:
+                    failed.append((item, item_exc))
+                else:
+                    self._committed([item])
+        for item, item_exc in failed:
+            # Not retried again: a request that cannot be written would block
+            # everything queued behind it.
+            logger.error("Commit of %d entries failed: %s", len(item.entries), item_exc, exc_info=item_exc)
+            self.failed += len(item.entries)
+            if self.spool is not None:
+                # Accepted with a 202, so kept for the next start rather than
+                # dropped when the checkpoint moves past it.
+                self.spool.dead_letter([Spool.encode(item.entries)])
+                logger.warning("Kept %d entries in the spool dead-letter file", len(item.entries))
+            item.future.set_exception(item_exc)
+
+    def retry_after(self) -> int:
+        """Seconds until the queued rows should have been committed."""
+        with self._cond:
+            rate = self._rate or float(self.group_rows)
+            return max(1, min(60, math.ceil(self._rows / rate)))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "pending_rows": self._rows,
+                "max_rows": self.max_rows,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "committed": self.committed,
+                "failed": self.failed,
+                "groups": self.groups,
+                "rows_per_second": round(self._rate, 1),
+                "spooled": self.spool is not None,
+            }
@@ -0,0 +1,199 @@
+import asyncio
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from detector import json_dumps
+
+KINDS = ("logs", "metrics", "categories", "stats", "alerts")
+
+# Sent instead of the events a client was too slow to take; it reloads.
+RESYNC_FRAME = "event: resync\ndata: {}\n\n"
+
+
+def frame(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+class Subscription:
+    """One live-tail client: its filters and a bounded queue of SSE frames."""
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        sources: Optional[FrozenSet[str]],
+        levels: Optional[FrozenSet[str]],
+        kinds: FrozenSet[str],
+        max_pending: int,
+    ) -> None:
+        self.loop = loop
+        self.sources = sources
+        self.levels = levels
+        self.kinds = kinds
+        self.dropped = 0
+        self._queue: asyncio.Queue = asyncio.Queue(max(1, max_pending))
+
+    def _offer(self, item: Optional[str]) -> None:
+        # Event loop thread only.
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # A client that cannot keep up gets one resync instead of a
+            # growing backlog.
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self.dropped += 1
+            self._queue.put_nowait(RESYNC_FRAME if item is not None else None)
+
+    async def get(self) -> Optional[str]:
+        """The next frame, or None once the hub is closed."""
+        return await self._queue.get()
+
+
+class BatchEvent:
+    """What one committed ingest batch changed, split by source.
+
+    Built on the ingest thread only when someone is listening. Each part is
+    serialized once per source and reused by every client whose filters
+    keep it whole.
+    """
+
+    def __init__(self) -> None:
+        self.logs: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.skipped: Counter = Counter()
+        # source -> metric -> bucket second -> [count, sum, min, max]
+        self.metrics: Dict[str, Dict[str, Dict[int, List[float]]]] = defaultdict(lambda: defaultdict(dict))
+        self.categories: Dict[str, Dict[str, Counter]] = defaultdict(lambda: defaultdict(Counter))
+        self.counts: Dict[str, Counter] = defaultdict(Counter)
+        self.stats: Optional[Dict[str, Any]] = None
+        self._fragments: Dict[Tuple[str, str], str] = {}
+
+    def add_metric(self, source: str, name: str, second: int, value: float) -> None:
+        cell = self.metrics[source][name].get(second)
+        if cell is None:
+            self.metrics[source][name][second] = [1, value, value, value]
+        else:
+            cell[0] += 1
+            cell[1] += value
+            cell[2] = min(cell[2], value)
+            cell[3] = max(cell[3], value)
+
+    def _part(self, source: str, kind: str, levels: Optional[FrozenSet[str]]) -> Any:
+        if kind == "logs":
+            lines = self.logs.get(source, [])
+            if levels is not None:
+                lines = [line for line in lines if line["level"] in levels]
+            return {"lines": lines, "skipped": self.skipped.get(source, 0)}
+        if kind == "metrics":
+            return {
+                name: [[second] + cell for second, cell in sorted(cells.items())]
+                for name, cells in self.metrics.get(source, {}).items()
+            }
+        if kind == "categories":
+            return {name: dict(values) for name, values in self.categories.get(source, {}).items()}
+        if kind == "stats":
+            return self.stats
+        return dict(self.counts.get(source, {}))
+
+    def _fragment(self, source: str, kind: str, levels: Optional[FrozenSet[str]]) -> str:
+        if levels is not None and kind == "logs":
+            return json_dumps(self._part(source, kind, levels))
+        key = (source, kind)
+        text = self._fragments.get(key)
+        if text is None:
+            text = self._fragments[key] = json_dumps(self._part(source, kind, None))
+        return text
+
+    def render(self, sub: Subscription) -> Optional[str]:
+        """The SSE frame ``sub`` should receive, or None when nothing matches."""
+        sources = [s for s in self.counts if sub.sources is None or s in sub.sources]
+        parts = []
+        for source in sources:
+            kinds = [k for k in ("logs", "metrics", "categories") if k in sub.kinds]
+            kinds.append("counts")
+            body = ",".join(f'"{k}":{self._fragment(source, k, sub.levels)}' for k in kinds)
+            parts.append(f"{json_dumps(source)}:{{{body}}}")
+        if not parts:
+            return None
+        stats = f',"stats":{self._fragment("", "stats", None)}' if "stats" in sub.kinds and self.stats else ""
+        return frame("batch", f'{{"sources":{{{",".join(parts)}}}{stats}}}')
+
+
+class Hub:
+    """Fans committed changes out to live-tail subscribers.
+
+    publish() runs on the ingest threads; frames reach each subscriber's
+    event loop through call_soon_threadsafe. Queues are bounded by
+    ``max_pending`` frames; on overflow a client's queue is replaced by a
+    single resync frame.
+    """
+
+    def __init__(self, max_pending: int = 256, max_lines: int = 500) -> None:
+        self.max_pending = max_pending
+        self.max_lines = max_lines
+        self._lock = threading.Lock()
+        self._subs: List[Subscription] = []
+
+    @property
+    def active(self) -> bool:
+        return bool(self._subs)
+
+    def subscribe(
+        self,
+        sources: Optional[Iterable[str]] = None,
+        levels: Optional[Iterable[str]] = None,
+        kinds: Iterable[str] = KINDS,
+    ) -> Subscription:
+        sub = Subscription(
+            asyncio.get_running_loop(),
+            frozenset(sources) if sources else None,
+            frozenset(level.upper() for level in levels) if levels else None,
+            frozenset(kinds),
+            self.max_pending,
+        )
+        with self._lock:
+            self._subs = self._subs + [sub]
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subs = [s for s in self._subs if s is not sub]
+
+    def subscribers(self) -> int:
+        return len(self._subs)
+
+    def _deliver(self, items: List[Tuple[Subscription, Optional[str]]]) -> None:
+        for sub, item in items:
+            sub._offer(item)
+
+    def _send(self, items: List[Tuple[Subscription, Optional[str]]]) -> None:
+        by_loop: Dict[asyncio.AbstractEventLoop, List[Tuple[Subscription, Optional[str]]]] = defaultdict(list)
+        for sub, item in items:
+            by_loop[sub.loop].append((sub, item))
+        for loop, batch in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(self._deliver, batch)
+            except RuntimeError:
+                # The loop has closed; its subscribers are gone with it.
+                for sub, _ in batch:
+                    self.unsubscribe(sub)
+
+    def publish(self, event: BatchEvent) -> None:
+        items = []
+        for sub in self._subs:
+            text = event.render(sub)
+            if text is not None:
+                items.append((sub, text))
+        if items:
+            self._send(items)
+
+    def notify(self, kind: str, data: Dict[str, Any]) -> None:
+        """Send a small event (e.g. alert rule changes) to every client taking ``kind``."""
+        text = frame(kind, json_dumps(data))
+        self._send([(sub, text) for sub in self._subs if kind in sub.kinds])
+
+    def close(self) -> None:
+        """End every subscriber's stream."""
+        with self._lock:
+            subs, self._subs = self._subs, []
+        self._send([(sub, None) for sub in subs])
@@ -1,46 +1,150 @@
+import asyncio
+import base64
+import codecs
+import csv
+import heapq
+import io
 import json
 import logging
 import os
 import sqlite3
-import threading
+import time
 from collections import defaultdict
 from datetime import datetime, timedelta
+from itertools import chain, islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Iterator, List, NamedTuple, Optional, Tuple
 
 import uvicorn
-from fastapi import BackgroundTasks, FastAPI, HTTPException, Query, Request
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
+import aggregator
 import alerts
-from detector import detect_and_parse
-from extractor import derive_metrics_and_categories
+import archive
+import cache
+import cardinality
+import db
+import dictionary
+import ingest_queue
+import live
+import notify
+import partitions
+import rollups
+import search
+import stats
+import templates
+from detector import StreamParser, detect_and_parse, json_dumps, parse_json_text
+from parse_pool import ParsePool
+from timestamps import iso_micros, iso_second, utc_micros
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s :: %(message)s")
 logger = logging.getLogger("loglens")
 
 BASE_DIR = Path(__file__).parent
 STATIC_DIR = BASE_DIR / "static"
-DB_PATH = BASE_DIR / "loglens.db"
+DB_PATH = Path(os.environ.get("LOGLENS_DB_PATH", str(BASE_DIR / "loglens.db")))
 
 app = FastAPI(title="LogLens", version="1.0.0")
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
-conn: Optional[sqlite3.Connection] = None
-DB_LOCK = threading.Lock()
+# Ingest and other writes go through DB.write/DB.submit (one writer thread);
+# GET endpoints take a read-only connection from DB.read().
+DB = db.Database(
+    DB_PATH,
+    readers=int(os.environ.get("LOGLENS_DB_READERS", "4")),
+    cache_kib=int(os.environ.get("LOGLENS_DB_CACHE_KIB", "65536")),
+    mmap_bytes=int(os.environ.get("LOGLENS_DB_MMAP_BYTES", str(256 * 1024 * 1024))),
+)
+STATS = stats.Stats()
+STRINGS = dictionary.StringDictionary(int(os.environ.get("LOGLENS_STRING_CACHE_SIZE", "200000")))
+AGGREGATOR = aggregator.StreamingAggregator()
+# Alert rules are evaluated on every ingest batch; the tick re-checks them as
+# windows slide while no data arrives.
+ALERT_TICK_SECONDS = float(os.environ.get("LOGLENS_ALERT_TICK_SECONDS", "1"))
+# Days of raw entries/metrics/categories and of metric rollups to keep
+# (today included); 0 keeps everything.
+RETENTION_RAW_DAYS = int(os.environ.get("LOGLENS_RETENTION_RAW_DAYS", "0"))
+RETENTION_ROLLUP_DAYS = int(os.environ.get("LOGLENS_RETENTION_ROLLUP_DAYS", "0"))
+RETENTION_INTERVAL_SECONDS = float(os.environ.get("LOGLENS_RETENTION_INTERVAL_SECONDS", "3600"))
+# Entries dated more than this many days before or after now are stored in
+# the partition of their ingest day (MAX_AGE 0: no lower bound).
+PARTITION_MAX_AGE_DAYS = int(os.environ.get("LOGLENS_PARTITION_MAX_AGE_DAYS", "366"))
+PARTITION_MAX_AHEAD_DAYS = int(os.environ.get("LOGLENS_PARTITION_MAX_AHEAD_DAYS", "1"))
+# Metrics of days older than LOGLENS_ARCHIVE_AFTER_DAYS move to columnar files
+# in LOGLENS_ARCHIVE_DIR (0 disables), kept LOGLENS_RETENTION_ARCHIVE_DAYS
+# days (0 keeps everything) independently of raw retention.
+ARCHIVE_AFTER_DAYS = int(os.environ.get("LOGLENS_ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_DIR = Path(os.environ.get("LOGLENS_ARCHIVE_DIR", str(BASE_DIR / "archive")))
+RETENTION_ARCHIVE_DAYS = int(os.environ.get("LOGLENS_RETENTION_ARCHIVE_DAYS", "0"))
 
 
+def _mark_notified(history_ids: List[int], delivered: bool) -> None:
+    if delivered:
+        DB.submit(alerts.mark_notified, history_ids)
+
+
+NOTIFIER = notify.Notifier(
+    workers=int(os.environ.get("LOGLENS_NOTIFY_WORKERS", "2")),
+    max_pending=int(os.environ.get("LOGLENS_NOTIFY_MAX_PENDING", "1000")),
+    max_attempts=int(os.environ.get("LOGLENS_NOTIFY_MAX_ATTEMPTS", "5")),
+    smtp_host=os.environ.get("LOGLENS_SMTP_HOST", "localhost"),
+    smtp_port=int(os.environ.get("LOGLENS_SMTP_PORT", "25")),
+    on_result=_mark_notified,
+)
+
+# LOGLENS_PARSE_WORKERS=0/1 keeps parsing in-process; bodies under the
+# minimum size are always parsed in-process to avoid the IPC round trip.
+# Free-text (plain, syslog) messages are clustered into templates at ingest.
+# Numbers in them only become metrics when the line names them (key=value).
+TEMPLATES = templates.TemplateMiner(
+    similarity=float(os.environ.get("LOGLENS_TEMPLATE_SIMILARITY", "0.4")),
+    max_clusters=int(os.environ.get("LOGLENS_TEMPLATE_MAX_CLUSTERS", "50000")),
+)
+FREE_TEXT_FORMATS = ("plain", "syslog")
+# Category fields past extractor.CATEGORY_CARDINALITY_LIMIT distinct values
+# are kept as per-source top-K sketches instead of rows, for at most
+# LOGLENS_CATEGORY_MAX_SOURCES sources per field (older ones are merged).
+CATEGORIES = cardinality.CategoryTracker(
+    top_k=int(os.environ.get("LOGLENS_CATEGORY_TOP_K", "64")),
+    max_sources=int(os.environ.get("LOGLENS_CATEGORY_MAX_SOURCES", "100")),
+)
+# Live-tail clients (/api/live) get committed batches pushed to them; a client
+# more than LOGLENS_LIVE_MAX_PENDING batches behind is told to resync.
+LIVE = live.Hub(
+    max_pending=int(os.environ.get("LOGLENS_LIVE_MAX_PENDING", "256")),
+    max_lines=int(os.environ.get("LOGLENS_LIVE_MAX_LINES", "500")),
+)
+# Read endpoints are cached per (path, parameters) until the data they were
+# computed from changes; LOGLENS_CACHE_MAX_BYTES=0 disables storing.
+VERSIONS = cache.DataVersions()
+RESPONSE_CACHE = cache.ResponseCache(int(os.environ.get("LOGLENS_CACHE_MAX_BYTES", str(64 * 1024 * 1024))))
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get("LOGLENS_LIVE_HEARTBEAT_SECONDS", "15"))
+# Live streams only end when their client leaves; on shutdown uvicorn waits
+# this long for open requests, then cancels them.
+SHUTDOWN_GRACE_SECONDS = int(os.environ.get("LOGLENS_SHUTDOWN_GRACE_SECONDS", "5"))
+PARSE_POOL = ParsePool(
+    workers=int(os.environ.get("LOGLENS_PARSE_WORKERS", "0")),
+    min_bytes=int(os.environ.get("LOGLENS_PARSE_MIN_BYTES", str(1024 * 1024))),
+)
+
+
+# The unsuffixed entries/metrics/categories tables are the legacy partition;
+# their indexes come from partitions.ensure_indexes().
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS log_entries (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     timestamp TEXT NOT NULL,
-    source TEXT NOT NULL,
-    level TEXT NOT NULL,
+    ts_us INTEGER,
+    source_id INTEGER NOT NULL,
+    level_id INTEGER NOT NULL,
     message TEXT NOT NULL,
     raw_line TEXT NOT NULL,
-    format_detected TEXT NOT NULL,
-    created_at TEXT NOT NULL
+    format_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    template_id INTEGER
 );
 
 CREATE TABLE IF NOT EXISTS metrics (
@@ -49,15 +153,17 @@ CREATE TABLE IF NOT EXISTS metrics (
     metric_name TEXT NOT NULL,
     metric_value REAL NOT NULL,
     timestamp TEXT NOT NULL,
+    ts_us INTEGER,
     FOREIGN KEY(log_entry_id) REFERENCES log_entries(id)
 );
 
 CREATE TABLE IF NOT EXISTS categories (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     log_entry_id INTEGER NOT NULL,
-    category_name TEXT NOT NULL,
-    category_value TEXT NOT NULL,
+    name_id INTEGER NOT NULL,
+    value_id INTEGER NOT NULL,
     timestamp TEXT NOT NULL,
+    ts_us INTEGER,
     FOREIGN KEY(log_entry_id) REFERENCES log_entries(id)
 );
 
@@ -69,7 +175,9 @@ CREATE TABLE IF NOT EXISTS alert_rules (
     window_seconds INTEGER NOT NULL,
     webhook_url TEXT,
     email TEXT,
-    enabled INTEGER NOT NULL DEFAULT 1
+    enabled INTEGER NOT NULL DEFAULT 1,
+    aggregation TEXT NOT NULL DEFAULT 'avg',
+    cooldown_seconds INTEGER
 );
 
 CREATE TABLE IF NOT EXISTS alert_history (
@@ -80,51 +188,163 @@ CREATE TABLE IF NOT EXISTS alert_history (
     notified INTEGER NOT NULL,
     FOREIGN KEY(rule_id) REFERENCES alert_rules(id)
 );
-
-CREATE INDEX IF NOT EXISTS idx_log_entries_source_ts ON log_entries(source, timestamp);
-CREATE INDEX IF NOT EXISTS idx_metrics_name_ts ON metrics(metric_name, timestamp);
-CREATE INDEX IF NOT EXISTS idx_categories_name ON categories(category_name, category_value);
 """
 
 
-def init_db() -> sqlite3.Connection:
-    database = sqlite3.connect(str(DB_PATH), check_same_thread=False)
-    database.execute("PRAGMA journal_mode=WAL;")
+def init_db(database: sqlite3.Connection) -> None:
     database.executescript(SCHEMA_SQL)
+    alerts.ensure_schema(database)
+    database.executescript(rollups.schema_sql())
+    database.executescript(stats.STATS_SCHEMA_SQL)
+    database.executescript(partitions.CATALOG_SQL)
+    database.executescript(templates.SCHEMA_SQL)
+    database.executescript(dictionary.SCHEMA_SQL)
+    database.executescript(cardinality.SCHEMA_SQL)
+    database.executescript(archive.SCHEMA_SQL)
     database.commit()
-    return database
+    partitions.ensure_columns(database)
+    filled = partitions.fill_ts_us(database)
+    if filled:
+        logger.info("Computed UTC epoch times of %d stored rows", filled)
+    converted = partitions.encode_strings(database)
+    if converted:
+        logger.info("Moved inline strings of %d partitions to the strings dictionary", len(converted))
+        database.execute("VACUUM")
+    partitions.ensure_indexes(database)
+    if filled and not rollups.needs_backfill(database):
+        # Buckets used to be cut from the timestamp as written; they are UTC now.
+        logger.info("Rebuilding metric rollups on UTC buckets")
+        rollups.rebuild(database)
+        _fold_archive_into_rollups(database)
+    if rollups.needs_backfill(database):
+        logger.info("Backfilling metric rollups from existing metrics")
+        rollups.rebuild(database)
+    if stats.needs_rebuild(database):
+        logger.info("Backfilling stats counters from existing entries")
+        stats.rebuild(database)
+    for day in partitions.ensure_search(database):
+        logger.info("Built search index for partition %s", day or "legacy")
+    if CATEGORIES.needs_backfill(database):
+        promoted = CATEGORIES.backfill(database)
+        logger.info("Tracking category cardinality; sketching %s", ", ".join(promoted) or "no fields")
+
+
+def _enforce_retention(conn: sqlite3.Connection) -> None:
+    # Whole day partitions are dropped, so expiry costs the same at any size.
+    for day in partitions.expired(conn, RETENTION_RAW_DAYS):
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            delta = stats.table_delta(conn, partitions.table("log_entries", day), sign=-1)
+            STATS.persist(cur, delta)
+            partitions.drop(cur, day)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        STATS.merge(delta)
+        logger.info("Dropped partition %s (%d entries)", day, -delta.total)
+    before = _rollup_horizon()
+    if before:
+        removed = rollups.expire(conn, before)
+        if removed:
+            logger.info("Expired %d rollup rows before %s", removed, before)
+    for day in archive.expire(conn, ARCHIVE_DIR, RETENTION_ARCHIVE_DAYS):
+        logger.info("Removed metrics archive of %s", day)
+
+
+def _rollup_horizon() -> Optional[str]:
+    """First day rollups are kept for, or None when they are kept forever."""
+    if RETENTION_ROLLUP_DAYS <= 0:
+        return None
+    return (datetime.utcnow().date() - timedelta(days=RETENTION_ROLLUP_DAYS - 1)).isoformat()
+
+
+def _archive_metrics() -> None:
+    # Files are built from a dedicated snapshot so the writer only runs the
+    # short delete-and-swap transaction.
+    with DB.read() as conn:
+        days = archive.due(conn, ARCHIVE_AFTER_DAYS)
+    if days:
+        DB.write(archive.remove_orphans, ARCHIVE_DIR)
+    for day in days:
+        with DB.reader() as conn:
+            built = archive.build(conn, ARCHIVE_DIR, day)
+        if built:
+            DB.write(archive.commit, ARCHIVE_DIR, built)
+            logger.info("Archived %d metrics of %s to %s", built.rows, day, built.file)
+
+
+def _reload_alert_rules() -> None:
+    with DB.read() as conn:
+        AGGREGATOR.load(conn)
+
+
+def _alerts_recorded(future) -> None:
+    try:
+        trig = future.result()
+    except Exception as exc:
+        logger.exception("Recording alerts failed: %s", exc)
+        return
+    logger.warning("Triggered %d alerts", len(trig))
+
+
+def _dispatch_alerts(fired: List[tuple]) -> None:
+    if fired:
+        DB.submit(alerts.record_alerts, fired, NOTIFIER).add_done_callback(_alerts_recorded)
 
 
 @app.on_event("startup")
 async def startup() -> None:
-    global conn
-    conn = init_db()
+    DB.open(init_db)
+    NOTIFIER.start()
+    PARSE_POOL.start()
+    DB.write(STATS.load)
+    with DB.read() as conn:
+        STRINGS.load(conn)
+        TEMPLATES.load(conn)
+        CATEGORIES.load(conn)
+    _reload_alert_rules()
+    # Started last: replayed spool entries need everything above loaded.
+    INGEST.start()
     logger.info("Database initialized at %s", DB_PATH)
     app.state.alert_task = app.state.loop_task = None
 
-    import asyncio
-
     async def _alert_loop() -> None:
         while True:
             try:
-                with DB_LOCK:
-                    trig = alerts.check_rules(conn)
-                if trig:
-                    logger.warning("Triggered %d alerts", len(trig))
+                _dispatch_alerts(AGGREGATOR.evaluate())
             except Exception as exc:
                 logger.exception("Alert loop error: %s", exc)
-            await asyncio.sleep(30)
+            await asyncio.sleep(ALERT_TICK_SECONDS)
+
+    async def _retention_loop() -> None:
+        while True:
+            try:
+                if ARCHIVE_AFTER_DAYS > 0:
+                    await run_in_threadpool(_archive_metrics)
+                await asyncio.wrap_future(DB.submit(_enforce_retention))
+            except Exception as exc:
+                logger.exception("Retention error: %s", exc)
+            # Expired or archived rows may be in any cached response.
+            VERSIONS.bump_all()
+            await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
 
     app.state.loop_task = asyncio.create_task(_alert_loop())
+    app.state.retention_task = asyncio.create_task(_retention_loop())
 
 
 @app.on_event("shutdown")
 async def shutdown() -> None:
-    task = getattr(app.state, "loop_task", None)
-    if task:
-        task.cancel()
-    if conn:
-        conn.close()
+    for name in ("loop_task", "retention_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    LIVE.close()
+    INGEST.close()
+    PARSE_POOL.close()
+    NOTIFIER.close()
+    DB.close()
 
 
 @app.get("/")
@@ -132,191 +352,924 @@ def root() -> FileResponse:
     return FileResponse(str(STATIC_DIR / "index.html"))
 
 
-def _insert_entries(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
-    if not conn:
-        raise HTTPException(status_code=500, detail="Database unavailable")
+INSERT_BATCH_SIZE = int(os.environ.get("LOGLENS_INSERT_BATCH_SIZE", "10000"))
+# Bodies larger than this (or sent without Content-Length) are parsed and
+# committed incrementally instead of being read into memory first.
+STREAM_THRESHOLD_BYTES = int(os.environ.get("LOGLENS_STREAM_THRESHOLD_BYTES", str(8 * 1024 * 1024)))
 
-    ingested = 0
-    by_format = defaultdict(int)
-    with DB_LOCK:
-        cur = conn.cursor()
-        for e in entries:
-            ts = e.get("timestamp") or datetime.utcnow().isoformat()
-            cur.execute(
-                """
-                INSERT INTO log_entries (timestamp, source, level, message, raw_line, format_detected, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
+class EntryBatch(NamedTuple):
+    created_at: str
+    ts_col: List[str]
+    ts_us_col: List[int]
+    source_col: List[str]
+    level_col: List[str]
+    message_col: List[str]
+    raw_col: List[str]
+    format_col: List[str]
+    day_col: List[str]
+    template_col: List[Optional[int]]
+    template_rows: List[tuple]
+    templates_changed: bool
+    # Child rows carry the entry's offset in the batch until ids are reserved;
+    # metric rows are (offset, name, value, ts_us).
+    metric_rows: List[tuple]
+    category_rows: List[tuple]
+    stats_delta: stats.StatsDelta
+
+
+def _prepare_batch(entries: List[Dict[str, Any]], by_format: Dict[str, int]) -> EntryBatch:
+    # Runs on the caller's thread so the writer thread only executes SQL.
+    utcnow = datetime.utcnow()
+    now = utcnow.isoformat()
+    now_us = utc_micros(now)
+    window = partitions.day_window(utcnow.date(), PARTITION_MAX_AGE_DAYS, PARTITION_MAX_AHEAD_DAYS)
+    ts_col: List[str] = []
+    ts_us_col: List[int] = []
+    source_col: List[str] = []
+    level_col: List[str] = []
+    message_col: List[str] = []
+    raw_col: List[str] = []
+    format_col: List[str] = []
+    day_col: List[str] = []
+    metric_rows: List[tuple] = []
+    category_rows: List[tuple] = []
+
+    for offset, e in enumerate(entries):
+        ts = e.get("timestamp") or now
+        fmt = e.get("format_detected", "plain")
+        ts_us = utc_micros(ts)
+        if ts_us is None:
+            ts_us = now_us
+        ts_col.append(ts)
+        ts_us_col.append(ts_us)
+        source_col.append(e.get("source", "ingest"))
+        level_col.append(e.get("level", "INFO"))
+        message_col.append(e.get("message", ""))
+        raw_col.append(e.get("raw_line", ""))
+        format_col.append(fmt)
+        day_col.append(partitions.day_of(ts_us, now[:10], window))
+        by_format[fmt] += 1
+
+        for metric_name, metric_value in (e.get("numeric_fields") or {}).items():
+            metric_rows.append((offset, metric_name, float(metric_value), ts_us))
+        if fmt in FREE_TEXT_FORMATS:
+            for metric_name, metric_value in templates.named_numbers(e.get("message", "")).items():
+                metric_rows.append((offset, metric_name, metric_value, ts_us))
+        for cat_name, cat_val in (e.get("string_fields") or {}).items():
+            if cat_val is None:
+                continue
+            category_rows.append((offset, str(cat_name), str(cat_val), ts))
+
+    # Structured formats (access logs, JSON) have no free-text message to
+    # cluster; their template_id stays NULL.
+    free_text = [o for o, fmt in enumerate(format_col) if fmt in FREE_TEXT_FORMATS]
+    template_col: List[Optional[int]] = [None] * len(message_col)
+    revision = TEMPLATES.revision
+    mined, template_rows = TEMPLATES.mine([message_col[o] for o in free_text])
+    for o, template_id in zip(free_text, mined):
+        template_col[o] = template_id
+
+    delta = STATS.collect(level_col, source_col, ts_us_col)
+    return EntryBatch(
+        now,
+        ts_col,
+        ts_us_col,
+        source_col,
+        level_col,
+        message_col,
+        raw_col,
+        format_col,
+        day_col,
+        template_col,
+        template_rows,
+        TEMPLATES.revision != revision,
+        metric_rows,
+        category_rows,
+        delta,
+    )
+
+
+def _group_by_day(rows: List[tuple], day_col: List[str]) -> Dict[str, List[tuple]]:
+    groups: Dict[str, List[tuple]] = defaultdict(list)
+    for row in rows:
+        groups[day_col[row[0]]].append(row)
+    return groups
+
+
+def _write_batch(conn: sqlite3.Connection, batch: EntryBatch) -> Tuple[int, List[tuple]]:
+    """Commit ``batch``; returns its first entry id and the category rows stored."""
+    count = len(batch.ts_col)
+    cur = conn.cursor()
+    promotions = CATEGORIES.revision
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        first_id = partitions.reserve_ids(cur, count)
+        category_rows = CATEGORIES.route(cur, batch.category_rows, batch.source_col)
+        codes = STRINGS.encode(
+            cur,
+            chain(
+                batch.source_col,
+                batch.level_col,
+                batch.format_col,
+                (row[1] for row in category_rows),
+                (row[2] for row in category_rows),
+            ),
+        )
+        entry_rows = zip(
+            range(count),
+            range(first_id, first_id + count),
+            batch.ts_col,
+            batch.ts_us_col,
+            [codes[v] for v in batch.source_col],
+            [codes[v] for v in batch.level_col],
+            batch.message_col,
+            batch.raw_col,
+            [codes[v] for v in batch.format_col],
+            [batch.created_at] * count,
+            batch.template_col,
+        )
+        metric_days = _group_by_day(batch.metric_rows, batch.day_col)
+        category_days = _group_by_day(category_rows, batch.day_col)
+        for day, rows in _group_by_day(list(entry_rows), batch.day_col).items():
+            partitions.ensure(cur, day)
+            cur.executemany(partitions.insert_sql("log_entries", day), (row[1:] for row in rows))
+            cur.executemany(partitions.insert_sql("search", day), ((row[1], row[6]) for row in rows))
+            cur.executemany(
+                partitions.insert_sql("metrics", day),
+                ((first_id + o, n, v, batch.ts_col[o], ts_us) for o, n, v, ts_us in metric_days.get(day, ())),
+            )
+            cur.executemany(
+                partitions.insert_sql("categories", day),
                 (
-                    ts,
-                    e.get("source", "ingest"),
-                    e.get("level", "INFO"),
-                    e.get("message", ""),
-                    e.get("raw_line", ""),
-                    e.get("format_detected", "plain"),
-                    datetime.utcnow().isoformat(),
+                    (first_id + o, codes[n], codes[v], ts, batch.ts_us_col[o])
+                    for o, n, v, ts in category_days.get(day, ())
                 ),
             )
-            log_entry_id = cur.lastrowid
-            by_format[e.get("format_detected", "plain")] += 1
+        rollups.apply(
+            cur, ((n, batch.source_col[o], iso_second(ts_us // 1_000_000), v) for o, n, v, ts_us in batch.metric_rows)
+        )
+        cur.executemany(
+            templates.UPSERT_SQL,
+            ((tid, text, w, n, batch.created_at, batch.created_at) for tid, text, w, n in batch.template_rows),
+        )
+        STATS.persist(cur, batch.stats_delta)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        CATEGORIES.load(conn)
+        VERSIONS.bump_all()
+        raise
+    STATS.merge(batch.stats_delta)
+    STRINGS.remember(codes)
+    if batch.templates_changed or CATEGORIES.revision != promotions:
+        # Template texts and promoted fields show up in every source's responses.
+        VERSIONS.bump_all()
+    VERSIONS.bump_sources(batch.source_col)
+    return first_id, category_rows
 
-            for metric_name, metric_value in (e.get("numeric_fields") or {}).items():
-                cur.execute(
-                    "INSERT INTO metrics (log_entry_id, metric_name, metric_value, timestamp) VALUES (?, ?, ?, ?)",
-                    (log_entry_id, metric_name, float(metric_value), ts),
-                )
 
-            for cat_name, cat_val in (e.get("string_fields") or {}).items():
-                if cat_val is None:
-                    continue
-                cur.execute(
-                    "INSERT INTO categories (log_entry_id, category_name, category_value, timestamp) VALUES (?, ?, ?, ?)",
-                    (log_entry_id, str(cat_name), str(cat_val), ts),
-                )
-            ingested += 1
-        conn.commit()
+def _live_event(batch: EntryBatch, first_id: int, category_rows: List[tuple]) -> live.BatchEvent:
+    event = live.BatchEvent()
+    sources = batch.source_col
+    for o, source in enumerate(sources):
+        event.counts[source]["entries"] += 1
+        event.counts[source][batch.level_col[o]] += 1
+    # Only the newest lines of each source are sent; the rest are counted.
+    for o in range(len(sources) - 1, -1, -1):
+        source = sources[o]
+        lines = event.logs[source]
+        if len(lines) >= LIVE.max_lines:
+            event.skipped[source] += 1
+            continue
+        lines.append(
+            {
+                "id": first_id + o,
+                "timestamp": batch.ts_col[o],
+                "source": source,
+                "level": batch.level_col[o],
+                "message": batch.message_col[o],
+                "format": batch.format_col[o],
+                "template_id": batch.template_col[o],
+            }
+        )
+    for lines in event.logs.values():
+        lines.reverse()
+    for o, name, value, ts_us in batch.metric_rows:
+        event.add_metric(sources[o], name, ts_us // 1_000_000, value)
+    # Only the rows _write_batch stored: sketched fields' values are not sent.
+    for o, name, value, _ in category_rows:
+        event.categories[sources[o]][name][value] += 1
+    event.stats = STATS.snapshot()
+    return event
+
+
+def _insert_entries(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    if not DB.is_open:
+        raise HTTPException(status_code=500, detail="Database unavailable")
+
+    ingested = 0
+    by_format: Dict[str, int] = defaultdict(int)
+    # One transaction per batch, so other queued writes interleave with a
+    # large upload.
+    for start in range(0, len(entries), INSERT_BATCH_SIZE):
+        batch = _prepare_batch(entries[start:start + INSERT_BATCH_SIZE], by_format)
+        first_id, category_rows = DB.write(_write_batch, batch)
+        ingested += len(batch.ts_col)
+        if LIVE.active:
+            LIVE.publish(_live_event(batch, first_id, category_rows))
+        touched = AGGREGATOR.observe((n, ts_us, v) for o, n, v, ts_us in batch.metric_rows)
+        if touched:
+            _dispatch_alerts(AGGREGATOR.evaluate(touched))
+    return {"ingested": ingested, "formats": dict(by_format)}
+
+
+# Parsed entries wait in a queue of up to LOGLENS_INGEST_QUEUE_ROWS rows (0
+# commits inside the request instead); one thread commits them in groups of
+# up to INSERT_BATCH_SIZE rows, lingering LOGLENS_INGEST_LINGER_MS for a
+# group to fill. LOGLENS_INGEST_SPOOL_DIR also spools them to disk.
+INGEST_QUEUE_ROWS = int(os.environ.get("LOGLENS_INGEST_QUEUE_ROWS", "200000"))
+INGEST_SPOOL_DIR = os.environ.get("LOGLENS_INGEST_SPOOL_DIR", "")
+INGEST = ingest_queue.IngestQueue(
+    _insert_entries,
+    max_rows=INGEST_QUEUE_ROWS,
+    group_rows=INSERT_BATCH_SIZE,
+    linger=int(os.environ.get("LOGLENS_INGEST_LINGER_MS", "10")) / 1000,
+    spool_dir=Path(INGEST_SPOOL_DIR) if INGEST_SPOOL_DIR else None,
+)
+
+
+def _formats(entries: List[Dict[str, Any]]) -> Dict[str, int]:
+    by_format: Dict[str, int] = defaultdict(int)
+    for e in entries:
+        by_format[e.get("format_detected", "plain")] += 1
+    return dict(by_format)
+
+
+async def _enqueue(entries: List[Dict[str, Any]], wait: bool) -> JSONResponse:
+    if INGEST_QUEUE_ROWS <= 0:
+        result = await run_in_threadpool(_insert_entries, entries)
+        return JSONResponse({"status": "ok", **result})
+    future = await run_in_threadpool(INGEST.offer, entries)
+    if future is None:
+        raise HTTPException(
+            status_code=429, detail="Ingest queue is full", headers={"Retry-After": str(INGEST.retry_after())}
+        )
+    if wait:
+        await asyncio.wrap_future(future)
+        return JSONResponse({"status": "ok", "ingested": len(entries), "formats": _formats(entries)})
+    return JSONResponse({"status": "accepted", "accepted": len(entries), "formats": _formats(entries)}, status_code=202)
+
+
+def _apply_source(entries: List[Dict[str, Any]], source: str) -> List[Dict[str, Any]]:
+    if source and source != "ingest":
+        for p in entries:
+            p["source"] = source
+    return entries
+
+
+def _should_stream(request: Request, stream: Optional[bool]) -> bool:
+    if stream is not None:
+        return stream
+    length = request.headers.get("content-length")
+    if length is None or not length.isdigit():
+        return True
+    return int(length) > STREAM_THRESHOLD_BYTES
+
+
+async def _parse_body(text: str, source: str) -> List[Dict[str, Any]]:
+    if len(text) < PARSE_POOL.min_bytes:
+        return detect_and_parse(text, source=source)
+    # Keep large parses off the event loop, in the pool when it is enabled.
+    return await run_in_threadpool(PARSE_POOL.parse, text, source)
+
+
+async def _ingest_stream(request: Request, source: str) -> Dict[str, Any]:
+    parser = StreamParser(source=source)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    received = 0
+    ingested = 0
+    by_format: Dict[str, int] = defaultdict(int)
+    pending: List[Dict[str, Any]] = []
+
+    async def flush(batch: List[Dict[str, Any]]) -> None:
+        nonlocal ingested
+        batch = _apply_source(batch, source)
+        if INGEST_QUEUE_ROWS <= 0:
+            await run_in_threadpool(_insert_entries, batch)
+        else:
+            # Waits for room instead of answering 429 halfway through a
+            # body, and for the commit, so memory stays bounded.
+            future = await run_in_threadpool(INGEST.offer, batch, None)
+            if future is None:
+                raise HTTPException(status_code=503, detail="Ingest queue is closed")
+            await asyncio.wrap_future(future)
+        ingested += len(batch)
+        for fmt, count in _formats(batch).items():
+            by_format[fmt] += count
+
+    async for chunk in request.stream():
+        received += len(chunk)
+        pending.extend(await run_in_threadpool(parser.feed, decoder.decode(chunk)))
+        while len(pending) >= INSERT_BATCH_SIZE:
+            await flush(pending[:INSERT_BATCH_SIZE])
+            del pending[:INSERT_BATCH_SIZE]
+    pending.extend(parser.feed(decoder.decode(b"", final=True)))
+    pending.extend(parser.close())
+    if pending:
+        await flush(pending)
+
+    if not received:
+        raise HTTPException(status_code=400, detail="Empty request body")
+    if not ingested:
+        raise HTTPException(status_code=400, detail="No log entries parsed")
     return {"ingested": ingested, "formats": dict(by_format)}
 
 
 @app.post("/api/ingest")
-async def ingest(request: Request, source: str = Query(default="ingest")) -> JSONResponse:
+async def ingest(
+    request: Request,
+    source: str = Query(default="ingest"),
+    stream: Optional[bool] = Query(default=None),
+    wait: bool = Query(default=False),
+) -> JSONResponse:
+    """Parse a body of log lines and queue them: 202, or 429 when the queue is full.
+
+    ``wait=true`` answers 200 once the entries are committed. Streamed
+    bodies are always committed before the answer. A 202 is not durable
+    without LOGLENS_INGEST_SPOOL_DIR: queued entries are lost if the process
+    stops first, and a request whose commit fails is only logged.
+    """
+    if _should_stream(request, stream):
+        result = await _ingest_stream(request, source)
+        return JSONResponse({"status": "ok", **result})
+
     body = await request.body()
     if not body:
         raise HTTPException(status_code=400, detail="Empty request body")
     content_type = request.headers.get("content-type", "")
 
     text = body.decode("utf-8", errors="replace")
-    parsed: List[Dict[str, Any]] = []
+    parsed: Optional[List[Dict[str, Any]]] = None
 
-    try:
-        if "application/json" in content_type:
-            obj = json.loads(text)
-            if isinstance(obj, list):
-                text_for_detector = json.dumps(obj)
-            elif isinstance(obj, dict):
-                text_for_detector = json.dumps(obj)
-            else:
-                text_for_detector = text
-            parsed = detect_and_parse(text_for_detector, source=source)
+    if "application/json" in content_type:
+        # Decoded once, straight into the JSON parser; raw_line keeps the
+        # original text of each element.
+        if len(text) < PARSE_POOL.min_bytes:
+            parsed = parse_json_text(text, source)
         else:
-            parsed = detect_and_parse(text, source=source)
-    except json.JSONDecodeError:
-        parsed = detect_and_parse(text, source=source)
+            parsed = await run_in_threadpool(parse_json_text, text, source)
+    if parsed is None:
+        parsed = await _parse_body(text, source)
 
     if not parsed:
         raise HTTPException(status_code=400, detail="No log entries parsed")
 
-    for p in parsed:
-        if source and source != "ingest":
-            p["source"] = source
+    return await _enqueue(_apply_source(parsed, source), wait)
+
+
+def _cached(
+    request: Request, scopes: List[str], compute: Callable[[], Any], vary: Optional[Hashable] = None
+) -> Response:
+    """compute()'s JSON, reused while ``scopes`` and ``vary`` are unchanged; 304 when the client has it."""
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+    token = VERSIONS.token(scopes) + (vary,)
+    entry = RESPONSE_CACHE.get(key, token)
+    if entry is None:
+        entry = RESPONSE_CACHE.put(key, token, json_dumps(compute()).encode("utf-8"))
+    # no-cache: browsers revalidate with If-None-Match instead of reusing blindly.
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if cache.etag_matches(request.headers.get("if-none-match"), entry.etag):
+        RESPONSE_CACHE.record_not_modified()
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
+
 
-    result = _insert_entries(parsed)
-    return JSONResponse({"status": "ok", **result})
+def _data_scopes(source: Optional[str]) -> List[str]:
+    return [cache.source_scope(source)] if source else [cache.DATA]
 
 
 @app.get("/api/sources")
-def get_sources() -> Dict[str, Any]:
-    with DB_LOCK:
-        cur = conn.execute("SELECT DISTINCT source FROM log_entries ORDER BY source")
-        rows = [r[0] for r in cur.fetchall()]
-    return {"sources": rows}
+def get_sources(request: Request) -> Response:
+    return _cached(request, [cache.SOURCES], _sources)
+
+
+def _sources() -> Dict[str, Any]:
+    ids = set()
+    with DB.read() as conn:
+        for day in partitions.overlapping(conn):
+            cur = conn.execute(f"SELECT DISTINCT source_id FROM {partitions.table('log_entries', day)}")
+            ids.update(r[0] for r in cur)
+        sources = STRINGS.decode(conn, ids)
+    return {"sources": sorted(sources.values())}
 
 
 @app.get("/api/metrics")
-def get_metrics(source: Optional[str] = None, from_: Optional[str] = Query(default=None, alias="from"), to: Optional[str] = None):
+def get_metrics(
+    request: Request,
+    source: Optional[str] = None,
+    from_: Optional[str] = Query(default=None, alias="from"),
+    to: Optional[str] = None,
+    resolution: str = Query(default="auto", pattern="^(auto|raw|1s|1m|1h)$"),
+    step: Optional[int] = Query(default=None, ge=1),
+    max_points: int = Query(default=rollups.MAX_POINTS_DEFAULT, ge=1, le=10000),
+) -> Response:
+    return _cached(
+        request, _data_scopes(source), lambda: _metrics(source, from_, to, resolution, step, max_points)
+    )
+
+
+def _metrics(
+    source: Optional[str], from_: Optional[str], to: Optional[str], resolution: str, step: Optional[int], max_points: int
+) -> Dict[str, Any]:
+    # Naive UTC from here on, like rollup buckets, so every path accepts the
+    # same inputs and compares them the same way.
+    from_ = iso_micros(_micros_param(from_, "from")) if from_ else None
+    to = iso_micros(_micros_param(to, "to")) if to else None
+    if resolution != "raw":
+        horizon = _rollup_horizon()
+        with DB.read() as conn:
+            table_res, step_s = rollups.choose(conn, source, from_, to, resolution, step, max_points)
+            extra = None
+            if horizon and (not from_ or from_ < horizon):
+                # Rollups before the horizon have expired; aggregate those
+                # days from the archive and the raw rows not archived yet.
+                last = (datetime.fromisoformat(horizon) - timedelta(microseconds=1)).isoformat()
+                last = min(to, last) if to else last
+                extra = archive.aggregate(conn, ARCHIVE_DIR, step_s, source, from_, last)
+                for key, cell in _raw_cells(conn, step_s, source, from_, last).items():
+                    acc = extra.setdefault(key, [0, 0.0, cell[2], cell[3]])
+                    acc[0] += cell[0]
+                    acc[1] += cell[1]
+                    acc[2] = min(acc[2], cell[2])
+                    acc[3] = max(acc[3], cell[3])
+                from_ = horizon
+            series = rollups.query(conn, table_res, step_s, source, from_, to, max_points, extra)
+        return {"metrics": series, "resolution": table_res, "step": step_s}
+
     filters = ["1=1"]
     params: List[Any] = []
-    if source:
-        filters.append("le.source = ?")
-        params.append(source)
     if from_:
-        filters.append("m.timestamp >= ?")
-        params.append(from_)
- 
-
-    sql = f"""
-    SELECT m.metric_name, m.timestamp, m.metric_value
-    FROM metrics m
-    JOIN log_entries le ON le.id = m.log_entry_id
-    WHERE {' AND '.join(filters)}
-    ORDER BY m.timestamp ASC
-    """
-    with DB_LOCK:
-        cur = conn.execute(sql, params)
-        rows = cur.fetchall()
+        filters.append("m.ts_us >= ?")
+        params.append(_micros_param(from_, "from"))
+    if to:
+        filters.append("m.ts_us <= ?")
+        params.append(_micros_param(to, "to"))
+
+    rows: List[tuple] = []
+    with DB.read() as conn:
+        rows.extend(archive.raw_rows(conn, ARCHIVE_DIR, source, from_, to))
+        archived = bool(rows)
+        if source:
+            filters.append("le.source_id = ?")
+            params.append(STRINGS.id_of(conn, source))
+        days = partitions.overlapping(conn, from_, to)
+        for day in days:
+            sql = f"""
+            SELECT m.metric_name, m.timestamp, m.metric_value, m.ts_us
+            FROM {partitions.table('metrics', day)} m
+            JOIN {partitions.table('log_entries', day)} le ON le.id = m.log_entry_id
+            WHERE {' AND '.join(filters)}
+            ORDER BY m.ts_us ASC
+            """
+            rows.extend(conn.execute(sql, params))
+    # Partitions follow the written date, not UTC, and legacy and archived
+    # rows (rows of an archived day can arrive late) interleave with them.
+    rows.sort(key=lambda r: r[3])
 
     series: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
-    for name, ts, value in rows:
+    for name, ts, value, _ in rows:
         series[name].append({"t": ts, "v": value})
-    return {"metrics": series}
+    return {"metrics": series, "resolution": "raw"}
 
 
-@app.get("/api/categories")
-def get_categories(source: Optional[str] = None):
-    filters = ["1=1"]
-    params: List[Any] = []
+def _raw_cells(
+    conn: sqlite3.Connection, step: int, source: Optional[str], from_: Optional[str], to: Optional[str]
+) -> Dict[tuple, List[float]]:
+    """(metric_name, bucket epoch second) -> [count, sum, min, max] of raw metrics rows."""
+    filters = ["m.ts_us <= ?"]
+    params: List[Any] = [_micros_param(to, "to")]
+    if from_:
+        filters.append("m.ts_us >= ?")
+        params.append(_micros_param(from_, "from"))
     if source:
-        filters.append("le.source = ?")
-        params.append(source)
-    sql = f"""
-    SELECT c.category_name, c.category_value, COUNT(*)
-    FROM categories c
-    JOIN log_entries le ON le.id = c.log_entry_id
-    WHERE {' AND '.join(filters)}
-    GROUP BY c.category_name, c.category_value
-    ORDER BY c.category_name ASC, COUNT(*) DESC
-    """
-    with DB_LOCK:
-        rows = conn.execute(sql, params).fetchall()
+        filters.append("le.source_id = ?")
+        params.append(STRINGS.id_of(conn, source))
+    cells: Dict[tuple, List[float]] = {}
+    for day in partitions.overlapping(conn, from_, to):
+        m = partitions.table("metrics", day)
+        # Without a source filter this reads the (metric_name, ts_us, metric_value) index only.
+        join = f"JOIN {partitions.table('log_entries', day)} le ON le.id = m.log_entry_id" if source else ""
+        sql = f"""
+        SELECT m.metric_name, (m.ts_us / ?) * ? AS b,
+               COUNT(*), SUM(m.metric_value), MIN(m.metric_value), MAX(m.metric_value)
+        FROM {m} m {join}
+        WHERE {' AND '.join(filters)}
+        GROUP BY m.metric_name, b
+        """
+        for name, b, count, total, vmin, vmax in conn.execute(sql, [step * 1_000_000, step] + params):
+            cell = cells.get((name, b))
+            if cell is None:
+                cells[(name, b)] = [count, total, vmin, vmax]
+            else:
+                cell[0] += count
+                cell[1] += total
+                cell[2] = min(cell[2], vmin)
+                cell[3] = max(cell[3], vmax)
+    return cells
+
+
+@app.get("/api/categories")
+def get_categories(request: Request, source: Optional[str] = None) -> Response:
+    return _cached(request, _data_scopes(source), lambda: _categories(source))
+
+
+def _categories(source: Optional[str]) -> Dict[str, Any]:
+    by_id: Dict[tuple, int] = defaultdict(int)
+    counts: Dict[tuple, int] = defaultdict(int)
+    sketched = CATEGORIES.snapshot(source, TOP_CATEGORY_VALUES)
+    with DB.read() as conn:
+        source_id = STRINGS.id_of(conn, source) if source else None
+        # Rows of sketched fields stored before their promotion are skipped.
+        skipped = [i for i in (STRINGS.id_of(conn, name) for name in CATEGORIES.promoted()) if i is not None]
+        skipped_sql = ",".join(map(str, skipped))
+        for day in partitions.overlapping(conn):
+            c = partitions.table("categories", day)
+            if source:
+                sql = f"""
+                SELECT c.name_id, c.value_id, COUNT(*)
+                FROM {c} c
+                JOIN {partitions.table('log_entries', day)} le ON le.id = c.log_entry_id
+                WHERE le.source_id = ? AND c.name_id NOT IN ({skipped_sql})
+                GROUP BY c.name_id, c.value_id
+                """
+                rows = conn.execute(sql, (source_id,))
+            else:
+                # Integer keys: the grouping is a scan of the (name_id, value_id) index.
+                rows = conn.execute(
+                    f"SELECT name_id, value_id, COUNT(*) FROM {c} WHERE name_id NOT IN ({skipped_sql}) GROUP BY name_id, value_id"
+                )
+            for name_id, value_id, count in rows:
+                by_id[(name_id, value_id)] += count
+        names = STRINGS.decode(conn, (i for key in by_id for i in key))
+        for (name_id, value_id), count in by_id.items():
+            counts[(names.get(name_id, ""), names.get(value_id, ""))] += count
+
+        top = _template_counts(conn, source, None, None)[:TOP_TEMPLATES]
+        for _, text, count in top:
+            counts[("template", text)] += count
 
     result: Dict[str, Dict[str, int]] = defaultdict(dict)
-    for cname, cval, count in rows:
+    for (cname, cval), count in sorted(counts.items(), key=lambda kv: (kv[0][0], -kv[1])):
         result[cname][cval] = count
-    return {"categories": result}
+    distinct = {name: len(values) for name, values in result.items() if name != "template"}
+    for name, sketch in sketched.items():
+        result[name] = dict(sketch["top"])
+        distinct[name] = sketch["distinct"]
+    # Counts and distinct values of sketched fields are estimates.
+    return {"categories": result, "distinct": distinct, "approximate": sorted(sketched)}
 
 
-@app.get("/api/logs")
-def get_logs(source: Optional[str] = None, level: Optional[str] = None, limit: int = 100):
+TOP_TEMPLATES = 10
+TOP_CATEGORY_VALUES = 10
+
+
+def _template_counts(conn: sqlite3.Connection, source: Optional[str], from_, to) -> List[tuple]:
+    """(template_id, template, count) of the entries in range, most frequent first."""
+    filters, params = _log_filters(conn, source, None, from_, to)
+    filters.append("template_id IS NOT NULL")
+    counts: Dict[int, int] = defaultdict(int)
+    for day in partitions.overlapping(conn, from_, to):
+        sql = f"""
+        SELECT template_id, COUNT(*) FROM {partitions.table('log_entries', day)}
+        WHERE {' AND '.join(filters)}
+        GROUP BY template_id
+        """
+        for template_id, count in conn.execute(sql, params):
+            counts[template_id] += count
+    rows = [(tid, TEMPLATES.template(tid) or "", count) for tid, count in counts.items()]
+    rows.sort(key=lambda r: (-r[2], r[0]))
+    return rows
+
+
+@app.get("/api/templates")
+def get_templates(
+    request: Request,
+    source: Optional[str] = None,
+    from_: Optional[str] = Query(default=None, alias="from"),
+    to: Optional[str] = None,
+    limit: int = 50,
+) -> Response:
+    return _cached(request, _data_scopes(source), lambda: _templates(source, from_, to, limit))
+
+
+def _templates(source: Optional[str], from_: Optional[str], to: Optional[str], limit: int) -> Dict[str, Any]:
     limit = min(max(limit, 1), 1000)
+    with DB.read() as conn:
+        rows = _template_counts(conn, source, from_, to)
+    return {
+        "templates": [{"id": tid, "template": text, "count": count} for tid, text, count in rows[:limit]],
+        "total": len(rows),
+    }
+
+
+ENTRY_COLUMNS = "id, timestamp, source_id, level_id, message, raw_line, format_id, created_at, template_id, ts_us"
+# Positions of the dictionary-encoded columns and of ts_us in ENTRY_COLUMNS.
+ENTRY_STRING_COLUMNS = (2, 3, 6)
+ENTRY_TIME_COLUMN = 9
+EXPORT_BATCH_SIZE = int(os.environ.get("LOGLENS_EXPORT_BATCH_SIZE", "2000"))
+
+
+def _entry_order(row: tuple) -> tuple:
+    return row[ENTRY_TIME_COLUMN], row[0]
+
+
+def _newest_rows(conn: sqlite3.Connection, build_sql, params: List[Any], limit: int, from_, to) -> List[tuple]:
+    """Up to ``limit`` rows ordered by (ts_us, id) descending.
+
+    ``build_sql(table)`` must select from that entries table in that order
+    with a trailing ``LIMIT ?``. Day partitions are read newest first and
+    reading stops once the limit is reached.
+    """
+    days = partitions.overlapping(conn, from_, to)
+    rows: List[tuple] = []
+    for day in reversed(days):
+        if day is None or len(rows) >= limit:
+            continue
+        rows.extend(conn.execute(build_sql(partitions.table("log_entries", day)), params + [limit - len(rows)]))
+    if None in days:
+        rows.extend(conn.execute(build_sql("log_entries"), params + [limit]))
+        rows.sort(key=_entry_order, reverse=True)
+        del rows[limit:]
+    return rows
+
+
+def _fetch_batches(cur: sqlite3.Cursor, size: int) -> Iterator[tuple]:
+    while True:
+        rows = cur.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+
+def _stream_rows(conn: sqlite3.Connection, build_sql, params: List[Any], from_, to, size: int) -> Iterator[List[tuple]]:
+    """Every matching row, newest first, in lists of at most ``size``.
+
+    Partitions are read one after the other through fetchmany(), so memory
+    stays bounded however many rows match. Legacy rows are merged in by
+    (ts_us, id).
+    """
+    days = partitions.overlapping(conn, from_, to)
+
+    def day_rows() -> Iterator[tuple]:
+        for day in reversed(days):
+            if day is not None:
+                yield from _fetch_batches(conn.execute(build_sql(partitions.table("log_entries", day)), params), size)
+
+    rows: Iterator[tuple] = day_rows()
+    if None in days:
+        legacy = _fetch_batches(conn.execute(build_sql("log_entries"), params), size)
+        rows = heapq.merge(rows, legacy, key=_entry_order, reverse=True)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _log_filters(
+    conn: sqlite3.Connection,
+    source: Optional[str],
+    level: Optional[str],
+    from_: Optional[str],
+    to: Optional[str],
+    template_id: Optional[int] = None,
+):
     filters = ["1=1"]
     params: List[Any] = []
+    # An unknown string has no id; "= NULL" then matches nothing, as it should.
     if source:
-        filters.append("source = ?")
-        params.append(source)
+        filters.append("source_id = ?")
+        params.append(STRINGS.id_of(conn, source))
     if level:
-        filters.append("level = ?")
-        params.append(level)
-    sql = f"""
-    SELECT id, timestamp, source, level, message, raw_line, format_detected, created_at
-    FROM log_entries
-    WHERE {' AND '.join(filters)}
-    ORDER BY timestamp DESC
-    LIMIT ?
+        filters.append("level_id = ?")
+        params.append(STRINGS.id_of(conn, level))
+    if template_id is not None:
+        filters.append("template_id = ?")
+        params.append(template_id)
+    if from_:
+        filters.append("ts_us >= ?")
+        params.append(_micros_param(from_, "from"))
+    if to:
+        filters.append("ts_us <= ?")
+        params.append(_micros_param(to, "to"))
+    return filters, params
+
+
+def _micros_param(value: str, name: str) -> int:
+    micros = utc_micros(value)
+    if micros is None:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} timestamp")
+    return micros
+
+
+def _encode_cursor(row: tuple) -> str:
+    key = [row[ENTRY_TIME_COLUMN], row[0]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        ts, entry_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(ts, int) or not isinstance(entry_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return ts, entry_id
+
+
+def _entry_dict(r: tuple) -> Dict[str, Any]:
+    return {
+        "id": r[0],
+        "timestamp": r[1],
+        "source": r[2],
+        "level": r[3],
+        "message": r[4],
+        "raw_line": r[5],
+        "format": r[6],
+        "created_at": r[7],
+        "template_id": r[8],
+        "params": TEMPLATES.params(r[8], r[4]),
+    }
+
+
+@app.get("/api/logs")
+def get_logs(
+    source: Optional[str] = None,
+    level: Optional[str] = None,
+    limit: int = 100,
+    from_: Optional[str] = Query(default=None, alias="from"),
+    to: Optional[str] = None,
+    q: Optional[str] = None,
+    offset: int = Query(default=0, ge=0, le=search.MAX_OFFSET),
+    cursor: Optional[str] = None,
+    template_id: Optional[int] = None,
+):
+    limit = min(max(limit, 1), 1000)
+
+    if q is not None:
+        if cursor is not None:
+            raise HTTPException(status_code=400, detail="cursor cannot be combined with q; use offset")
+        match = search.match_expression(q)
+        if match is None:
+            raise HTTPException(status_code=400, detail="q has no search terms")
+        with DB.read() as conn:
+            filters, params = _log_filters(conn, source, level, from_, to, template_id)
+            rows = search.search(conn, match, filters, params, limit, offset, from_, to)
+            rows = STRINGS.decode_rows(conn, rows, ENTRY_STRING_COLUMNS)
+        out = []
+        for r in rows:
+            entry = _entry_dict(r)
+            entry["snippet"] = r[9]
+            entry["rank"] = r[10]
+            out.append(entry)
+        more = len(rows) == limit and offset + limit <= search.MAX_OFFSET
+        return {"logs": out, "next_offset": offset + limit if more else None}
+
+    after = _decode_cursor(cursor) if cursor is not None else None
+    with DB.read() as conn:
+        filters, params = _log_filters(conn, source, level, from_, to, template_id)
+        if after is not None:
+            # Keyset pagination: strictly older than the last row of the previous page.
+            filters.append("(ts_us, id) < (?, ?)")
+            params.extend(after)
+
+        def build_sql(table: str) -> str:
+            return f"""
+            SELECT {ENTRY_COLUMNS}
+            FROM {table}
+            WHERE {' AND '.join(filters)}
+            ORDER BY ts_us DESC, id DESC
+            LIMIT ?
+            """
+
+        rows = _newest_rows(conn, build_sql, params, limit, from_, to)
+        rows = STRINGS.decode_rows(conn, rows, ENTRY_STRING_COLUMNS)
+    next_cursor = _encode_cursor(rows[-1]) if len(rows) == limit else None
+    return {"logs": [_entry_dict(r) for r in rows], "next_cursor": next_cursor}
+
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _export_lines(format_: str, source: Optional[str], level: Optional[str], from_, to) -> Iterator[str]:
+    if format_ == "csv":
+        yield "id,timestamp,source,level,message,raw_line,format,created_at,template_id\r\n"
+    # A connection of its own: a long export neither holds a pooled reader
+    # nor blocks the writer, and sees one snapshot from start to end.
+    with DB.reader() as conn:
+        filters, params = _log_filters(conn, source, level, from_, to)
+
+        def build_sql(table: str) -> str:
+            return f"""
+            SELECT {ENTRY_COLUMNS}
+            FROM {table}
+            WHERE {' AND '.join(filters)}
+            ORDER BY ts_us DESC, id DESC
+            """
+
+        for batch in _stream_rows(conn, build_sql, params, from_, to, EXPORT_BATCH_SIZE):
+            batch = STRINGS.decode_rows(conn, batch, ENTRY_STRING_COLUMNS)
+            if format_ == "csv":
+                buf = io.StringIO()
+                csv.writer(buf).writerows(r[:ENTRY_TIME_COLUMN] for r in batch)
+                yield buf.getvalue()
+            else:
+                yield "".join(json_dumps(_entry_dict(r)) + "\n" for r in batch)
+
+
+@app.get("/api/logs/export")
+def export_logs(
+    source: Optional[str] = None,
+    level: Optional[str] = None,
+    from_: Optional[str] = Query(default=None, alias="from"),
+    to: Optional[str] = None,
+    format: str = "ndjson",
+):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    return StreamingResponse(
+        _export_lines(format, source, level, from_, to),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="loglens-export.{format}"'},
+    )
+
+
+@app.get("/api/live")
+async def live_tail(
+    request: Request,
+    source: Optional[List[str]] = Query(default=None),
+    level: Optional[List[str]] = Query(default=None),
+    kinds: str = Query(default=",".join(live.KINDS)),
+) -> StreamingResponse:
+    """Server-sent events of what each committed ingest batch added.
+
+    ``batch`` events carry, per source, the new log lines (the newest
+    LOGLENS_LIVE_MAX_LINES of them), metric cells per second as [second,
+    count, sum, min, max], category value counts and level counts, plus the
+    /api/stats counters. ``resync`` asks the client to reload: it fell too
+    far behind and events were dropped. ``alerts`` reports rule changes.
     """
-    params.append(limit)
-    with DB_LOCK:
-        rows = conn.execute(sql, params).fetchall()
-    out = [
-        {
-            "id": r[0],
-            "timestamp": r[1],
-            "source": r[2],
-            "level": r[3],
-            "message": r[4],
-            "raw_line": r[5],
-            "format": r[6],
-            "created_at": r[7],
-        }
-        for r in rows
-    ]
-    return {"logs": out}
+    wanted = [k for k in kinds.split(",") if k]
+    unknown = [k for k in wanted if k not in live.KINDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"kinds must be among {'/'.join(live.KINDS)}")
+
+    async def events() -> AsyncIterator[str]:
+        sub = LIVE.subscribe(source, level, wanted)
+        try:
+            yield live.frame("hello", json_dumps({"kinds": sorted(sub.kinds)}))
+            while True:
+                try:
+                    item = await asyncio.wait_for(sub.get(), LIVE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                if item is None:
+                    break
+                yield item
+        finally:
+            LIVE.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/ingest/queue")
+def get_ingest_queue() -> Dict[str, Any]:
+    """Ingest queue depth and commit counters."""
+    return INGEST.snapshot()
+
+
+@app.get("/api/cache")
+def get_cache() -> Dict[str, Any]:
+    """Response cache size and hit/miss counters."""
+    return RESPONSE_CACHE.snapshot()
 
 
 @app.get("/api/alerts")
 def get_alerts():
-    with DB_LOCK:
+    with DB.read() as conn:
         rules = conn.execute(
-            "SELECT id, metric_name, condition, threshold, window_seconds, webhook_url, email, enabled FROM alert_rules"
+            "SELECT id, metric_name, condition, threshold, window_seconds, webhook_url, email, enabled, aggregation,"
+            " cooldown_seconds FROM alert_rules"
         ).fetchall()
         history = conn.execute(
             "SELECT id, rule_id, triggered_at, metric_value, notified FROM alert_history ORDER BY triggered_at DESC LIMIT 100"
@@ -332,6 +1285,8 @@ def get_alerts():
                 "webhook_url": r[5],
                 "email": r[6],
                 "enabled": bool(r[7]),
+                "aggregation": r[8],
+                "cooldown_seconds": r[9],
             }
             for r in rules
         ],
@@ -342,6 +1297,26 @@ def get_alerts():
     }
 
 
+def _insert_rule(conn: sqlite3.Connection, rule: tuple) -> int:
+    cur = conn.execute(
+        """
+        INSERT INTO alert_rules (
+            metric_name, condition, threshold, window_seconds, webhook_url, email, enabled, aggregation, cooldown_seconds
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rule,
+    )
+    conn.commit()
+    return cur.lastrowid
+
+
+def _delete_rule(conn: sqlite3.Connection, rule_id: int) -> int:
+    cur = conn.execute("DELETE FROM alert_rules WHERE id = ?", (rule_id,))
+    conn.commit()
+    return cur.rowcount
+
+
 @app.post("/api/alerts/rules")
 async def create_alert_rule(request: Request):
     data = await request.json()
@@ -352,62 +1327,57 @@ async def create_alert_rule(request: Request):
 
     if data["condition"] not in {"gt", "lt", "eq"}:
         raise HTTPException(status_code=400, detail="condition must be gt/lt/eq")
+    cooldown = data.get("cooldown_seconds")
+    if cooldown is not None:
+        try:
+            cooldown = int(cooldown)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="cooldown_seconds must be an integer")
+        if cooldown < 0:
+            raise HTTPException(status_code=400, detail="cooldown_seconds must be >= 0")
+    aggregation = data.get("aggregation") or "avg"
+    if aggregation not in alerts.AGGREGATIONS:
+        raise HTTPException(status_code=400, detail=f"aggregation must be one of {'/'.join(alerts.AGGREGATIONS)}")
 
-    with DB_LOCK:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO alert_rules (metric_name, condition, threshold, window_seconds, webhook_url, email, enabled)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                data["metric_name"],
-                data["condition"],
-                float(data["threshold"]),
-                int(data["window_seconds"]),
-                data.get("webhook_url"),
-                data.get("email"),
-                1,
-            ),
-        )
-        conn.commit()
-        rid = cur.lastrowid
+    rule = (
+        data["metric_name"],
+        data["condition"],
+        float(data["threshold"]),
+        int(data["window_seconds"]),
+        data.get("webhook_url"),
+        data.get("email"),
+        1,
+        aggregation,
+        cooldown,
+    )
+    rid = await asyncio.wrap_future(DB.submit(_insert_rule, rule))
+    await run_in_threadpool(_reload_alert_rules)
+    VERSIONS.bump([cache.ALERTS])
+    LIVE.notify("alerts", {"status": "created", "id": rid})
     return {"status": "created", "id": rid}
 
 
 @app.delete("/api/alerts/rules/{rule_id}")
 def delete_alert_rule(rule_id: int):
-    with DB_LOCK:
-        cur = conn.cursor()
-        cur.execute("DELETE FROM alert_rules WHERE id = ?", (rule_id,))
-        conn.commit()
-        if cur.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Rule not found")
+    if DB.write(_delete_rule, rule_id) == 0:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    _reload_alert_rules()
+    VERSIONS.bump([cache.ALERTS])
+    LIVE.notify("alerts", {"status": "deleted", "id": rule_id})
     return {"status": "deleted", "id": rule_id}
 
 
 @app.get("/api/stats")
-def stats():
-    now = datetime.utcnow()
-    minute_ago = (now - timedelta(minutes=1)).isoformat()
-    with DB_LOCK:
-        total = conn.execute("SELECT COUNT(*) FROM log_entries").fetchone()[0]
-        per_min = conn.execute("SELECT COUNT(*) FROM log_entries WHERE timestamp >= ?", (minute_ago,)).fetchone()[0]
-        errors = conn.execute(
-            "SELECT COUNT(*) FROM log_entries WHERE level = 'ERROR'"
-        ).fetchone()[0]
-        top_sources = conn.execute(
-            "SELECT source, COUNT(*) AS c FROM log_entries GROUP BY source ORDER BY c DESC LIMIT 10"
-        ).fetchall()
-        active_alerts = conn.execute("SELECT COUNT(*) FROM alert_rules WHERE enabled = 1").fetchone()[0]
+def get_stats(request: Request) -> Response:
+    # entries_per_min moves with the clock, so a response lasts one second.
+    return _cached(request, [cache.DATA, cache.ALERTS], _stats, vary=int(time.time()))
 
-    return {
-        "total_entries": total,
-        "entries_per_min": per_min,
-        "error_rate": (errors / total) if total else 0.0,
-        "top_sources": [{"source": s, "count": c} for s, c in top_sources],
-        "active_alerts": active_alerts,
-    }
+
+def _stats() -> Dict[str, Any]:
+    # Counters are maintained at ingest; only the small rules table is read.
+    with DB.read() as conn:
+        active_alerts = conn.execute("SELECT COUNT(*) FROM alert_rules WHERE enabled = 1").fetchone()[0]
+    return {**STATS.snapshot(), "active_alerts": active_alerts}
 
 
 def print_banner() -> None:
@@ -423,6 +1393,60 @@ def print_banner() -> None:
     print("LogLens running at http://localhost:8000")
 
 
+def _fold_archive_into_rollups(conn: sqlite3.Connection) -> None:
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        rollups.apply(cur, archive.records(conn, ARCHIVE_DIR))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def rebuild_derived(
+    rebuild_stats: bool, rebuild_rollups: bool, migrate: bool = False, mine_templates: bool = False
+) -> None:
+    DB.open(init_db)
+    try:
+        if migrate:
+            logger.info("Moving legacy rows into day partitions")
+            moved = DB.write(partitions.migrate_legacy)
+            logger.info("Moved %d entries", moved)
+        if rebuild_stats:
+            logger.info("Rebuilding stats counters from log_entries")
+            DB.write(stats.rebuild)
+        if rebuild_rollups:
+            logger.info("Rebuilding metric rollups from metrics")
+            DB.write(rollups.rebuild)
+            DB.write(_fold_archive_into_rollups)
+        if mine_templates:
+            logger.info("Mining templates of entries stored without one")
+            with DB.read() as conn:
+                TEMPLATES.load(conn)
+            mined = DB.write(templates.backfill, TEMPLATES, FREE_TEXT_FORMATS)
+            logger.info("Assigned templates to %d entries", mined)
+    finally:
+        DB.close()
+
+
 if __name__ == "__main__":
-    print_banner()
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="LogLens server")
+    parser.add_argument("--rebuild-stats", action="store_true", help="recompute stats counters and exit")
+    parser.add_argument("--rebuild-rollups", action="store_true", help="recompute metric rollups and exit")
+    parser.add_argument(
+        "--migrate-partitions", action="store_true", help="move pre-partitioning rows into day partitions and exit"
+    )
+    parser.add_argument(
+        "--mine-templates", action="store_true", help="assign templates to entries stored without one and exit"
+    )
+    args = parser.parse_args()
+    if args.rebuild_stats or args.rebuild_rollups or args.migrate_partitions or args.mine_templates:
+        rebuild_derived(args.rebuild_stats, args.rebuild_rollups, args.migrate_partitions, args.mine_templates)
+    else:
+        print_banner()
+        uvicorn.run(
+            "main:app", host="0.0.0.0", port=8000, reload=False, timeout_graceful_shutdown=SHUTDOWN_GRACE_SECONDS
+        )
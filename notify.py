@@ -0,0 +1,272 @@
+import heapq
+import http.client
+import itertools
+import json
+import logging
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("loglens.notify")
+
+# (history ids, delivered) once a job succeeds or runs out of attempts
+ResultCallback = Callable[[List[int], bool], None]
+
+KINDS = ("webhook", "email")
+
+
+class _Job:
+    __slots__ = ("kind", "target", "payloads", "history_ids", "attempts", "due")
+
+    def __init__(self, kind: str, target: str) -> None:
+        self.kind = kind
+        self.target = target
+        self.payloads: List[Dict[str, Any]] = []
+        self.history_ids: List[int] = []
+        self.attempts = 0
+        self.due = 0.0
+
+
+class _Connections:
+    """One worker's keep-alive HTTP connections and SMTP session."""
+
+    def __init__(self) -> None:
+        self.http: Dict[Tuple[str, str], http.client.HTTPConnection] = {}
+        self.smtp: Optional[smtplib.SMTP] = None
+
+    def close(self) -> None:
+        for conn in self.http.values():
+            conn.close()
+        self.http.clear()
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                self.smtp.close()
+            self.smtp = None
+
+
+class Notifier:
+    """Delivers alert notifications off the request and writer threads.
+
+    submit() queues a webhook or email for a worker pool. While a job for
+    the same (kind, target) is still waiting, new alerts are folded into it
+    instead of queueing another delivery. Failed deliveries are retried with
+    exponential backoff. The queue is bounded; when it is full new targets
+    are dropped with a warning.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_pending: int = 1000,
+        max_attempts: int = 5,
+        backoff: float = 0.5,
+        backoff_max: float = 30.0,
+        timeout: float = 8.0,
+        smtp_host: str = "localhost",
+        smtp_port: int = 25,
+        sender: str = "loglens@localhost",
+        idle_seconds: float = 60.0,
+        on_result: Optional[ResultCallback] = None,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.smtp_host = smtp_host
+        self.smtp_port = smtp_port
+        self.sender = sender
+        self.idle_seconds = idle_seconds
+        self.on_result = on_result
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int, _Job]] = []
+        self._seq = itertools.count()
+        self._waiting: Dict[Tuple[str, str], _Job] = {}
+        self._threads: List[threading.Thread] = []
+        self._closing = False
+
+    def start(self) -> None:
+        with self._cond:
+            if self._threads:
+                return
+            self._closing = False
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"loglens-notify-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop the workers after they drain jobs that are already due."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._threads = []
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def submit(self, kind: str, target: str, payload: Dict[str, Any], history_id: Optional[int] = None) -> bool:
+        if kind not in KINDS:
+            raise ValueError(f"unknown notification kind: {kind}")
+        if not target:
+            return False
+        with self._cond:
+            job = self._waiting.get((kind, target))
+            if job is None:
+                if len(self._heap) >= self.max_pending:
+                    logger.warning("Notification queue full; dropping %s to %s", kind, target)
+                    return False
+                job = _Job(kind, target)
+                job.due = time.monotonic()
+                self._waiting[(kind, target)] = job
+                heapq.heappush(self._heap, (job.due, next(self._seq), job))
+                self._cond.notify()
+            job.payloads.append(payload)
+            if history_id is not None:
+                job.history_ids.append(history_id)
+        return True
+
+    def _next_job(self, conns: _Connections) -> Optional[_Job]:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    job = heapq.heappop(self._heap)[2]
+                    self._waiting.pop((job.kind, job.target), None)
+                    return job
+                if self._closing:
+                    return None
+                wait = self._heap[0][0] - now if self._heap else self.idle_seconds
+                if not self._cond.wait(min(wait, self.idle_seconds)) and not self._heap:
+                    # Idle: let servers reclaim the keep-alive connections.
+                    conns.close()
+
+    def _run(self) -> None:
+        conns = _Connections()
+        try:
+            while True:
+                job = self._next_job(conns)
+                if job is None:
+                    return
+                self._deliver(job, conns)
+        finally:
+            conns.close()
+
+    def _deliver(self, job: _Job, conns: _Connections) -> None:
+        job.attempts += 1
+        try:
+            if job.kind == "webhook":
+                ok = self._send_webhook(conns, job.target, _webhook_body(job.payloads))
+            else:
+                ok = self._send_email(conns, job.target, job.payloads)
+        except Exception as exc:
+            logger.warning("%s delivery to %s failed: %s", job.kind, job.target, exc)
+            ok = False
+        if not ok and job.attempts < self.max_attempts and not self._closing:
+            self._retry(job)
+            return
+        if not ok:
+            logger.warning("Giving up on %s to %s after %d attempts", job.kind, job.target, job.attempts)
+        if self.on_result is not None and job.history_ids:
+            try:
+                self.on_result(job.history_ids, ok)
+            except Exception as exc:
+                logger.exception("Notification result callback failed: %s", exc)
+
+    def _retry(self, job: _Job) -> None:
+        delay = min(self.backoff * 2 ** (job.attempts - 1), self.backoff_max)
+        with self._cond:
+            key = (job.kind, job.target)
+            newer = self._waiting.get(key)
+            if newer is not None:
+                # Alerts arrived meanwhile; deliver them together.
+                newer.payloads[:0] = job.payloads
+                newer.history_ids[:0] = job.history_ids
+                newer.attempts = max(newer.attempts, job.attempts)
+                return
+            job.due = time.monotonic() + delay
+            self._waiting[key] = job
+            heapq.heappush(self._heap, (job.due, next(self._seq), job))
+            self._cond.notify()
+
+    def _send_webhook(self, conns: _Connections, url: str, body: bytes) -> bool:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        headers = {"Content-Type": "application/json"}
+        for fresh in (False, True):
+            conn = conns.http.get(key)
+            reused = conn is not None
+            if conn is None:
+                factory = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+                conn = conns.http[key] = factory(parts.netloc, timeout=self.timeout)
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                conns.http.pop(key, None)
+                # A kept-alive connection may have been closed by the server;
+                # retry once on a new one before counting a failure.
+                if reused and not fresh:
+                    continue
+                raise
+            if resp.will_close:
+                conn.close()
+                conns.http.pop(key, None)
+            return 200 <= resp.status < 300
+        return False
+
+    def _smtp_session(self, conns: _Connections) -> smtplib.SMTP:
+        if conns.smtp is None:
+            conns.smtp = smtplib.SMTP(host=self.smtp_host, port=self.smtp_port, timeout=self.timeout)
+        return conns.smtp
+
+    def _send_email(self, conns: _Connections, recipient: str, payloads: List[Dict[str, Any]]) -> bool:
+        msg = _email_message(self.sender, recipient, payloads)
+        for fresh in (False, True):
+            reused = conns.smtp is not None
+            try:
+                self._smtp_session(conns).send_message(msg)
+                return True
+            except (smtplib.SMTPServerDisconnected, OSError):
+                if conns.smtp is not None:
+                    conns.smtp.close()
+                conns.smtp = None
+                if reused and not fresh:
+                    continue
+                raise
+        return False
+
+
+def _webhook_body(payloads: List[Dict[str, Any]]) -> bytes:
+    # The latest alert keeps the single-alert shape; earlier ones ride along.
+    body = dict(payloads[-1])
+    if len(payloads) > 1:
+        body["coalesced"] = payloads[:-1]
+    return json.dumps(body).encode("utf-8")
+
+
+def _email_message(sender: str, recipient: str, payloads: List[Dict[str, Any]]) -> EmailMessage:
+    msg = EmailMessage()
+    if len(payloads) == 1:
+        msg["Subject"] = f"LogLens Alert Triggered: {payloads[0].get('metric_name')}"
+        msg.set_content(json.dumps(payloads[0], indent=2))
+    else:
+        names = sorted({str(p.get("metric_name")) for p in payloads})
+        msg["Subject"] = f"LogLens: {len(payloads)} Alerts Triggered: {', '.join(names)}"
+        msg.set_content(json.dumps(payloads, indent=2))
+    msg["From"] = sender
+    msg["To"] = recipient
+    return msg
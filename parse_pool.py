@@ -0,0 +1,78 @@
+import logging
+import math
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from detector import FormatParser, ParseResult, detect_and_parse, parse_shard
+
+logger = logging.getLogger("loglens.parse_pool")
+
+
+def _ready() -> bool:
+    # Submitted once per worker by start(): importing this module (and the
+    # detector with it) is the expensive part of a spawned worker's first task.
+    return True
+
+
+class ParsePool:
+    """Parses large bodies by sharding their lines across worker processes.
+
+    Detection is detect_and_parse's own: the format cached for the source is
+    tried first, then the registry in order, with the same error threshold.
+    Only the parse of each candidate format is replaced: formats that can
+    be split (every line format, CSV without quotes) are parsed in shards of
+    lines by the workers with that format's parser, and shards are merged
+    back in order. Bodies under ``min_bytes`` and whole-body JSON documents
+    are parsed in-process.
+    """
+
+    def __init__(self, workers: int = 0, min_bytes: int = 1024 * 1024, shard_lines: int = 5000) -> None:
+        self.workers = max(int(workers), 0)
+        self.min_bytes = min_bytes
+        self.shard_lines = shard_lines
+        self._executor: Optional[Executor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 1
+
+    def start(self) -> None:
+        """Spawn the workers now rather than on the first large body."""
+        if not self.enabled or self._executor is not None:
+            return
+        # spawn: the server process is multi-threaded, forking it is unsafe
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        for _ in range(self.workers):
+            self._executor.submit(_ready)
+        logger.info("Parse pool started with %d workers", self.workers)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def parse(self, text: str, source: str = "ingest") -> List[Dict[str, Any]]:
+        if not self.enabled or len(text) < self.min_bytes:
+            return detect_and_parse(text, source=source)
+        self.start()
+        return detect_and_parse(text, source=source, parse=self._parse_format)
+
+    def _parse_format(self, fmt: FormatParser, text: str, lines: List[str], source: str) -> Optional[ParseResult]:
+        split = fmt.split(text, lines) if fmt.split is not None else None
+        if split is None:
+            return fmt.parse(text, lines, source)
+        header, rows = split
+        size = max(self.shard_lines, math.ceil(len(rows) / (self.workers * 4)))
+        if len(rows) <= size:
+            return fmt.parse(text, lines, source)
+        futures = [
+            self._executor.submit(parse_shard, fmt.name, header, rows[i:i + size], source)
+            for i in range(0, len(rows), size)
+        ]
+        results = [f.result() for f in futures]
+        if any(result is None for result in results):
+            # A shard gave up on its own share of errors; judge the body as
+            # a whole, as the in-process parse would.
+            return fmt.parse(text, lines, source)
+        return [e for entries, _ in results for e in entries], sum(errors for _, errors in results)
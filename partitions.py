@@ -0,0 +1,444 @@
+import re
+import sqlite3
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from timestamps import utc_micros
+
+# Entries, metrics and categories are stored in one table per UTC day of the
+# entry timestamp (its ts_us): log_entries_20240131, metrics_20240131, ...
+# Entries dated outside a window around now go to the partition of the day
+# they were ingested, so a bad payload cannot create a table set per date.
+# The unsuffixed tables from before partitioning are the "legacy" partition
+# (day None); they are read like any other partition but never written.
+BASES = ("log_entries", "metrics", "categories")
+
+DAY_RE = re.compile(r"\d{4}-\d{2}-\d{2}$")
+DAY_US = 86_400 * 1_000_000
+EPOCH = date(1970, 1, 1)
+
+CATALOG_SQL = """
+CREATE TABLE IF NOT EXISTS partitions (
+    day TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS id_sequence (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO id_sequence (name, value)
+VALUES ('log_entries', COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'log_entries'), 0));
+"""
+
+
+def table(base: str, day: Optional[str]) -> str:
+    return base if day is None else f"{base}_{day.replace('-', '')}"
+
+
+def search_table(day: Optional[str]) -> str:
+    return f"{table('log_entries', day)}_fts"
+
+
+def search_sql(day: Optional[str]) -> str:
+    # External content: the index stores tokens only and reads message text
+    # back from the entries table for snippets.
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {search_table(day)} "
+        f"USING fts5(message, content='{table('log_entries', day)}', content_rowid='id')"
+    )
+
+
+def day_window(today: date, max_age_days: int, max_ahead_days: int) -> Tuple[int, int]:
+    """Range of day numbers (days since 1970-01-01) that get their own partition.
+
+    ``max_age_days`` <= 0 sets no lower bound.
+    """
+    number = (today - EPOCH).days
+    first = number - max_age_days if max_age_days > 0 else -(10 ** 9)
+    return first, number + max_ahead_days
+
+
+@lru_cache(maxsize=4096)
+def _day_name(number: int) -> str:
+    return (EPOCH + timedelta(days=number)).isoformat()
+
+
+def day_of(ts_us: int, default: str, window: Tuple[int, int]) -> str:
+    """UTC day of ``ts_us``, or ``default`` when it falls outside ``window``."""
+    number = ts_us // DAY_US
+    if window[0] <= number <= window[1]:
+        try:
+            return _day_name(number)
+        except OverflowError:
+            pass
+    return default
+
+
+def entries_sql(name: str) -> str:
+    # source, level and format are ids into the strings dictionary. timestamp
+    # is the ISO text as parsed, ts_us the same instant in UTC epoch
+    # microseconds; range filters and ordering use ts_us.
+    return f"""
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    ts_us INTEGER NOT NULL,
+    source_id INTEGER NOT NULL,
+    level_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    raw_line TEXT NOT NULL,
+    format_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    template_id INTEGER
+)"""
+
+
+def categories_sql(name: str) -> str:
+    return f"""
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY,
+    log_entry_id INTEGER NOT NULL,
+    name_id INTEGER NOT NULL,
+    value_id INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    ts_us INTEGER NOT NULL
+)"""
+
+
+def partition_sql(day: str) -> str:
+    le, m, c = (table(base, day) for base in BASES)
+    return f"""
+{entries_sql(le)};
+
+CREATE TABLE IF NOT EXISTS {m} (
+    id INTEGER PRIMARY KEY,
+    log_entry_id INTEGER NOT NULL,
+    metric_name TEXT NOT NULL,
+    metric_value REAL NOT NULL,
+    timestamp TEXT NOT NULL,
+    ts_us INTEGER NOT NULL
+);
+
+{categories_sql(c)};
+
+{index_sql(day)}
+
+{search_sql(day)};
+"""
+
+
+def index_sql(day: Optional[str]) -> str:
+    le, m, c = (table(base, day) for base in BASES)
+    return f"""
+CREATE INDEX IF NOT EXISTS idx_{le}_time ON {le}(ts_us);
+CREATE INDEX IF NOT EXISTS idx_{le}_source_time ON {le}(source_id, ts_us);
+CREATE INDEX IF NOT EXISTS idx_{le}_source_level_time ON {le}(source_id, level_id, ts_us);
+CREATE INDEX IF NOT EXISTS idx_{le}_source_template ON {le}(source_id, template_id);
+CREATE INDEX IF NOT EXISTS idx_{m}_name_time_value ON {m}(metric_name, ts_us, metric_value);
+CREATE INDEX IF NOT EXISTS idx_{c}_name ON {c}(name_id, value_id);
+"""
+
+
+def ensure(cur: sqlite3.Cursor, day: str) -> None:
+    """Create the tables for ``day`` inside the caller's write transaction."""
+    if cur.execute("SELECT 1 FROM partitions WHERE day = ?", (day,)).fetchone() is not None:
+        return
+    # executescript() would commit the open transaction, so run one by one.
+    for statement in partition_sql(day).split(";"):
+        if statement.strip():
+            cur.execute(statement)
+    cur.execute("INSERT OR IGNORE INTO partitions (day) VALUES (?)", (day,))
+
+
+@lru_cache(maxsize=1024)
+def insert_sql(base: str, day: str) -> str:
+    if base == "log_entries":
+        return f"""
+        INSERT INTO {table(base, day)}
+            (id, timestamp, ts_us, source_id, level_id, message, raw_line, format_id, created_at, template_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+    if base == "search":
+        return f"INSERT INTO {search_table(day)} (rowid, message) VALUES (?, ?)"
+    if base == "metrics":
+        return (
+            f"INSERT INTO {table(base, day)} (log_entry_id, metric_name, metric_value, timestamp, ts_us)"
+            " VALUES (?, ?, ?, ?, ?)"
+        )
+    return f"INSERT INTO {table(base, day)} (log_entry_id, name_id, value_id, timestamp, ts_us) VALUES (?, ?, ?, ?, ?)"
+
+
+def reserve_ids(cur: sqlite3.Cursor, count: int) -> int:
+    """Reserve ``count`` consecutive log entry ids; returns the first."""
+    row = cur.execute("SELECT value FROM id_sequence WHERE name = 'log_entries'").fetchone()
+    cur.execute("UPDATE id_sequence SET value = value + ? WHERE name = 'log_entries'", (count,))
+    return row[0] + 1
+
+
+def has_legacy_rows(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM log_entries LIMIT 1").fetchone() is not None
+
+
+def shift_day(day: str, days: int) -> str:
+    if not DAY_RE.match(day):
+        return day
+    try:
+        return (date.fromisoformat(day) + timedelta(days=days)).isoformat()
+    except ValueError:
+        return day
+
+
+def overlapping(conn: sqlite3.Connection, from_: Optional[str] = None, to: Optional[str] = None) -> List[Optional[str]]:
+    """Partitions that may hold rows with timestamps in [from_, to], oldest first.
+
+    The legacy partition, when it still has rows, comes first and is always
+    included because it is not split by day. Rows moved by migrate_legacy()
+    are filed under the date written in their timestamp, which can be a day
+    off the UTC date, so one more day is taken on each side.
+    """
+    filters = ["1=1"]
+    params: List[str] = []
+    if from_:
+        filters.append("day >= ?")
+        params.append(shift_day(from_[:10], -1))
+    if to:
+        filters.append("day <= ?")
+        params.append(shift_day(to[:10], 1))
+    days: List[Optional[str]] = [
+        r[0] for r in conn.execute(f"SELECT day FROM partitions WHERE {' AND '.join(filters)} ORDER BY day", params)
+    ]
+    if has_legacy_rows(conn):
+        days.insert(0, None)
+    return days
+
+
+def any_rows(conn: sqlite3.Connection, base: str) -> bool:
+    for day in overlapping(conn):
+        if conn.execute(f"SELECT 1 FROM {table(base, day)} LIMIT 1").fetchone() is not None:
+            return True
+    return False
+
+
+def ensure_search(conn: sqlite3.Connection) -> List[Optional[str]]:
+    """Build the full-text index of partitions created before it existed."""
+    built: List[Optional[str]] = []
+    for day in overlapping(conn):
+        name = search_table(day)
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+        if exists is None:
+            conn.execute(search_sql(day))
+            conn.execute(f"INSERT INTO {name} ({name}) VALUES ('rebuild')")
+            conn.commit()
+            built.append(day)
+    return built
+
+
+# Columns added to partition tables after partitions were first released.
+ADDED_COLUMNS = {
+    "log_entries": (("template_id", "INTEGER"), ("ts_us", "INTEGER")),
+    "metrics": (("ts_us", "INTEGER"),),
+    "categories": (("ts_us", "INTEGER"),),
+}
+# Indexes replaced by the ts_us ones.
+DROPPED_INDEXES = ("idx_{le}_source_ts", "idx_{le}_ts", "idx_{m}_name_ts")
+
+
+def _all_days(conn: sqlite3.Connection) -> List[Optional[str]]:
+    """Every partition, the legacy one included even when it is empty."""
+    return [None] + [r[0] for r in conn.execute("SELECT day FROM partitions ORDER BY day")]
+
+
+def ensure_columns(conn: sqlite3.Connection) -> None:
+    """Add columns introduced after some partitions were created."""
+    for day in _all_days(conn):
+        for base, added in ADDED_COLUMNS.items():
+            name = table(base, day)
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({name})")}
+            for column, decl in added:
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE {name} ADD COLUMN {column} {decl}")
+    conn.commit()
+
+
+def fill_ts_us(conn: sqlite3.Connection) -> int:
+    """Compute ts_us for rows stored before the column existed, one table per commit.
+
+    Returns the number of rows filled.
+    """
+    conn.create_function("utc_micros", 1, utc_micros, deterministic=True)
+    filled = 0
+    for day in _all_days(conn):
+        for base in BASES:
+            cur = conn.execute(
+                f"UPDATE {table(base, day)} SET ts_us = COALESCE(utc_micros(timestamp), 0) WHERE ts_us IS NULL"
+            )
+            filled += cur.rowcount
+            conn.commit()
+    return filled
+
+
+def ensure_indexes(conn: sqlite3.Connection) -> None:
+    """Create the indexes of every partition; new ones get added to old partitions."""
+    for day in _all_days(conn):
+        le, m = table("log_entries", day), table("metrics", day)
+        for index in DROPPED_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {index.format(le=le, m=m)}")
+        conn.executescript(index_sql(day))
+
+
+def _rewrite(conn: sqlite3.Connection, name: str, strings: str, create_sql: str, columns: str, select_sql: str) -> None:
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute(f"INSERT OR IGNORE INTO strings (value) {strings}")
+        cur.execute(create_sql)
+        cur.execute(f"INSERT INTO {name}_encoded ({columns}) {select_sql}")
+        cur.execute(f"DROP TABLE {name}")
+        cur.execute(f"ALTER TABLE {name}_encoded RENAME TO {name}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def encode_strings(conn: sqlite3.Connection) -> List[Optional[str]]:
+    """Rewrite partitions that still store source/level/format and category
+    names and values as inline text, one table per commit.
+
+    Returns the partitions converted. Indexes are recreated by
+    ensure_indexes() afterwards.
+    """
+    converted: List[Optional[str]] = []
+    for day in _all_days(conn):
+        le, c = table("log_entries", day), table("categories", day)
+        le_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({le})")}
+        c_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({c})")}
+        if "source" in le_columns:
+            _rewrite(
+                conn,
+                le,
+                f"SELECT source FROM {le} UNION SELECT level FROM {le} UNION SELECT format_detected FROM {le}",
+                entries_sql(le + "_encoded"),
+                "id, timestamp, ts_us, source_id, level_id, message, raw_line, format_id, created_at, template_id",
+                f"""
+                SELECT e.id, e.timestamp, e.ts_us, s.id, l.id, e.message, e.raw_line, f.id, e.created_at, e.template_id
+                FROM {le} e
+                JOIN strings s ON s.value = e.source
+                JOIN strings l ON l.value = e.level
+                JOIN strings f ON f.value = e.format_detected
+                """,
+            )
+        if "category_name" in c_columns:
+            _rewrite(
+                conn,
+                c,
+                f"SELECT category_name FROM {c} UNION SELECT category_value FROM {c}",
+                categories_sql(c + "_encoded"),
+                "id, log_entry_id, name_id, value_id, timestamp, ts_us",
+                f"""
+                SELECT x.id, x.log_entry_id, n.id, v.id, x.timestamp, x.ts_us
+                FROM {c} x
+                JOIN strings n ON n.value = x.category_name
+                JOIN strings v ON v.value = x.category_value
+                """,
+            )
+        if "source" in le_columns or "category_name" in c_columns:
+            converted.append(day)
+    return converted
+
+
+def expired(conn: sqlite3.Connection, keep_days: int, today: Optional[date] = None) -> List[str]:
+    """Days older than the newest ``keep_days`` days (today included)."""
+    if keep_days <= 0:
+        return []
+    today = today or datetime.utcnow().date()
+    cutoff = (today - timedelta(days=keep_days - 1)).isoformat()
+    return [r[0] for r in conn.execute("SELECT day FROM partitions WHERE day < ? ORDER BY day", (cutoff,))]
+
+
+def drop(cur: sqlite3.Cursor, day: str) -> None:
+    """Drop every table of a day partition inside the caller's transaction."""
+    cur.execute(f"DROP TABLE IF EXISTS {search_table(day)}")
+    for base in BASES:
+        cur.execute(f"DROP TABLE IF EXISTS {table(base, day)}")
+    cur.execute("DELETE FROM partitions WHERE day = ?", (day,))
+
+
+def migrate_legacy(conn: sqlite3.Connection) -> int:
+    """Move rows from the legacy tables into day partitions, one day per commit.
+
+    Rows whose timestamp does not start with a date stay where they are.
+    Returns the number of entries moved.
+    """
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_log_entries_migrate ON log_entries(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_entry_migrate ON metrics(log_entry_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_categories_entry_migrate ON categories(log_entry_id)")
+    conn.commit()
+    moved = 0
+    legacy_search = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (search_table(None),)).fetchone()
+    days = [r[0] for r in conn.execute("SELECT DISTINCT substr(timestamp, 1, 10) FROM log_entries")]
+    for day in days:
+        if not DAY_RE.match(day or ""):
+            continue
+        # Everything sharing the 10-character date prefix.
+        lo, hi = day, day + "\uffff"
+        in_day = "SELECT id FROM log_entries WHERE timestamp >= ? AND timestamp < ?"
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            ensure(cur, day)
+            cur.execute(
+                f"""
+                INSERT INTO {table('log_entries', day)}
+                    (id, timestamp, ts_us, source_id, level_id, message, raw_line, format_id, created_at, template_id)
+                SELECT id, timestamp, ts_us, source_id, level_id, message, raw_line, format_id, created_at, template_id
+                FROM log_entries WHERE timestamp >= ? AND timestamp < ?
+                """,
+                (lo, hi),
+            )
+            moved += cur.rowcount
+            cur.execute(
+                f"""
+                INSERT INTO {search_table(day)} (rowid, message)
+                SELECT id, message FROM log_entries WHERE timestamp >= ? AND timestamp < ?
+                """,
+                (lo, hi),
+            )
+            if legacy_search:
+                cur.execute(
+                    f"""
+                    INSERT INTO {search_table(None)} ({search_table(None)}, rowid, message)
+                    SELECT 'delete', id, message FROM log_entries WHERE timestamp >= ? AND timestamp < ?
+                    """,
+                    (lo, hi),
+                )
+            cur.execute(
+                f"""
+                INSERT INTO {table('metrics', day)} (log_entry_id, metric_name, metric_value, timestamp, ts_us)
+                SELECT log_entry_id, metric_name, metric_value, timestamp, ts_us FROM metrics
+                WHERE log_entry_id IN ({in_day})
+                """,
+                (lo, hi),
+            )
+            cur.execute(
+                f"""
+                INSERT INTO {table('categories', day)} (log_entry_id, name_id, value_id, timestamp, ts_us)
+                SELECT log_entry_id, name_id, value_id, timestamp, ts_us FROM categories
+                WHERE log_entry_id IN ({in_day})
+                """,
+                (lo, hi),
+            )
+            cur.execute(f"DELETE FROM metrics WHERE log_entry_id IN ({in_day})", (lo, hi))
+            cur.execute(f"DELETE FROM categories WHERE log_entry_id IN ({in_day})", (lo, hi))
+            cur.execute("DELETE FROM log_entries WHERE timestamp >= ? AND timestamp < ?", (lo, hi))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    conn.execute("DROP INDEX IF EXISTS idx_log_entries_migrate")
+    conn.execute("DROP INDEX IF EXISTS idx_metrics_entry_migrate")
+    conn.execute("DROP INDEX IF EXISTS idx_categories_entry_migrate")
+    conn.commit()
+    return moved
@@ -0,0 +1,258 @@
+import math
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import partitions
+
+# name -> bucket width in seconds, finest first
+RESOLUTIONS: Dict[str, int] = {"1s": 1, "1m": 60, "1h": 3600}
+
+# Bucket keys are naive UTC ISO strings cut from the second of the row's
+# ts_us, so they compare like query bounds without an offset.
+_BUCKET_SLICES = {"1s": (19, ""), "1m": (16, ":00"), "1h": (13, ":00:00")}
+
+MAX_POINTS_DEFAULT = 500
+
+
+def table_name(resolution: str) -> str:
+    return f"metric_rollup_{resolution}"
+
+
+def schema_sql() -> str:
+    parts = []
+    for res in RESOLUTIONS:
+        table = table_name(res)
+        parts.append(
+            f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    metric_name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    value_count INTEGER NOT NULL,
+    value_sum REAL NOT NULL,
+    value_min REAL NOT NULL,
+    value_max REAL NOT NULL,
+    PRIMARY KEY (metric_name, source, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_{table}_source_bucket ON {table}(source, bucket);
+CREATE INDEX IF NOT EXISTS idx_{table}_name_bucket ON {table}(metric_name, bucket);
+"""
+        )
+    return "".join(parts)
+
+
+def bucket_key(ts: str, resolution: str) -> str:
+    size, suffix = _BUCKET_SLICES[resolution]
+    return ts[:size] + suffix
+
+
+def _upsert_sql(resolution: str) -> str:
+    return f"""
+    INSERT INTO {table_name(resolution)} (metric_name, source, bucket, value_count, value_sum, value_min, value_max)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(metric_name, source, bucket) DO UPDATE SET
+        value_count = value_count + excluded.value_count,
+        value_sum = value_sum + excluded.value_sum,
+        value_min = MIN(value_min, excluded.value_min),
+        value_max = MAX(value_max, excluded.value_max)
+    """
+
+
+def apply(cur: sqlite3.Cursor, rows: Iterable[Tuple[str, str, str, float]]) -> None:
+    """Fold (metric_name, source, UTC ISO timestamp, value) rows into every rollup.
+
+    Runs on the ingest cursor so the rollups commit with the raw rows.
+    """
+    aggs: Dict[str, Dict[Tuple[str, str, str], List[float]]] = {res: {} for res in RESOLUTIONS}
+    for name, source, ts, value in rows:
+        for res, agg in aggs.items():
+            key = (name, source, bucket_key(ts, res))
+            cell = agg.get(key)
+            if cell is None:
+                agg[key] = [1, value, value, value]
+            else:
+                cell[0] += 1
+                cell[1] += value
+                if value < cell[2]:
+                    cell[2] = value
+                if value > cell[3]:
+                    cell[3] = value
+    for res, agg in aggs.items():
+        cur.executemany(_upsert_sql(res), (key + tuple(cell) for key, cell in agg.items()))
+
+
+def rebuild(conn: sqlite3.Connection) -> None:
+    """Recompute every rollup from the raw metrics partitions."""
+    days = partitions.overlapping(conn)
+    for res in RESOLUTIONS:
+        size, suffix = _BUCKET_SLICES[res]
+        table = table_name(res)
+        conn.execute(f"DELETE FROM {table}")
+        for day in days:
+            # Legacy rows and rows written with an offset can share buckets
+            # with another partition.
+            conn.execute(
+                f"""
+                INSERT INTO {table} (metric_name, source, bucket, value_count, value_sum, value_min, value_max)
+                SELECT m.metric_name, s.value,
+                       substr(strftime('%Y-%m-%dT%H:%M:%S', m.ts_us / 1000000, 'unixepoch'), 1, {size}) || '{suffix}',
+                       COUNT(*), SUM(m.metric_value), MIN(m.metric_value), MAX(m.metric_value)
+                FROM {partitions.table('metrics', day)} m
+                JOIN {partitions.table('log_entries', day)} le ON le.id = m.log_entry_id
+                JOIN strings s ON s.id = le.source_id
+                WHERE true
+                GROUP BY 1, 2, 3
+                ON CONFLICT(metric_name, source, bucket) DO UPDATE SET
+                    value_count = value_count + excluded.value_count,
+                    value_sum = value_sum + excluded.value_sum,
+                    value_min = MIN(value_min, excluded.value_min),
+                    value_max = MAX(value_max, excluded.value_max)
+                """
+            )
+    conn.commit()
+
+
+def needs_backfill(conn: sqlite3.Connection) -> bool:
+    has_rollups = conn.execute(f"SELECT 1 FROM {table_name('1h')} LIMIT 1").fetchone() is not None
+    return not has_rollups and partitions.any_rows(conn, "metrics")
+
+
+def expire(conn: sqlite3.Connection, before: str) -> int:
+    """Delete rollup buckets older than ``before``; returns rows removed."""
+    removed = 0
+    for res in RESOLUTIONS:
+        removed += conn.execute(f"DELETE FROM {table_name(res)} WHERE bucket < ?", (before,)).rowcount
+    conn.commit()
+    return removed
+
+
+def _epoch(value: str) -> Optional[float]:
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        return dt.timestamp()
+    return (dt - datetime(1970, 1, 1)).total_seconds()
+
+
+def _auto_step(
+    conn: sqlite3.Connection, source: Optional[str], from_: Optional[str], to: Optional[str], max_points: int
+) -> int:
+    lo = _epoch(from_) if from_ else None
+    hi = _epoch(to) if to else None
+    if lo is None or hi is None:
+        filters, params = _filters(source, None, None)
+        row = conn.execute(
+            f"SELECT MIN(bucket), MAX(bucket) FROM {table_name('1h')} WHERE {filters}", params
+        ).fetchone()
+        if lo is None and row and row[0]:
+            lo = _epoch(row[0])
+        if hi is None and row and row[1]:
+            hi = _epoch(row[1]) + RESOLUTIONS["1h"]
+    if lo is None or hi is None or hi <= lo:
+        return 1
+    return max(1, math.ceil((hi - lo) / max(max_points, 1)))
+
+
+def choose(
+    conn: sqlite3.Connection,
+    source: Optional[str],
+    from_: Optional[str],
+    to: Optional[str],
+    resolution: str,
+    step: Optional[int],
+    max_points: int,
+) -> Tuple[str, int]:
+    """Pick the rollup table and output step (seconds) for a query.
+
+    Without an explicit step, the step is the range divided by max_points;
+    the range is from/to or, when open-ended, the extent of the stored data.
+    Unless a resolution is forced, the coarsest rollup not wider than the
+    step is used.
+    """
+    if not step:
+        step = _auto_step(conn, source, from_, to, max_points)
+    if resolution in RESOLUTIONS:
+        chosen = resolution
+    else:
+        chosen = "1s"
+        for res, seconds in RESOLUTIONS.items():
+            if seconds <= step:
+                chosen = res
+    return chosen, max(step, RESOLUTIONS[chosen])
+
+
+def _filters(source: Optional[str], from_: Optional[str], to: Optional[str]) -> Tuple[str, List[Any]]:
+    filters = ["1=1"]
+    params: List[Any] = []
+    if source:
+        filters.append("source = ?")
+        params.append(source)
+    if from_:
+        filters.append("bucket >= ?")
+        params.append(from_)
+    if to:
+        filters.append("bucket <= ?")
+        params.append(to)
+    return " AND ".join(filters), params
+
+
+def query(
+    conn: sqlite3.Connection,
+    resolution: str,
+    step: int,
+    source: Optional[str],
+    from_: Optional[str],
+    to: Optional[str],
+    max_points: int,
+    extra: Optional[Dict[Tuple[str, int], List[float]]] = None,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Series bucketed by ``step`` seconds.
+
+    ``extra`` maps (metric_name, bucket epoch second) to [count, sum, min,
+    max] cells aggregated elsewhere (the metrics archive) to fold in.
+    """
+    # Floor `from` to the bucket holding it so the first bucket is not dropped.
+    filters, params = _filters(source, bucket_key(from_, resolution) if from_ else None, to)
+    sql = f"""
+    SELECT metric_name, (CAST(strftime('%s', bucket) AS INTEGER) / ?) * ? AS b,
+           SUM(value_count), SUM(value_sum), MIN(value_min), MAX(value_max)
+    FROM {table_name(resolution)}
+    WHERE {filters}
+    GROUP BY metric_name, b
+    ORDER BY b ASC
+    """
+    rows = conn.execute(sql, [step, step] + params).fetchall()
+    if extra:
+        cells = {(name, b): [count, total, vmin, vmax] for name, b, count, total, vmin, vmax in rows}
+        for key, (count, total, vmin, vmax) in extra.items():
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = [count, total, vmin, vmax]
+            else:
+                cell[0] += count
+                cell[1] += total
+                cell[2] = min(cell[2], vmin)
+                cell[3] = max(cell[3], vmax)
+        rows = sorted((key + tuple(cell) for key, cell in cells.items()), key=lambda r: r[1])
+
+    series: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for name, b, count, total, vmin, vmax in rows:
+        series[name].append(
+            {
+                "t": datetime.utcfromtimestamp(b).isoformat(),
+                "v": total / count if count else 0.0,
+                "count": count,
+                "min": vmin,
+                "max": vmax,
+            }
+        )
+    # An explicit fine step over a long range can still overshoot; keep the
+    # most recent points.
+    for name, points in series.items():
+        if len(points) > max_points:
+            series[name] = points[-max_points:]
+    return series
@@ -0,0 +1,64 @@
+import re
+import sqlite3
+from typing import Any, List, Optional
+
+import partitions
+
+# "quoted phrases", bare terms, and terms ending in * for prefix search
+TERM_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+SNIPPET_TOKENS = 12
+MAX_OFFSET = 10000
+
+
+def match_expression(text: str) -> Optional[str]:
+    """Turn free text into an FTS5 query that ANDs its terms.
+
+    Every term is quoted, so FTS5 operators and punctuation in user input
+    are matched literally instead of raising a syntax error.
+    """
+    parts: List[str] = []
+    for phrase, word in TERM_RE.findall(text or ""):
+        term = phrase if phrase else word
+        prefix = not phrase and term.endswith("*")
+        term = term.rstrip("*") if prefix else term
+        if not term.strip():
+            continue
+        quoted = '"' + term.replace('"', '""') + '"'
+        parts.append(quoted + "*" if prefix else quoted)
+    return " ".join(parts) or None
+
+
+def search(
+    conn: sqlite3.Connection,
+    match: str,
+    filters: List[str],
+    params: List[Any],
+    limit: int,
+    offset: int,
+    from_: Optional[str] = None,
+    to: Optional[str] = None,
+) -> List[tuple]:
+    """Best-ranked entries matching ``match`` across the overlapping partitions.
+
+    Rows are (id, timestamp, source_id, level_id, message, raw_line,
+    format_id, created_at, template_id, snippet, rank), ordered by bm25
+    rank.
+    ``filters`` are SQL conditions on the entries columns.
+    """
+    want = offset + limit
+    rows: List[tuple] = []
+    for day in partitions.overlapping(conn, from_, to):
+        fts = partitions.search_table(day)
+        sql = f"""
+        SELECT le.id, le.timestamp, le.source_id, le.level_id, le.message, le.raw_line, le.format_id, le.created_at,
+               le.template_id, snippet({fts}, 0, '<mark>', '</mark>', '…', {SNIPPET_TOKENS}), bm25({fts}) AS score
+        FROM {fts}
+        JOIN {partitions.table('log_entries', day)} le ON le.id = {fts}.rowid
+        WHERE {fts} MATCH ? AND {' AND '.join(filters)}
+        ORDER BY score
+        LIMIT ?
+        """
+        rows.extend(conn.execute(sql, [match] + params + [want]))
+    rows.sort(key=lambda r: r[10])
+    return rows[offset:want]
@@ -0,0 +1,193 @@
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
+
+import partitions
+
+# Width of the entries_per_min window, in one-second ring slots.
+RATE_WINDOW_SECONDS = 60
+
+STATS_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS stats_counters (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (scope, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS stats_rate (
+    second INTEGER PRIMARY KEY,
+    entries INTEGER NOT NULL
+);
+"""
+
+UPSERT_COUNTER_SQL = """
+INSERT INTO stats_counters (scope, key, value) VALUES (?, ?, ?)
+ON CONFLICT(scope, key) DO UPDATE SET value = value + excluded.value
+"""
+UPSERT_RATE_SQL = """
+INSERT INTO stats_rate (second, entries) VALUES (?, ?)
+ON CONFLICT(second) DO UPDATE SET entries = entries + excluded.entries
+"""
+
+
+class StatsDelta:
+    """Counter changes for one ingest batch, applied to memory after commit."""
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.levels: Counter = Counter()
+        self.sources: Counter = Counter()
+        self.seconds: Counter = Counter()
+
+
+class RateRing:
+    """Entries per timestamp second over the last RATE_WINDOW_SECONDS."""
+
+    def __init__(self, window: int = RATE_WINDOW_SECONDS) -> None:
+        self.window = window
+        self._slots: List[List[int]] = [[-1, 0] for _ in range(window)]
+
+    def add(self, second: int, count: int) -> None:
+        slot = self._slots[second % self.window]
+        if slot[0] == second:
+            slot[1] += count
+        elif slot[0] < second:
+            slot[0], slot[1] = second, count
+
+    def total(self, now_second: int) -> int:
+        lo = now_second - self.window
+        return sum(count for second, count in self._slots if second >= lo)
+
+
+class Stats:
+    """In-memory mirror of the stats_counters / stats_rate tables.
+
+    Ingest batches build a StatsDelta with collect(), write it in their
+    transaction with persist(), and merge() it here once committed, so
+    /api/stats never scans log_entries.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.total = 0
+        self.levels: Counter = Counter()
+        self.sources: Counter = Counter()
+        self.rate = RateRing()
+
+    @staticmethod
+    def collect(levels: Iterable[str], sources: Iterable[str], times_us: Iterable[int]) -> StatsDelta:
+        delta = StatsDelta()
+        now = int(time.time())
+        floor = now - RATE_WINDOW_SECONDS
+        for level, source, ts_us in zip(levels, sources, times_us):
+            delta.total += 1
+            delta.levels[level] += 1
+            delta.sources[source] += 1
+            second = ts_us // 1_000_000
+            if second >= floor:
+                # Future timestamps count against the current second.
+                delta.seconds[min(second, now)] += 1
+        return delta
+
+    @staticmethod
+    def persist(cur: sqlite3.Cursor, delta: StatsDelta) -> None:
+        rows: List[Tuple[str, str, int]] = [("total", "", delta.total)]
+        rows.extend(("level", k, v) for k, v in delta.levels.items())
+        rows.extend(("source", k, v) for k, v in delta.sources.items())
+        cur.executemany(UPSERT_COUNTER_SQL, rows)
+        if delta.seconds:
+            cur.executemany(UPSERT_RATE_SQL, delta.seconds.items())
+        cur.execute("DELETE FROM stats_rate WHERE second < ?", (int(time.time()) - RATE_WINDOW_SECONDS,))
+        if delta.total < 0:
+            cur.execute("DELETE FROM stats_counters WHERE scope != 'total' AND value <= 0")
+
+    def merge(self, delta: StatsDelta) -> None:
+        with self._lock:
+            self.total += delta.total
+            self.levels.update(delta.levels)
+            self.sources.update(delta.sources)
+            for second, count in delta.seconds.items():
+                self.rate.add(second, count)
+            if delta.total < 0:
+                # Unary plus drops keys whose count reached zero.
+                self.levels = +self.levels
+                self.sources = +self.sources
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute("SELECT scope, key, value FROM stats_counters").fetchall()
+        rate = conn.execute(
+            "SELECT second, entries FROM stats_rate WHERE second >= ?",
+            (int(time.time()) - RATE_WINDOW_SECONDS,),
+        ).fetchall()
+        with self._lock:
+            self.total = 0
+            self.levels = Counter()
+            self.sources = Counter()
+            self.rate = RateRing()
+            for scope, key, value in rows:
+                if scope == "total":
+                    self.total = value
+                elif scope == "level":
+                    self.levels[key] = value
+                elif scope == "source":
+                    self.sources[key] = value
+            for second, count in rate:
+                self.rate.add(second, count)
+
+    def snapshot(self, top: int = 10) -> Dict[str, Any]:
+        with self._lock:
+            total = self.total
+            return {
+                "total_entries": total,
+                "entries_per_min": self.rate.total(int(time.time())),
+                "error_rate": (self.levels.get("ERROR", 0) / total) if total else 0.0,
+                "top_sources": [{"source": s, "count": c} for s, c in self.sources.most_common(top)],
+            }
+
+
+def table_delta(conn: sqlite3.Connection, table: str, sign: int = 1) -> StatsDelta:
+    """Level and source counts of one entries table, multiplied by ``sign``."""
+    delta = StatsDelta()
+    rows = conn.execute(
+        f"""
+        SELECT l.value, s.value, x.n
+        FROM (SELECT level_id, source_id, COUNT(*) AS n FROM {table} GROUP BY level_id, source_id) x
+        JOIN strings l ON l.id = x.level_id
+        JOIN strings s ON s.id = x.source_id
+        """
+    )
+    for level, source, count in rows:
+        delta.total += sign * count
+        delta.levels[level] += sign * count
+        delta.sources[source] += sign * count
+    return delta
+
+
+def needs_rebuild(conn: sqlite3.Connection) -> bool:
+    has_counters = conn.execute("SELECT 1 FROM stats_counters LIMIT 1").fetchone() is not None
+    return not has_counters and partitions.any_rows(conn, "log_entries")
+
+
+def rebuild(conn: sqlite3.Connection) -> None:
+    """Recompute the persisted counters from every log_entries partition."""
+    minute_ago = (datetime.utcnow() - timedelta(seconds=RATE_WINDOW_SECONDS)).isoformat()
+    minute_ago_us = (int(time.time()) - RATE_WINDOW_SECONDS) * 1_000_000
+    total = StatsDelta()
+    timestamps: List[int] = []
+    for day in partitions.overlapping(conn):
+        table = partitions.table("log_entries", day)
+        part = table_delta(conn, table)
+        total.total += part.total
+        total.levels.update(part.levels)
+        total.sources.update(part.sources)
+        if day is None or day >= partitions.shift_day(minute_ago[:10], -1):
+            timestamps.extend(r[0] for r in conn.execute(f"SELECT ts_us FROM {table} WHERE ts_us >= ?", (minute_ago_us,)))
+    total.seconds = Stats.collect(("",) * len(timestamps), ("",) * len(timestamps), timestamps).seconds
+    conn.execute("DELETE FROM stats_counters")
+    conn.execute("DELETE FROM stats_rate")
+    Stats.persist(conn.cursor(), total)
+    conn.commit()
@@ -0,0 +1,317 @@
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import partitions
+
+# Online log template mining after Drain (He et al., ICWS 2017): messages are
+# routed through a fixed-depth tree keyed by token count and their first
+# tokens, then matched against the few clusters in the reached leaf. Tokens
+# that differ between a cluster and a matching message become wildcards.
+WILDCARD = "<*>"
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS log_templates (
+    id INTEGER PRIMARY KEY,
+    template TEXT NOT NULL,
+    wildcards INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL
+);
+"""
+
+UPSERT_SQL = """
+INSERT INTO log_templates (id, template, wildcards, count, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    template = CASE WHEN excluded.wildcards >= wildcards THEN excluded.template ELSE template END,
+    wildcards = MAX(wildcards, excluded.wildcards),
+    count = count + excluded.count,
+    last_seen = MAX(last_seen, excluded.last_seen)
+"""
+
+# key=value and key:value tokens keep their key when the value varies.
+KV_TOKEN_RE = re.compile(r"([A-Za-z_][\w.\-]*)([=:])(.+)")
+WORD_RE = re.compile(r"[A-Za-z_][\w\-]*")
+NUMBER_RE = re.compile(r"([-+]?\d*\.?\d+)([A-Za-z%]{0,3})")
+HAS_DIGIT_RE = re.compile(r"\d")
+# Tokens with digits and no real word in them (numbers, ids, IPs, times,
+# 12ms) are masked before matching, as Drain's preprocessing step does.
+WORDISH_RE = re.compile(r"[A-Za-z]{3}")
+
+MAX_TOKENS = 64
+
+
+class Cluster:
+    __slots__ = ("id", "tokens", "wildcards")
+
+    def __init__(self, cluster_id: int, tokens: List[str]) -> None:
+        self.id = cluster_id
+        self.tokens = tokens
+        self.wildcards = sum(1 for t in tokens if _is_variable(t))
+
+    @property
+    def template(self) -> str:
+        return " ".join(self.tokens)
+
+
+def _is_variable(token: str) -> bool:
+    return token.endswith(WILDCARD)
+
+
+def _tokens(message: str) -> List[str]:
+    tokens = message.split()
+    if len(tokens) > MAX_TOKENS:
+        tokens[MAX_TOKENS - 1:] = [" ".join(tokens[MAX_TOKENS - 1:])]
+    return tokens
+
+
+def _is_path(token: str) -> bool:
+    # Paths and URLs: every distinct one would otherwise get its own branch.
+    return "/" in token
+
+
+def _mask(token: str) -> str:
+    path = _is_path(token)
+    if not path and not HAS_DIGIT_RE.search(token):
+        return token
+    kv = KV_TOKEN_RE.match(token)
+    # "scheme://..." is a URL, not a key.
+    if kv and not HAS_DIGIT_RE.search(kv.group(1)) and not kv.group(3).startswith("//"):
+        return kv.group(1) + kv.group(2) + _mask(kv.group(3))
+    return token if not path and WORDISH_RE.search(token) else WILDCARD
+
+
+def _generalize(a: str, b: str) -> str:
+    if a == b:
+        return a
+    ma, mb = KV_TOKEN_RE.match(a), KV_TOKEN_RE.match(b)
+    if ma and mb and ma.group(1, 2) == mb.group(1, 2):
+        return ma.group(1) + ma.group(2) + WILDCARD
+    return WILDCARD
+
+
+def _matches(template_token: str, token: str) -> bool:
+    if template_token == WILDCARD:
+        return True
+    if template_token.endswith(WILDCARD):
+        return token.startswith(template_token[: -len(WILDCARD)])
+    return False
+
+
+def params_of(tokens: List[str], template: List[str]) -> Dict[str, str]:
+    """Named values of the wildcard positions of ``template`` in ``tokens``.
+
+    A wildcard is named after its key (``key=<*>``, or a ``key:`` token just
+    before it), else after the word before it, else by position.
+    """
+    params: Dict[str, str] = {}
+    for i, (tt, token) in enumerate(zip(template, tokens)):
+        if not _is_variable(tt):
+            continue
+        if tt != WILDCARD:
+            name, value = tt[: -len(WILDCARD) - 1], token[len(tt) - len(WILDCARD):]
+        else:
+            prev = template[i - 1] if i else ""
+            word = WORD_RE.fullmatch(prev.rstrip(":="))
+            name, value = (word.group(0) if word and not _is_variable(prev) else f"param{i + 1}"), token
+        base, n = name, 2
+        while name in params:
+            name, n = f"{base}_{n}", n + 1
+        params[name] = value
+    return params
+
+
+def named_numbers(message: str) -> Dict[str, float]:
+    """Numbers the line itself names, as ``key=value`` or ``key: value``.
+
+    Other numbers (PIDs, ports, request ids) stay template parameters
+    instead of becoming metric series.
+    """
+    out: Dict[str, float] = {}
+    tokens = message.split()
+    for i, token in enumerate(tokens):
+        kv = KV_TOKEN_RE.match(token)
+        if kv:
+            name, value = kv.group(1), kv.group(3)
+        elif token[-1:] in (":", "=") and i + 1 < len(tokens) and WORD_RE.fullmatch(token[:-1]):
+            name, value = token[:-1], tokens[i + 1]
+        else:
+            continue
+        m = NUMBER_RE.fullmatch(value.rstrip(",;"))
+        if m:
+            out[name] = float(m.group(1))
+    return out
+
+
+class TemplateMiner:
+    """Assigns each message a template id and extracts its parameters.
+
+    Thread-safe. Clusters live in memory; the caller persists the template
+    rows returned by mine() in log_templates, and load() rebuilds the tree
+    from them after a restart so ids stay stable. Parameters are not stored:
+    params() recovers them from a message and its template id.
+    """
+
+    def __init__(
+        self,
+        depth: int = 4,
+        similarity: float = 0.4,
+        max_children: int = 100,
+        max_clusters: int = 50000,
+    ) -> None:
+        self.prefix_len = max(depth - 2, 1)
+        self.similarity = similarity
+        self.max_children = max_children
+        self.max_clusters = max_clusters
+        self._lock = threading.Lock()
+        self._root: Dict[int, dict] = {}
+        self._clusters: Dict[int, Cluster] = {}
+        self._next_id = 1
+        # Bumped whenever an existing template's text changes.
+        self.revision = 0
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._root = {}
+            self._clusters = {}
+            for cluster_id, template in conn.execute("SELECT id, template FROM log_templates ORDER BY id"):
+                cluster = Cluster(cluster_id, template.split(" ", MAX_TOKENS - 1))
+                self._clusters[cluster_id] = cluster
+                self._leaf(cluster.tokens, create=True).append(cluster)
+            self._next_id = max(self._clusters, default=0) + 1
+
+    def __len__(self) -> int:
+        return len(self._clusters)
+
+    def template(self, template_id: int) -> Optional[str]:
+        cluster = self._clusters.get(template_id)
+        return cluster.template if cluster is not None else None
+
+    def params(self, template_id: Optional[int], message: str) -> Dict[str, str]:
+        """Parameters of ``message`` under its template's current form."""
+        cluster = self._clusters.get(template_id) if template_id is not None else None
+        if cluster is None:
+            return {}
+        template = cluster.tokens
+        tokens = _tokens(message)
+        if len(tokens) != len(template):
+            return {}
+        return params_of(tokens, template)
+
+    def _leaf(self, tokens: List[str], create: bool) -> Optional[List[Cluster]]:
+        node = self._root.get(len(tokens))
+        if node is None:
+            if not create:
+                return None
+            node = self._root[len(tokens)] = {}
+        for token in tokens[: self.prefix_len]:
+            key = WILDCARD if HAS_DIGIT_RE.search(token) or _is_variable(token) or _is_path(token) else token
+            child = node.get(key)
+            if child is None:
+                child = node.get(WILDCARD)
+                if not create:
+                    if child is None:
+                        return None
+                elif len(node) < self.max_children or key == WILDCARD:
+                    child = node[key] = {}
+                elif child is None:
+                    child = node[WILDCARD] = {}
+            node = child
+        leaf = node.get(None)
+        if leaf is None and create:
+            leaf = node[None] = []
+        return leaf
+
+    def _best(self, leaf: List[Cluster], tokens: List[str]) -> Optional[Cluster]:
+        best, best_key = None, (-1.0, -1)
+        for cluster in leaf:
+            same = variable = 0
+            for tt, token in zip(cluster.tokens, tokens):
+                if tt == token:
+                    same += 1
+                elif _matches(tt, token):
+                    variable += 1
+            key = (same / len(tokens), variable)
+            if key > best_key:
+                best, best_key = cluster, key
+        if best is not None and best_key[0] >= self.similarity:
+            return best
+        return None
+
+    def _add(self, message_tokens: List[str]) -> Optional[Cluster]:
+        tokens = [_mask(t) for t in message_tokens]
+        leaf = self._leaf(tokens, create=len(self._clusters) < self.max_clusters)
+        if leaf is None:
+            return None
+        cluster = self._best(leaf, tokens)
+        if cluster is None:
+            if len(self._clusters) >= self.max_clusters:
+                return None
+            cluster = Cluster(self._next_id, tokens)
+            self._next_id += 1
+            self._clusters[cluster.id] = cluster
+            leaf.append(cluster)
+        else:
+            merged = [_generalize(tt, token) for tt, token in zip(cluster.tokens, tokens)]
+            if merged != cluster.tokens:
+                # A new list, so templates already handed out stay unchanged.
+                cluster.tokens = merged
+                cluster.wildcards = sum(1 for t in merged if _is_variable(t))
+                self.revision += 1
+        return cluster
+
+    def mine(self, messages: List[str]) -> Tuple[List[Optional[int]], List[tuple]]:
+        """Mine a batch of messages.
+
+        Returns the template id of every message (None once max_clusters is
+        reached and nothing matches) and, for every template the batch
+        touched, an (id, template, wildcards, count) row to persist.
+        """
+        ids: List[Optional[int]] = []
+        counts: Dict[int, int] = {}
+        with self._lock:
+            for message in messages:
+                tokens = _tokens(message)
+                cluster = self._add(tokens) if tokens else None
+                if cluster is None:
+                    ids.append(None)
+                    continue
+                counts[cluster.id] = counts.get(cluster.id, 0) + 1
+                ids.append(cluster.id)
+            rows = [(cid, self._clusters[cid].template, self._clusters[cid].wildcards, n) for cid, n in counts.items()]
+        return ids, rows
+
+
+def backfill(
+    conn: sqlite3.Connection, miner: TemplateMiner, formats: Sequence[str], batch_size: int = 10000
+) -> int:
+    """Assign templates to ``formats`` entries stored before mining existed, one commit per batch."""
+    done = 0
+    now = datetime.utcnow().isoformat()
+    marks = ",".join("?" * len(formats))
+    for day in partitions.overlapping(conn):
+        name = partitions.table("log_entries", day)
+        last = 0
+        while True:
+            rows = conn.execute(
+                f"""
+                SELECT id, message FROM {name}
+                WHERE id > ? AND template_id IS NULL
+                  AND format_id IN (SELECT id FROM strings WHERE value IN ({marks}))
+                ORDER BY id LIMIT ?
+                """,
+                (last, *formats, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            last = rows[-1][0]
+            ids, touched = miner.mine([r[1] for r in rows])
+            conn.executemany(f"UPDATE {name} SET template_id = ? WHERE id = ?", zip(ids, (r[0] for r in rows)))
+            conn.executemany(UPSERT_SQL, ((tid, text, w, n, now, now) for tid, text, w, n in touched))
+            conn.commit()
+            done += len(rows)
+    return done
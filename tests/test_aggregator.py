@@ -0,0 +1,34 @@
+from datetime import datetime
+
+import pytest
+
+import aggregator
+import alerts
+from timestamps import epoch_second
+
+NOW = 1_790_000_000
+
+
+def rule(aggregation: str, threshold: float) -> alerts.Rule:
+    return alerts.Rule(1, "latency", "gt", threshold, 60, None, None, aggregation, 0)
+
+
+def fed(aggregation: str, threshold: float) -> aggregator.StreamingAggregator:
+    agg = aggregator.StreamingAggregator()
+    agg._rules = [rule(aggregation, threshold)]
+    agg._windows = {"latency": aggregator.MetricWindow(60, False)}
+    # One point per second from 70 s ago up to now.
+    for age in range(70, -1, -1):
+        agg._windows["latency"].add(NOW - age, 1.0)
+    return agg
+
+
+@pytest.mark.parametrize("aggregation, expected", [("count", 60.0), ("sum", 60.0), ("rate", 1.0)])
+def test_window_covers_exactly_its_span(aggregation: str, expected: float) -> None:
+    fired = fed(aggregation, 0).evaluate(now=NOW + 0.5)
+    assert [value for _, value in fired] == [expected]
+
+
+def test_rollup_cutoff_matches_the_window() -> None:
+    now = datetime.utcfromtimestamp(NOW + 0.5)
+    assert epoch_second(alerts._since(now, 60)) == NOW - 59
@@ -0,0 +1,56 @@
+import sqlite3
+from typing import Dict, List, Tuple
+
+import cardinality
+
+
+def tracker_db(max_sources: int) -> Tuple[cardinality.CategoryTracker, sqlite3.Connection]:
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.executescript(cardinality.SCHEMA_SQL)
+    conn.execute("CREATE TABLE partitions (day TEXT PRIMARY KEY)")
+    conn.execute("CREATE TABLE log_entries (id INTEGER PRIMARY KEY)")
+    return cardinality.CategoryTracker(limit=2, top_k=4, max_sources=max_sources), conn
+
+
+def route(tracker: cardinality.CategoryTracker, conn: sqlite3.Connection, source: str, values: List[str]) -> None:
+    rows = [(i, "ip", value, "") for i, value in enumerate(values)]
+    tracker.route(conn.cursor(), rows, [source] * len(values))
+
+
+def stored_sources(conn: sqlite3.Connection) -> List[str]:
+    return sorted(r[0] for r in conn.execute("SELECT source FROM category_sketches WHERE name = 'ip'"))
+
+
+def totals(tracker: cardinality.CategoryTracker, source=None) -> Dict[str, int]:
+    return {name: s["total"] for name, s in tracker.snapshot(source, 10).items()}
+
+
+def test_sources_past_the_cap_are_merged_into_other() -> None:
+    tracker, conn = tracker_db(max_sources=2)
+    route(tracker, conn, "a", ["1", "2", "3"])
+    assert tracker.promoted() == {"ip"}
+    route(tracker, conn, "b", ["4"])
+    route(tracker, conn, "a", ["5"])
+    route(tracker, conn, "c", ["6", "7"])
+    # "b" was the least recently updated source.
+    assert stored_sources(conn) == sorted(["a", "c", cardinality.OTHER_SOURCE])
+    assert totals(tracker) == {"ip": 7}
+    assert totals(tracker, "b") == {}
+    assert totals(tracker, "c") == {"ip": 2}
+
+    for source in "defgh":
+        route(tracker, conn, source, ["8"])
+    assert len(stored_sources(conn)) == 3
+    assert totals(tracker) == {"ip": 12}
+
+
+def test_load_folds_sources_over_a_lowered_cap() -> None:
+    tracker, conn = tracker_db(max_sources=10)
+    route(tracker, conn, "a", ["1", "2", "3"])
+    for source in "bcde":
+        route(tracker, conn, source, ["4"])
+    smaller = cardinality.CategoryTracker(limit=2, top_k=4, max_sources=2)
+    smaller.load(conn)
+    assert totals(smaller) == {"ip": 7}
+    assert totals(smaller, "e") == {"ip": 1}
+    assert totals(smaller, "a") == {}
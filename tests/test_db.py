@@ -0,0 +1,36 @@
+import threading
+
+import pytest
+
+import db
+
+
+def test_read_fails_once_closed(tmp_path) -> None:
+    database = db.Database(tmp_path / "test.db", readers=1)
+    database.open()
+    database.close()
+    with pytest.raises(RuntimeError):
+        with database.read():
+            pass
+
+
+def test_waiting_read_fails_when_closed(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(db, "_READ_POLL_SECONDS", 0.05)
+    database = db.Database(tmp_path / "test.db", readers=1)
+    database.open()
+    errors = []
+
+    def waiter() -> None:
+        try:
+            with database.read():
+                pass
+        except RuntimeError as exc:
+            errors.append(exc)
+
+    with database.read():
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        database.close()
+        thread.join(5)
+    assert not thread.is_alive()
+    assert len(errors) == 1
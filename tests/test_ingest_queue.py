@@ -0,0 +1,108 @@
+from typing import Any, Dict, List
+
+import pytest
+
+import ingest_queue
+
+
+class Commits:
+    def __init__(self, fail_first: int = 0) -> None:
+        self.fail_first = fail_first
+        self.batches: List[List[Dict[str, Any]]] = []
+
+    def __call__(self, entries: List[Dict[str, Any]]) -> None:
+        if self.fail_first:
+            self.fail_first -= 1
+            raise RuntimeError("disk full")
+        self.batches.append(entries)
+
+    @property
+    def messages(self) -> List[str]:
+        return [e["message"] for batch in self.batches for e in batch]
+
+
+def run_queue(spool_dir, commits: Commits, *bodies: List[Dict[str, Any]]) -> List[Any]:
+    queue = ingest_queue.IngestQueue(commits, linger=0, spool_dir=spool_dir)
+    queue.start()
+    outcomes = []
+    try:
+        for entries in bodies:
+            future = queue.offer(entries)
+            assert future is not None
+            outcomes.append(future.exception(timeout=10))
+    finally:
+        queue.close()
+    return outcomes
+
+
+def entry(message: str) -> Dict[str, Any]:
+    return {"message": message}
+
+
+def test_failed_group_is_kept_and_replayed_on_restart(tmp_path) -> None:
+    first = Commits(fail_first=1)
+    outcomes = run_queue(tmp_path, first, [entry("a1"), entry("a2")], [entry("b")])
+    assert isinstance(outcomes[0], RuntimeError)
+    assert outcomes[1] is None
+    assert first.messages == ["b"]
+    # The later successful group moved the checkpoint past "a"; it survives
+    # in the dead-letter file.
+    assert (tmp_path / ingest_queue.DEAD_LETTER).exists()
+
+    second = Commits()
+    run_queue(tmp_path, second)
+    assert second.messages == ["a1", "a2"]
+    assert not (tmp_path / ingest_queue.DEAD_LETTER).exists()
+
+    third = Commits()
+    run_queue(tmp_path, third)
+    assert third.messages == []
+
+
+def test_entries_not_committed_before_a_crash_are_replayed(tmp_path) -> None:
+    queue = ingest_queue.IngestQueue(Commits(), linger=0, spool_dir=tmp_path)
+    # Spooled but never drained: the thread is not started.
+    queue.spool = ingest_queue.Spool(tmp_path)
+    assert queue.offer([entry("x")]) is not None
+    queue.spool.close()
+
+    replayed = Commits()
+    run_queue(tmp_path, replayed)
+    assert replayed.messages == ["x"]
+
+
+@pytest.mark.parametrize("rows", [1, 5])
+def test_full_queue_rejects(rows: int) -> None:
+    queue = ingest_queue.IngestQueue(Commits(), max_rows=4)
+    assert queue.offer([entry("a")] * rows) is not None
+    assert queue.offer([entry("b")] * 4) is None
+    assert queue.snapshot()["rejected"] == 4
+
+
+class RejectsBad(Commits):
+    def __call__(self, entries: List[Dict[str, Any]]) -> None:
+        if any(e["message"] == "bad" for e in entries):
+            raise RuntimeError("constraint failed")
+        self.batches.append(entries)
+
+
+@pytest.mark.parametrize("spooled", [False, True])
+def test_failed_group_only_fails_the_bad_request(tmp_path, spooled: bool) -> None:
+    commits = RejectsBad()
+    # A long linger and a three-row group: the three requests share one commit.
+    queue = ingest_queue.IngestQueue(commits, group_rows=3, linger=10, spool_dir=tmp_path if spooled else None)
+    queue.start()
+    try:
+        futures = [queue.offer(entries) for entries in ([entry("a")], [entry("bad")], [entry("c")])]
+        outcomes = [f.exception(timeout=10) for f in futures]
+    finally:
+        queue.close()
+    assert outcomes[0] is None and outcomes[2] is None
+    assert isinstance(outcomes[1], RuntimeError)
+    assert commits.messages == ["a", "c"]
+    assert queue.snapshot()["failed"] == 1
+    assert (tmp_path / ingest_queue.DEAD_LETTER).exists() == spooled
+    if spooled:
+        replayed = RejectsBad()
+        run_queue(tmp_path, replayed)
+        assert replayed.messages == []
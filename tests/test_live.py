@@ -0,0 +1,48 @@
+import asyncio
+import json
+from typing import Any, Dict, Iterator
+
+import pytest
+
+import live
+
+
+@pytest.fixture
+def loop() -> Iterator[asyncio.AbstractEventLoop]:
+    event_loop = asyncio.new_event_loop()
+    yield event_loop
+    event_loop.close()
+
+
+def subscription(loop: asyncio.AbstractEventLoop, kinds=live.KINDS, sources=None) -> live.Subscription:
+    return live.Subscription(loop, sources, None, frozenset(kinds), 8)
+
+
+def batch_event() -> live.BatchEvent:
+    event = live.BatchEvent()
+    event.logs["api"].append({"id": 1, "level": "ERROR", "message": "boom"})
+    event.counts["api"]["ERROR"] += 1
+    event.add_metric("api", "latency", 1700000000, 12.5)
+    event.stats = {"total_entries": 42, "entries_per_min": 17, "error_rate": 0.5, "top_sources": []}
+    return event
+
+
+def data_of(text: str) -> Dict[str, Any]:
+    event, data = text.strip().split("\n")
+    assert event == "event: batch"
+    return json.loads(data[len("data: "):])
+
+
+def test_batch_frame_carries_stats(loop: asyncio.AbstractEventLoop) -> None:
+    data = data_of(batch_event().render(subscription(loop)))
+    assert data["stats"]["entries_per_min"] == 17
+    assert data["stats"]["total_entries"] == 42
+    assert data["sources"]["api"]["counts"] == {"ERROR": 1}
+    assert data["sources"]["api"]["metrics"]["latency"] == [[1700000000, 1, 12.5, 12.5, 12.5]]
+
+
+def test_stats_only_sent_to_subscribers_taking_them(loop: asyncio.AbstractEventLoop) -> None:
+    event = batch_event()
+    assert "stats" not in data_of(event.render(subscription(loop, kinds=("logs",))))
+    assert "stats" in data_of(event.render(subscription(loop, kinds=("stats",))))
+    assert event.render(subscription(loop, sources=frozenset({"web"}))) is None
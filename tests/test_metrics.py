@@ -0,0 +1,72 @@
+import json
+import os
+from typing import Any, Dict, Iterator, Set
+
+import pytest
+
+from timestamps import utc_micros
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory: pytest.TempPathFactory) -> Iterator[Any]:
+    workdir = tmp_path_factory.mktemp("metrics")
+    os.environ.setdefault("LOGLENS_DB_PATH", str(workdir / "loglens.db"))
+    os.environ.setdefault("LOGLENS_ARCHIVE_DIR", str(workdir / "archive"))
+    # The fixed dates below must keep their own partitions whenever this runs.
+    os.environ.setdefault("LOGLENS_PARTITION_MAX_AGE_DAYS", "0")
+    import main
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as test_client:
+        lines = [
+            json.dumps({"timestamp": f"2026-10-{day}T{hour:02d}:{minute:02d}:00Z", "latency": hour * 60 + minute})
+            for day in (17, 18)
+            for hour in range(6, 14)
+            for minute in (0, 30)
+        ]
+        # Exactly on a date-only bound.
+        lines.append(json.dumps({"timestamp": "2026-10-18T00:00:00Z", "latency": 0}))
+        response = test_client.post(
+            "/api/ingest", params={"source": "svc", "wait": "true"}, content="\n".join(lines)
+        )
+        assert response.status_code == 200
+        yield test_client
+
+
+def times(client: Any, resolution: str, **params: str) -> Set[int]:
+    query: Dict[str, str] = {"source": "svc", "resolution": resolution, **params}
+    if resolution != "raw":
+        query["step"] = "1"
+    response = client.get("/api/metrics", params=query)
+    assert response.status_code == 200, response.text
+    return {utc_micros(point["t"]) for point in response.json()["metrics"].get("latency", [])}
+
+
+@pytest.mark.parametrize(
+    "bounds",
+    [
+        {"from": "2026-10-18T10:00:00+02:00", "to": "2026-10-18T12:00:00+02:00"},
+        {"from": "2026-10-18T08:00:00Z", "to": "2026-10-18T10:00:00Z"},
+        {"from": "2026-10-17T12:30:00", "to": "2026-10-18"},
+        {"to": "2026-10-18"},
+        {"from": "2026-10-18T11:59:59.5-01:00"},
+    ],
+)
+def test_rollup_and_raw_paths_select_the_same_range(client: Any, bounds: Dict[str, str]) -> None:
+    raw = times(client, "raw", **bounds)
+    assert raw
+    assert times(client, "1s", **bounds) == raw
+    assert times(client, "auto", **bounds) == raw
+
+
+def test_offset_bounds_are_converted_to_utc(client: Any) -> None:
+    got = times(client, "auto", **{"from": "2026-10-18T10:00:00+02:00", "to": "2026-10-18T12:00:00+02:00"})
+    assert min(got) == utc_micros("2026-10-18T08:00:00Z")
+    assert max(got) == utc_micros("2026-10-18T10:00:00Z")
+
+
+@pytest.mark.parametrize("resolution", ["raw", "auto", "1m"])
+@pytest.mark.parametrize("name", ["from", "to"])
+def test_invalid_bounds_are_rejected_on_every_path(client: Any, resolution: str, name: str) -> None:
+    response = client.get("/api/metrics", params={"resolution": resolution, name: "garbage"})
+    assert response.status_code == 400
@@ -0,0 +1,256 @@
+import json
+import socket
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+import pytest
+
+import alerts
+import notify
+
+
+class StubWebhook:
+    """Local HTTP/1.1 server answering webhook POSTs with scripted statuses."""
+
+    def __init__(self, statuses: Sequence[int] = (), default: int = 200) -> None:
+        self.statuses = list(statuses)
+        self.default = default
+        self.requests: List[Tuple[int, float, Dict[str, Any]]] = []
+        self.connections = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self) -> None:
+                super().setup()
+                stub.connections += 1
+
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.gate.wait(10)
+                stub.requests.append((self.client_address[1], time.monotonic(), body))
+                status = stub.statuses.pop(0) if stub.statuses else stub.default
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StubSMTP:
+    """Socket-level SMTP server that accepts every message."""
+
+    def __init__(self) -> None:
+        self.connections = 0
+        self.messages: List[Tuple[str, str]] = []
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._session, args=(conn,), daemon=True).start()
+
+    def _session(self, conn: socket.socket) -> None:
+        with conn, conn.makefile("rb") as rfile:
+            conn.sendall(b"220 stub ESMTP\r\n")
+            recipient = ""
+            for raw in rfile:
+                line = raw.decode().rstrip("\r\n")
+                verb = line.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    conn.sendall(b"250-stub\r\n250 8BITMIME\r\n")
+                elif verb == "RCPT":
+                    recipient = line.split(":", 1)[1].strip(" <>")
+                    conn.sendall(b"250 OK\r\n")
+                elif verb == "DATA":
+                    conn.sendall(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    data = []
+                    for raw_data in rfile:
+                        if raw_data in (b".\r\n", b".\n"):
+                            break
+                        data.append(raw_data.decode())
+                    self.messages.append((recipient, "".join(data)))
+                    conn.sendall(b"250 OK queued\r\n")
+                elif verb == "QUIT":
+                    conn.sendall(b"221 Bye\r\n")
+                    return
+                else:
+                    conn.sendall(b"250 OK\r\n")
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class Results:
+    def __init__(self) -> None:
+        self.calls: List[Tuple[List[int], bool]] = []
+        self.event = threading.Event()
+
+    def __call__(self, history_ids: List[int], delivered: bool) -> None:
+        self.calls.append((list(history_ids), delivered))
+        self.event.set()
+
+
+def wait_for(predicate, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def webhook() -> Iterator[StubWebhook]:
+    stub = StubWebhook()
+    yield stub
+    stub.close()
+
+
+def make_notifier(**kwargs: Any) -> notify.Notifier:
+    kwargs.setdefault("workers", 1)
+    kwargs.setdefault("backoff", 0.05)
+    return notify.Notifier(**kwargs)
+
+
+def test_webhooks_reuse_keep_alive_connection(webhook: StubWebhook) -> None:
+    results = Results()
+    notifier = make_notifier(on_result=results)
+    notifier.start()
+    try:
+        for i in range(3):
+            notifier.submit("webhook", webhook.url, {"metric_name": "latency", "n": i}, i)
+            wait_for(lambda: len(results.calls) == i + 1)
+    finally:
+        notifier.close()
+    assert [body["n"] for _, _, body in webhook.requests] == [0, 1, 2]
+    assert webhook.connections == 1
+    assert len({port for port, _, _ in webhook.requests}) == 1
+    assert results.calls == [([0], True), ([1], True), ([2], True)]
+
+
+def test_webhook_retries_with_backoff() -> None:
+    stub = StubWebhook(statuses=[500, 503])
+    results = Results()
+    notifier = make_notifier(backoff=0.1, on_result=results)
+    notifier.start()
+    try:
+        notifier.submit("webhook", stub.url, {"metric_name": "errors"}, 7)
+        assert results.event.wait(10)
+    finally:
+        notifier.close()
+        stub.close()
+    times = [t for _, t, _ in stub.requests]
+    assert len(times) == 3
+    assert times[1] - times[0] >= 0.1
+    assert times[2] - times[1] >= 0.2
+    assert results.calls == [([7], True)]
+
+
+def test_webhook_gives_up_after_max_attempts() -> None:
+    stub = StubWebhook(default=500)
+    results = Results()
+    notifier = make_notifier(max_attempts=2, on_result=results)
+    notifier.start()
+    try:
+        notifier.submit("webhook", stub.url, {"metric_name": "errors"}, 3)
+        assert results.event.wait(10)
+    finally:
+        notifier.close()
+        stub.close()
+    assert len(stub.requests) == 2
+    assert results.calls == [([3], False)]
+
+
+def test_repeated_alerts_to_one_target_are_coalesced(webhook: StubWebhook) -> None:
+    results = Results()
+    notifier = make_notifier(on_result=results)
+    other = webhook.url + "?other=1"
+    for i in range(3):
+        assert notifier.submit("webhook", webhook.url, {"metric_name": "latency", "n": i}, i)
+    notifier.submit("webhook", other, {"metric_name": "latency", "n": 9}, 9)
+    assert notifier.pending() == 2
+    notifier.start()
+    try:
+        wait_for(lambda: len(results.calls) == 2)
+    finally:
+        notifier.close()
+    bodies = sorted((body for _, _, body in webhook.requests), key=lambda b: b["n"])
+    assert len(bodies) == 2
+    assert bodies[0]["n"] == 2
+    assert [p["n"] for p in bodies[0]["coalesced"]] == [0, 1]
+    assert "coalesced" not in bodies[1]
+    assert sorted(results.calls) == [([0, 1, 2], True), ([9], True)]
+
+
+def test_emails_share_one_smtp_session() -> None:
+    smtp = StubSMTP()
+    results = Results()
+    notifier = make_notifier(smtp_host="127.0.0.1", smtp_port=smtp.port, on_result=results)
+    notifier.start()
+    try:
+        notifier.submit("email", "ops@example.com", {"metric_name": "latency"}, 1)
+        wait_for(lambda: len(results.calls) == 1)
+        notifier.submit("email", "dev@example.com", {"metric_name": "errors"}, 2)
+        wait_for(lambda: len(results.calls) == 2)
+    finally:
+        notifier.close()
+        smtp.close()
+    assert smtp.connections == 1
+    assert [rcpt for rcpt, _ in smtp.messages] == ["ops@example.com", "dev@example.com"]
+    assert "Subject: LogLens Alert Triggered: latency" in smtp.messages[0][1]
+    assert results.calls == [([1], True), ([2], True)]
+
+
+def test_alert_history_marked_notified_after_delivery(tmp_path, webhook: StubWebhook) -> None:
+    path = tmp_path / "alerts.db"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE alert_history (id INTEGER PRIMARY KEY AUTOINCREMENT, rule_id INTEGER, "
+        "triggered_at TEXT, metric_value REAL, notified INTEGER DEFAULT 0)"
+    )
+
+    def mark(history_ids: List[int], delivered: bool) -> None:
+        if delivered:
+            writer = sqlite3.connect(path)
+            alerts.mark_notified(writer, history_ids)
+            writer.close()
+
+    def notified() -> List[int]:
+        return [row[0] for row in conn.execute("SELECT notified FROM alert_history ORDER BY id")]
+
+    rule = alerts.Rule(1, "latency", "gt", 100.0, 60, webhook.url, None, "avg", None)
+    notifier = make_notifier(on_result=mark)
+    notifier.start()
+    webhook.gate.clear()
+    try:
+        recorded = alerts.record_alerts(conn, [(rule, 250.0)], notifier)
+        # Recorded before delivery finishes, and not blocked by it.
+        assert notified() == [0]
+        webhook.gate.set()
+        wait_for(lambda: notified() == [1])
+    finally:
+        notifier.close()
+        conn.close()
+    assert webhook.requests[0][2]["history_id"] == recorded[0]["history_id"]
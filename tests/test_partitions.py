@@ -0,0 +1,33 @@
+from datetime import date
+
+import pytest
+
+import partitions
+from timestamps import utc_micros
+
+WINDOW = partitions.day_window(date(2026, 10, 18), 30, 1)
+
+
+@pytest.mark.parametrize(
+    "ts, day",
+    [
+        ("2026-10-18T12:00:00Z", "2026-10-18"),
+        # The UTC day, not the date as written.
+        ("2026-10-18T00:30:00+02:00", "2026-10-17"),
+        ("2026-10-18T22:00:00-05:00", "2026-10-19"),
+        ("2026-09-18T00:00:00Z", "2026-09-18"),
+    ],
+)
+def test_day_of_is_the_utc_day(ts: str, day: str) -> None:
+    assert partitions.day_of(utc_micros(ts), "default", WINDOW) == day
+
+
+@pytest.mark.parametrize("ts", ["2026-09-17T23:59:59Z", "2026-10-20T00:00:00Z", "1970-01-01T00:00:00Z", "9999-12-31"])
+def test_days_outside_the_window_use_the_default(ts: str) -> None:
+    assert partitions.day_of(utc_micros(ts), "default", WINDOW) == "default"
+
+
+def test_no_lower_bound_without_max_age() -> None:
+    window = partitions.day_window(date(2026, 10, 18), 0, 1)
+    assert partitions.day_of(utc_micros("1999-01-01T00:00:00Z"), "default", window) == "1999-01-01"
+    assert partitions.day_of(utc_micros("2026-10-20T00:00:00Z"), "default", window) == "default"
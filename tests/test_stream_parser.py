@@ -0,0 +1,68 @@
+import json
+from typing import Any, Dict, List
+
+import pytest
+
+import detector
+
+
+def streamed(text: str, source: str, chunk: int = 997, detect_bytes: int = 2048, **kwargs: Any) -> List[Dict[str, Any]]:
+    parser = detector.StreamParser(source=source, detect_bytes=detect_bytes, **kwargs)
+    out: List[Dict[str, Any]] = []
+    for start in range(0, len(text), chunk):
+        out.extend(parser.feed(text[start:start + chunk]))
+    out.extend(parser.close())
+    return out
+
+
+def comparable(entries: List[Dict[str, Any]]) -> List[tuple]:
+    return [(e["level"], e["message"], e.get("format_detected"), e.get("timestamp")) for e in entries]
+
+
+ACCESS = '10.0.0.{i} - - [18/Oct/2026:10:00:{s:02d} +0000] "GET /p/{i} HTTP/1.1" 200 {i} "-" "curl"'
+BODIES = {
+    "access_log": "\n".join(ACCESS.format(i=i, s=i % 60) for i in range(400)),
+    "jsonl": "\n".join(json.dumps({"timestamp": "2026-10-18T10:00:00Z", "msg": f"m{i}", "n": i}) for i in range(400)),
+    "csv": "time,level,message\n" + "\n".join(f"2026-10-18T10:00:{i % 60:02d}Z,INFO,row {i}" for i in range(400)),
+    "syslog": "\n".join(f"Oct 18 10:00:{i % 60:02d} host app[{i}]: event {i}" for i in range(400)),
+    "json_array": json.dumps([{"timestamp": "2026-10-18T10:00:00Z", "msg": f"m{i}"} for i in range(400)]),
+    "mixed": "\n".join(ACCESS.format(i=i, s=0) if i % 3 else f"2026-10-18T10:00:00Z garbage {i}" for i in range(400)),
+}
+
+
+@pytest.mark.parametrize("name", sorted(BODIES))
+@pytest.mark.parametrize("detect_bytes", [2048, 1 << 20])
+def test_streamed_bodies_parse_like_whole_ones(name: str, detect_bytes: int) -> None:
+    text = BODIES[name]
+    whole = detector.detect_and_parse(text, source=f"whole-{name}-{detect_bytes}")
+    parts = streamed(text, source=f"stream-{name}-{detect_bytes}", detect_bytes=detect_bytes)
+    assert comparable(parts) == comparable(whole)
+    assert detector.cached_format(f"stream-{name}-{detect_bytes}") == detector.cached_format(
+        f"whole-{name}-{detect_bytes}"
+    )
+
+
+def test_stream_uses_the_sources_cached_format() -> None:
+    detector.detect_and_parse(BODIES["access_log"], source="cached")
+    assert detector.cached_format("cached") == "access_log"
+    parser = detector.StreamParser(source="cached", detect_bytes=512)
+    parser.feed(BODIES["access_log"][:4096])
+    assert parser.format == "access_log"
+
+
+def test_malformed_array_element_stops_buffering() -> None:
+    good = ",".join(json.dumps({"msg": f"m{i}"}) for i in range(50))
+    rest = "\n".join(f"line {i}" for i in range(2000))
+    text = "[" + good + ", {bad json\n" + rest
+    parser = detector.StreamParser(source="broken", detect_bytes=256, max_element_bytes=4096)
+    out: List[Dict[str, Any]] = []
+    peak = 0
+    for start in range(0, len(text), 1000):
+        out.extend(parser.feed(text[start:start + 1000]))
+        peak = max(peak, len(parser._json_buf))
+    out.extend(parser.close())
+    assert peak <= 4096 + 1000
+    assert parser.format == "plain"
+    assert [e["message"] for e in out[:50]] == [f"m{i}" for i in range(50)]
+    assert out[-1]["message"] == "line 1999"
+    assert len(out) == 50 + 1 + 2000
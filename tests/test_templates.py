@@ -0,0 +1,35 @@
+import sqlite3
+
+import templates
+
+
+def test_paths_share_one_template() -> None:
+    miner = templates.TemplateMiner()
+    paths = ["alice", "bob", "carol", "dave", "eve", "fred", "gina"]
+    ids, rows = miner.mine([f"GET /api/user/{name}/profile took 12ms" for name in paths])
+    assert len(set(ids)) == 1
+    assert [row[1] for row in rows] == ["GET <*> took <*>"]
+
+
+def test_path_values_keep_their_key() -> None:
+    miner = templates.TemplateMiner()
+    ids, rows = miner.mine(["fetch url=http://a/x done", "fetch url=https://b/y/z done", "open /etc/a.conf"])
+    assert ids[0] == ids[1] != ids[2]
+    assert sorted(row[1] for row in rows) == ["fetch url=<*> done", "open <*>"]
+
+
+def test_backfill_only_mines_the_given_formats() -> None:
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(templates.SCHEMA_SQL)
+    conn.execute("CREATE TABLE strings (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)")
+    conn.executemany("INSERT INTO strings (id, value) VALUES (?, ?)", [(1, "plain"), (2, "access_log")])
+    conn.execute("CREATE TABLE log_entries (id INTEGER PRIMARY KEY, message TEXT, format_id INTEGER, template_id INTEGER)")
+    conn.executemany(
+        "INSERT INTO log_entries (id, message, format_id) VALUES (?, ?, ?)",
+        [(1, "worker started", 1), (2, "GET /a -> 200", 2), (3, "worker started", 1)],
+    )
+    conn.execute("CREATE TABLE partitions (day TEXT PRIMARY KEY)")
+    assert templates.backfill(conn, templates.TemplateMiner(), ("plain", "syslog")) == 2
+    assigned = dict(conn.execute("SELECT id, template_id FROM log_entries"))
+    assert assigned[1] == assigned[3] is not None
+    assert assigned[2] is None
@@ -0,0 +1,236 @@
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+STRPTIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%b %d %H:%M:%S",
+    "%d/%b/%Y:%H:%M:%S %z",
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%d %H:%M:%S%z",
+]
+
+ISO_FAST_RE = re.compile(
+    r"(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2})(?:\.(\d{1,6}))?(Z|[+-]\d{2}:?[0-5]\d)?$"
+)
+CLF_FAST_RE = re.compile(r"(\d{2})/([A-Z][a-z]{2})/(\d{4}):(\d{2}):(\d{2}):(\d{2}) ([+-]\d{2}[0-5]\d)$")
+MONTHS = {m: i for i, m in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], 1
+)}
+
+Parser = Callable[[str], Optional[datetime]]
+
+# (source, format_detected) -> index of the parser that last succeeded for it.
+# Sources are client-supplied, so the oldest keys are dropped past the cap.
+WINNERS_CACHE_SIZE = 4096
+_WINNERS: Dict[Hashable, int] = {}
+_batch = threading.local()
+
+
+@lru_cache(maxsize=4096)
+def _iso_seconds(prefix: str) -> Optional[datetime]:
+    try:
+        return datetime(
+            int(prefix[0:4]), int(prefix[5:7]), int(prefix[8:10]),
+            int(prefix[11:13]), int(prefix[14:16]), int(prefix[17:19]),
+        )
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=256)
+def _offset(value: str) -> Optional[timezone]:
+    if value == "Z":
+        return timezone.utc
+    digits = value[1:].replace(":", "")
+    delta = timedelta(hours=int(digits[:2]), minutes=int(digits[2:4]))
+    try:
+        return timezone(-delta if value[0] == "-" else delta)
+    except ValueError:
+        return None
+
+
+def _parse_iso(val: str) -> Optional[datetime]:
+    m = ISO_FAST_RE.match(val)
+    if not m:
+        return None
+    base = _iso_seconds(m.group(1))
+    # Year 1900 is special-cased by the strptime path; leave it to that path.
+    if base is None or base.year == 1900:
+        return None
+    frac, tz = m.group(2), m.group(3)
+    if frac:
+        base = base.replace(microsecond=int(frac.ljust(6, "0")))
+    if tz:
+        offset = _offset(tz)
+        if offset is None:
+            return None
+        base = base.replace(tzinfo=offset)
+    return base
+
+
+@lru_cache(maxsize=4096)
+def _parse_clf(val: str) -> Optional[datetime]:
+    m = CLF_FAST_RE.match(val)
+    if not m or m.group(2) not in MONTHS:
+        return None
+    day, month, year, hour, minute, second, tz = m.groups()
+    offset = _offset(tz)
+    if year == "1900" or offset is None:
+        return None
+    try:
+        return datetime(
+            int(year), MONTHS[month], int(day), int(hour), int(minute), int(second), tzinfo=offset
+        )
+    except ValueError:
+        return None
+
+
+def _strptime_parser(fmt: str) -> Parser:
+    def parse(val: str) -> Optional[datetime]:
+        try:
+            return datetime.strptime(val, fmt)
+        except ValueError:
+            return None
+    # Second-resolution formats repeat across consecutive lines.
+    return parse if "%f" in fmt else lru_cache(maxsize=4096)(parse)
+
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_SECOND = timedelta(seconds=1)
+
+
+def epoch_second(value: str) -> Optional[int]:
+    """Whole UTC-naive epoch seconds of a stored ISO timestamp.
+
+    Any offset suffix is ignored, matching how stored timestamps compare as
+    strings.
+    """
+    base = _iso_seconds(value[:19])
+    if base is None:
+        return None
+    return int((base - _EPOCH).total_seconds())
+
+
+@lru_cache(maxsize=4096)
+def _epoch_of_prefix(prefix: str) -> Optional[int]:
+    base = _iso_seconds(prefix)
+    return None if base is None else (base - _EPOCH) // _SECOND
+
+
+@lru_cache(maxsize=256)
+def _offset_seconds(value: str) -> Optional[int]:
+    offset = _offset(value)
+    return None if offset is None else offset.utcoffset(None) // _SECOND
+
+
+def utc_micros(value: str) -> Optional[int]:
+    """UTC epoch microseconds of an ISO timestamp or date; naive values are UTC."""
+    m = ISO_FAST_RE.match(value)
+    if m:
+        seconds = _epoch_of_prefix(m.group(1))
+        frac, tz = m.group(2), m.group(3)
+        shift = _offset_seconds(tz) if tz else 0
+        if seconds is not None and shift is not None:
+            return (seconds - shift) * 1_000_000 + (int(frac.ljust(6, "0")) if frac else 0)
+    dt = _parse_fromisoformat(value)
+    if dt is None:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+@lru_cache(maxsize=4096)
+def iso_second(seconds: int) -> str:
+    """Naive UTC ISO string of whole epoch seconds."""
+    return (_EPOCH + timedelta(seconds=seconds)).isoformat()
+
+
+def iso_micros(micros: int) -> str:
+    """The naive ISO string of epoch microseconds, as datetime.isoformat() writes it."""
+    return (_EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+def _parse_fromisoformat(val: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(val.replace("Z", "+00:00"))
+    except Exception:
+        return None
+
+
+# Fast parsers first: they only accept inputs the strptime formats would parse
+# to the same value, so their position does not change any result.
+PARSERS: List[Parser] = [_parse_iso, _parse_clf] + [_strptime_parser(f) for f in STRPTIME_FORMATS]
+FALLBACK = _parse_fromisoformat
+
+
+def _now() -> datetime:
+    current = getattr(_batch, "now", None)
+    if current is None:
+        current = datetime.utcnow()
+        if getattr(_batch, "depth", 0):
+            _batch.now = current
+    return current
+
+
+@contextmanager
+def batch() -> Iterator[None]:
+    """Share one utcnow() reading across every timestamp normalized inside."""
+    depth = getattr(_batch, "depth", 0)
+    _batch.depth = depth + 1
+    try:
+        yield
+    finally:
+        _batch.depth = depth
+        if not depth:
+            _batch.now = None
+
+
+def _remember_winner(key: Hashable, index: int) -> None:
+    if key not in _WINNERS and len(_WINNERS) >= WINNERS_CACHE_SIZE:
+        _WINNERS.pop(next(iter(_WINNERS)), None)
+    _WINNERS[key] = index
+
+
+def _parse(val: str, key: Optional[Hashable]) -> Tuple[Optional[datetime], bool]:
+    winner = _WINNERS.get(key) if key is not None else None
+    if winner is not None:
+        dt = PARSERS[winner](val)
+        if dt is not None:
+            return dt, True
+    for i, parser in enumerate(PARSERS):
+        if i == winner:
+            continue
+        dt = parser(val)
+        if dt is not None:
+            if key is not None:
+                _remember_winner(key, i)
+            return dt, True
+    return FALLBACK(val), False
+
+
+def normalize(value: Optional[str], key: Optional[Hashable] = None) -> str:
+    """Normalize a timestamp string to ISO-8601.
+
+    ``key`` (typically ``(source, format_detected)``) lets the engine try the
+    format that matched last time for that key before the others.
+    """
+    if not value:
+        return _now().isoformat()
+    val = value.strip()
+    if not val:
+        return _now().isoformat()
+    dt, from_format = _parse(val, key)
+    if dt is None:
+        return _now().isoformat()
+    if from_format and dt.year == 1900:
+        dt = dt.replace(year=_now().year)
+    return dt.isoformat()